@@ -85,10 +85,14 @@ WSGI_APPLICATION = 'config.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
+# Persistent connections stay off: under ASGI every request runs its queries in its own
+# thread, so connections kept open there are never reused or closed and just pile up.
+# Use a pooler (e.g. PgBouncer) in front of the database instead. DB_CONN_MAX_AGE is only
+# for WSGI deployments or the worker/mailer commands.
 DATABASES = {
     'default': dj_database_url.config(
         default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}",
-        conn_max_age=600
+        conn_max_age=int(os.environ.get('DB_CONN_MAX_AGE', 0)),
     )
 }
 
@@ -176,3 +180,137 @@ DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'noreply@superpower.ap
 EMAIL_TIMEOUT = 10  # Timeout in seconds to prevent worker hanging
 
 SITE_ID = 1
+
+# Profile Analysis Job Queue (see core/jobs.py and `manage.py run_analysis_worker`)
+ANALYSIS_WORKER_CONCURRENCY = int(os.environ.get('ANALYSIS_WORKER_CONCURRENCY', 2))  # Gemini calls in flight per node
+ANALYSIS_JOB_TIMEOUT = int(os.environ.get('ANALYSIS_JOB_TIMEOUT', 180))  # Seconds before a generation is abandoned
+ANALYSIS_JOB_MAX_ATTEMPTS = int(os.environ.get('ANALYSIS_JOB_MAX_ATTEMPTS', 3))
+ANALYSIS_JOB_RETRY_BACKOFF = int(os.environ.get('ANALYSIS_JOB_RETRY_BACKOFF', 15))  # Seconds, doubled per attempt
+ANALYSIS_CLAIM_TTL = int(os.environ.get('ANALYSIS_CLAIM_TTL', 1800))  # Seconds before an unfinished job stops blocking new runs
+ANALYSIS_FLUSH_CHUNKS = int(os.environ.get('ANALYSIS_FLUSH_CHUNKS', 8))  # Streamed chunks between partial-output writes
+ANALYSIS_FLUSH_INTERVAL_MS = int(os.environ.get('ANALYSIS_FLUSH_INTERVAL_MS', 1500))  # ...or this long, whichever comes first
+
+# Map-reduce analysis for large profiles (see core/analysis.py)
+ANALYSIS_MAP_REDUCE_THRESHOLD = int(os.environ.get('ANALYSIS_MAP_REDUCE_THRESHOLD', 25))  # Completed surveys before summarising
+ANALYSIS_REDUCE_BATCH_SIZE = int(os.environ.get('ANALYSIS_REDUCE_BATCH_SIZE', 20))  # Summaries condensed per reduce call
+ANALYSIS_MAP_CONCURRENCY = int(os.environ.get('ANALYSIS_MAP_CONCURRENCY', 4))  # Parallel map calls within one job
+
+# Gemini / LLM Client (see core/llm.py)
+GEMINI_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-2.5-flash')
+LLM_BACKEND = os.environ.get('LLM_BACKEND', 'gemini')  # 'gemini', 'fake' or a dotted path to a backend class
+LLM_TIMEOUT = int(os.environ.get('LLM_TIMEOUT', 60))  # Seconds per request
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', 3))  # Retries on 429/5xx
+LLM_RETRY_BACKOFF = float(os.environ.get('LLM_RETRY_BACKOFF', 1.0))  # Seconds, doubled per retry
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 8))  # Concurrent calls per process
+LLM_GLOBAL_MAX_IN_FLIGHT = int(os.environ.get('LLM_GLOBAL_MAX_IN_FLIGHT', 16))  # Web LLM calls across all processes; more get a 429
+LLM_SLOT_TIMEOUT = int(os.environ.get('LLM_SLOT_TIMEOUT', 300))  # Seconds before a slot held by a crashed process frees itself
+LLM_BUSY_RETRY_AFTER = int(os.environ.get('LLM_BUSY_RETRY_AFTER', 5))  # Retry-After sent when every slot is taken
+
+# Prompt Token Budgets (see core/prompts.py)
+LLM_CHARS_PER_TOKEN = int(os.environ.get('LLM_CHARS_PER_TOKEN', 4))  # Offline estimate, English prose
+LLM_ANALYSIS_TOKEN_BUDGET = int(os.environ.get('LLM_ANALYSIS_TOKEN_BUDGET', 200000))
+LLM_CHAT_TOKEN_BUDGET = int(os.environ.get('LLM_CHAT_TOKEN_BUDGET', 32000))  # Smaller: chat is interactive
+
+# Coach Chat Memory (see core/chat.py)
+CHAT_RECENT_MESSAGES = int(os.environ.get('CHAT_RECENT_MESSAGES', 8))  # Sent verbatim each turn
+CHAT_COMPACT_AFTER = int(os.environ.get('CHAT_COMPACT_AFTER', 6))  # Extra messages before older ones are summarised
+CHAT_SESSION_IDLE_TIMEOUT = int(os.environ.get('CHAT_SESSION_IDLE_TIMEOUT', 60 * 60 * 12))  # Seconds before a new conversation starts
+CHAT_RETRIEVAL_TOP_K = int(os.environ.get('CHAT_RETRIEVAL_TOP_K', 8))  # Survey answers sent with each question
+CHAT_INDEX_CACHE_TIMEOUT = int(os.environ.get('CHAT_INDEX_CACHE_TIMEOUT', 60 * 60 * 24))  # Compiled per-user retrieval index
+LLM_CONTEXT_CACHE_TTL = int(os.environ.get('LLM_CONTEXT_CACHE_TTL', 60 * 60))  # Gemini context caching, 0 = off
+LLM_CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get('LLM_CONTEXT_CACHE_MIN_TOKENS', 4096))  # Smaller system prompts are sent inline
+
+# Generation Cache (see core/generation_cache.py)
+GENERATION_CACHE_MAX_ENTRIES = int(os.environ.get('GENERATION_CACHE_MAX_ENTRIES', 2000))
+GENERATION_CACHE_TTL = int(os.environ.get('GENERATION_CACHE_TTL', 60 * 60 * 24 * 30))  # Seconds, 0 = never expire
+
+# Email Outbox (see core/outbox.py and `manage.py send_outbox`)
+EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', 50))  # Emails per SMTP connection
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 5))
+EMAIL_OUTBOX_LOCK_TIMEOUT = int(os.environ.get('EMAIL_OUTBOX_LOCK_TIMEOUT', 300))  # Seconds before a stuck batch is retried
+EMAIL_DOMAIN_RATE_LIMIT = int(os.environ.get('EMAIL_DOMAIN_RATE_LIMIT', 60))  # Per recipient domain per minute, 0 = off
+
+# Cache: Redis if REDIS_URL is set, else the database (`manage.py createcachetable`).
+# Either way it is shared by every web, worker and mailer process, so fragment version
+# tokens bumped by one of them (see core/fragment_cache.py) are seen by all the others.
+# 'ratelimit' holds rate-limit buckets and LLM slots, which need an atomic add() across
+# processes; it is never a per-host file cache.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+        'ratelimit': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'core_cache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        },
+        'ratelimit': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'core_ratelimit_cache',
+            'OPTIONS': {'MAX_ENTRIES': 100000},  # Culling live buckets would reset them
+        },
+    }
+FRAGMENT_CACHE_TIMEOUT = int(os.environ.get('FRAGMENT_CACHE_TIMEOUT', 60 * 60 * 24))  # Seconds; signals invalidate earlier
+
+# Dashboard
+DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE', 24))  # Invitation cards per page / scroll step
+
+# Recurring themes (see core/themes.py)
+THEMES_PER_QUESTION = int(os.environ.get('THEMES_PER_QUESTION', 4))  # Most themes found per survey question
+THEMES_MIN_ANSWERS = int(os.environ.get('THEMES_MIN_ANSWERS', 4))  # Fewer answers than this: nothing to compare
+THEMES_MAX_TERMS = int(os.environ.get('THEMES_MAX_TERMS', 500))  # Vocabulary kept per question
+THEMES_LABEL_TERMS = int(os.environ.get('THEMES_LABEL_TERMS', 3))  # Terms shown per theme
+THEMES_QUOTE_CHARS = int(os.environ.get('THEMES_QUOTE_CHARS', 160))  # Representative answer length in prompts
+THEMES_CACHE_TIMEOUT = int(os.environ.get('THEMES_CACHE_TIMEOUT', 60 * 60 * 24))
+
+# Stats Page
+STATS_DAILY_DAYS = int(os.environ.get('STATS_DAILY_DAYS', 30))  # Days shown in the feedback time series
+STATS_RECENT_FEEDBACK = int(os.environ.get('STATS_RECENT_FEEDBACK', 50))  # Comments listed on the page
+FEEDBACK_PAGE_SIZE = int(os.environ.get('FEEDBACK_PAGE_SIZE', 100))  # Rows per feedback API page
+FEEDBACK_PAGE_SIZE_MAX = int(os.environ.get('FEEDBACK_PAGE_SIZE_MAX', 1000))  # Largest ?size= accepted
+FEEDBACK_EXPORT_BATCH = int(os.environ.get('FEEDBACK_EXPORT_BATCH', 500))  # Rows per query while streaming the export
+
+# Rate limiting (see core/ratelimit.py): token buckets in the 'ratelimit' cache
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'True') == 'True'
+RATE_LIMIT_PROXY_COUNT = int(os.environ.get('RATE_LIMIT_PROXY_COUNT', 0))  # Trusted proxies adding X-Forwarded-For (1 behind a platform router)
+RATE_LIMITS = {
+    # '<endpoint>:<scope>': (burst, seconds to refill the whole burst)
+    'public_signup:ip': (5, 600),
+    'public_signup:link': (60, 3600),
+    'survey_feedback:ip': (30, 60),
+    'survey_feedback:survey': (10, 60),
+    'alternative_question:ip': (20, 60),
+    'alternative_question:survey': (10, 60),
+    'chat:user': (20, 60),
+    'profile_analysis:user': (5, 600),
+}
+
+# Bulk Invites
+BULK_INVITE_MAX = int(os.environ.get('BULK_INVITE_MAX', 500))  # Invitations per request
+
+# Logging: prompt sizes and LLM call latency are logged by core.prompts / core.llm
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '{levelname} {name} {message}', 'style': '{'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'core': {
+            'handlers': ['console'],
+            'level': os.environ.get('CORE_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
@@ -1,5 +1,24 @@
 from django.contrib import admin
-from .models import Survey, Profile
+from .models import Survey, Profile, AnalysisJob, OutboundEmail, AlternativeQuestion
 
 admin.site.register(Survey)
-admin.site.register(Profile)
\ No newline at end of file
+admin.site.register(Profile)
+
+
+@admin.register(AnalysisJob)
+class AnalysisJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'profile', 'status', 'attempts', 'run_after', 'locked_by', 'created_at')
+    list_filter = ('status',)
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('id', 'to_email', 'subject', 'status', 'attempts', 'send_after', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to_email',)
+
+
+@admin.register(AlternativeQuestion)
+class AlternativeQuestionAdmin(admin.ModelAdmin):
+    list_display = ('question_type', 'relationship', 'text', 'served_count')
+    list_filter = ('question_type', 'relationship')
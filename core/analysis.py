@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import llm
+from .generation_cache import cache_key, get_cached_generation, store_generation
+from .models import Profile, Survey, SurveySummary
+from .prompts import PromptBuilder
+from .themes import themes_summary
+
+# Profile analysis prompt and the map-reduce pipeline behind it.
+# Small profiles send every answer straight to the final "User Manual" synthesis. Past
+# ANALYSIS_MAP_REDUCE_THRESHOLD completed surveys, each survey is first summarised once
+# (map, stored as SurveySummary), the summaries are condensed in fixed-size groups
+# (reduce, cached by prompt) and only the result goes into the final prompt. A new
+# survey then costs one map call plus re-condensing the last group.
+
+
+def analysis_prompt(text_data):
+    return f"""
+    Role: You are an expert developmental psychologist and executive coach, fluent in the Enneagram, Internal Family Systems (IFS), The 6 Types of Working Genius, and Vertical Leadership Development.
+    
+    Input Data: You will receive 360-feedback from peers AND the user's own "10-Year Vision" from their onboarding.
+    
+    FEEDBACK DATA:
+    {text_data}
+    
+    Objective: Synthesize the inputs into a high-impact "User Manual" for the subject. Do not summarize; interpret the data to reveal their operating system. Use "Radical Candor"—be direct, kind, and psychologically deep.
+    
+    Output Format:
+    
+    Return pure HTML code (no markdown backticks, no markdown syntax like **, #). structure it as follows:
+
+    <div class="report-section">
+        <h3>Section 1: Who You Are (The Operating System)</h3>
+        <p><strong>Core Motivation:</strong> [Enneagram Insight]</p>
+        <p><strong>Zone of Genius:</strong> [Working Genius Insight]</p>
+    </div>
+
+    <div class="report-section">
+        <h3>Section 2: The Gap (Intent vs. Impact)</h3>
+        <p><strong>The Protectors (IFS):</strong></p>
+        <ul>
+            <li>[Character Name]: [Description of behavior and cost]</li>
+        </ul>
+        <p><strong>The Blind Spot:</strong> [Vertical Development Insight]</p>
+    </div>
+
+    <div class="report-section">
+        <h3>Section 3: The North Star</h3>
+        <p>[Comparison of Self-Report vs Peer Feedback]</p>
+        <p><strong>Vision of Maturity:</strong> [Description of them at Self-Transforming level]</p>
+    </div>
+
+    <div class="report-section">
+        <h3>Section 4: The Manual (The Path Forward)</h3>
+        <p><strong>The Daily Practice:</strong> [Specific Micro-habit]</p>
+        
+        <p><strong>The Media Stack:</strong></p>
+        <ul>
+            <li><strong>Read:</strong> [Book Title] - [Why]</li>
+            <li><strong>Watch:</strong> [Movie/Show] - [Why]</li>
+            <li><strong>Listen:</strong> [Podcast Episode] - [Why]</li>
+        </ul>
+
+        <p><strong>The Experience:</strong></p>
+        <ul>
+            <li>[Activity Recommendation]</li>
+        </ul>
+    </div>
+    """
+
+
+def add_themes(builder, profile):
+    # Counts of what respondents agree on, on top of the answers or notes. Optional and
+    # below every survey, so a tight budget drops the themes before any respondent's detail.
+    summary = themes_summary(profile)
+    if summary:
+        builder.add('themes', 'RECURRING THEMES ACROSS RESPONDENTS', summary + "\n", priority=-1)
+
+
+def build_analysis_prompt(profile):
+    builder = PromptBuilder('analysis', settings.LLM_ANALYSIS_TOKEN_BUDGET)
+    builder.add_feedback_context(profile.context_sections())
+    add_themes(builder, profile)
+    return builder.build(analysis_prompt)
+
+
+def survey_summary_prompt(survey):
+    section = Profile.survey_context_section(survey)
+    return f"""
+    Role: You are preparing 360-feedback for an executive coach.
+
+    Below is ONE anonymous respondent's answers about the subject.
+    Relationship to the subject: {survey.get_relationship_type_display() or 'Unknown'}
+    {section['body']}
+    Task: Condense these answers into at most 80 words of plain text. Keep concrete behaviours,
+    strengths, stress reactions and blind spots, and keep short striking phrases verbatim in quotes.
+    Do not interpret or add advice. No HTML, no markdown, no intro.
+    """
+
+
+def condense_prompt(summaries):
+    joined = "\n".join(f"- {text}" for text in summaries)
+    return f"""
+    Role: You are preparing 360-feedback for an executive coach.
+
+    Below are condensed notes from {len(summaries)} anonymous respondents about the same subject:
+    {joined}
+
+    Task: Merge these notes into at most 200 words of plain text. Lead with the themes several
+    respondents agree on, then notable disagreements and one-off observations worth keeping.
+    Keep short striking phrases verbatim in quotes. No HTML, no markdown, no intro.
+    """
+
+
+def uses_map_reduce(n_surveys):
+    return n_surveys > settings.ANALYSIS_MAP_REDUCE_THRESHOLD
+
+
+def generate_all(prompts):
+    # Map/reduce calls are independent; the LLM client's semaphore still caps the total
+    if not prompts:
+        return []
+    with ThreadPoolExecutor(max_workers=settings.ANALYSIS_MAP_CONCURRENCY) as pool:
+        return list(pool.map(llm.generate, prompts))
+
+
+def summarise_surveys(surveys, check_deadline=None):
+    # Map step: returns one summary per survey, generating only missing or outdated ones.
+    # Results are saved group by group, so a job that times out keeps its progress.
+    model_name = settings.GEMINI_MODEL
+    summaries = {}
+    pending = []
+    for survey in surveys:
+        prompt = survey_summary_prompt(survey)
+        source_hash = cache_key(prompt, model_name)
+        existing = getattr(survey, 'summary', None)
+        if existing is not None and existing.source_hash == source_hash:
+            summaries[survey.pk] = existing.summary
+        else:
+            pending.append((survey, prompt, source_hash))
+
+    batch_size = settings.ANALYSIS_REDUCE_BATCH_SIZE
+    for start in range(0, len(pending), batch_size):
+        if check_deadline:
+            check_deadline()
+        batch = pending[start:start + batch_size]
+        outputs = generate_all([prompt for _, prompt, _ in batch])
+        SurveySummary.objects.bulk_create(
+            [
+                SurveySummary(survey=survey, source_hash=source_hash, model_name=model_name, summary=text.strip())
+                for (survey, _, source_hash), text in zip(batch, outputs)
+            ],
+            update_conflicts=True,
+            unique_fields=['survey'],
+            update_fields=['source_hash', 'model_name', 'summary', 'updated_at'],
+        )
+        for (survey, _, _), text in zip(batch, outputs):
+            summaries[survey.pk] = text.strip()
+
+    return [summaries[survey.pk] for survey in surveys]
+
+
+def condense(summaries, check_deadline=None):
+    # Reduce step: condense fixed-size groups until the notes fit in one group.
+    # Groups follow survey order, so new surveys only invalidate the last group's cache entry.
+    model_name = settings.GEMINI_MODEL
+    batch_size = settings.ANALYSIS_REDUCE_BATCH_SIZE
+    while len(summaries) > batch_size:
+        if check_deadline:
+            check_deadline()
+        prompts = [condense_prompt(summaries[i:i + batch_size]) for i in range(0, len(summaries), batch_size)]
+        keys = [cache_key(prompt, model_name) for prompt in prompts]
+        outputs = [get_cached_generation(key) for key in keys]
+
+        missing = [i for i, output in enumerate(outputs) if output is None]
+        for i, text in zip(missing, generate_all([prompts[i] for i in missing])):
+            outputs[i] = text.strip()
+            store_generation(keys[i], model_name, outputs[i])
+        summaries = outputs
+    return summaries
+
+
+def condensed_analysis_prompt(profile, check_deadline=None):
+    surveys = list(
+        Survey.objects.for_context()
+        .filter(user_id=profile.user_id, is_completed=True)
+        .prefetch_related('summary')
+        .order_by('created_at', 'id')
+    )
+    notes = condense(summarise_surveys(surveys, check_deadline), check_deadline)
+
+    builder = PromptBuilder('analysis_condensed', settings.LLM_ANALYSIS_TOKEN_BUDGET)
+    for sec in profile.profile_context_sections():
+        builder.add(sec['key'], sec['title'], sec['body'], required=True)
+    builder.add(
+        'feedback_summary', f"Feedback Summary ({len(surveys)} anonymous respondents)", "\n\n".join(notes) + "\n",
+    )
+    add_themes(builder, profile)
+    return builder.build(analysis_prompt)
+
+
+def prompt_for_job(job, check_deadline=None):
+    # The queued prompt holds every raw answer and stays the generation-cache key;
+    # large profiles are sent the condensed version instead.
+    profile = Profile.objects.for_context().get(pk=job.profile_id)
+    n_surveys = Survey.objects.filter(user_id=profile.user_id, is_completed=True).count()
+    if not uses_map_reduce(n_surveys):
+        return job.prompt
+    return condensed_analysis_prompt(profile, check_deadline)
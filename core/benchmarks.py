@@ -0,0 +1,229 @@
+import statistics
+import time
+import tracemalloc
+from contextlib import ExitStack
+
+from django.contrib.auth.models import User
+from django.db import connection, reset_queries
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .llm import FakeBackend
+from .models import Survey, SurveyFeedback
+from .pagination import FeedbackPage, SurveyPage
+
+# Shared harness for the view benchmarks (`manage.py benchmark_views`) and the
+# query-count tests in core/tests.py: synthetic data, one case per route, and the
+# fake LLM backend so nothing leaves the machine.
+
+SIZES = (10, 100, 1000)
+
+
+LOCAL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmarks'},
+    'ratelimit': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmarks-ratelimit'},
+}
+
+
+def isolated_environment():
+    # Route every LLM call to the local fake backend and use a private in-memory cache,
+    # so runs neither call Gemini nor read fragments cached by earlier runs. Rate limits
+    # are off: every iteration comes from the same user and address.
+    # Returns an ExitStack to close when done.
+    stack = ExitStack()
+    stack.enter_context(override_settings(
+        LLM_BACKEND='fake',
+        CACHES=LOCAL_CACHES,
+        RATE_LIMIT_ENABLED=False,
+    ))
+    return stack
+
+
+# --- Synthetic data ---
+
+def seed_user(n_surveys, username=None):
+    # A user with a finished onboarding, `n_surveys` invitations (half completed) and feedback
+    user = User.objects.create_user(username or f"bench{n_surveys}", f"bench{n_surveys}@example.com", 'pw')
+    profile = user.profile
+    for field in profile.ONBOARDING_FIELDS:
+        setattr(profile, field, f"Synthetic {field} " * 20)
+    profile.onboarding_completed = True
+    profile.ai_summary = FakeBackend.reply
+    profile.save()
+
+    answer = "Observed behaviour in a synthetic respondent answer. " * 15
+    surveys = Survey.objects.bulk_create([
+        Survey(
+            user=user,
+            respondent_name=f"Respondent {i}",
+            respondent_email=f"r{i}@example.com",
+            relationship_type='coworker',
+            is_completed=(i % 2 == 0),
+            energy_audit_answer=answer if i % 2 == 0 else '',
+            stress_profile_answer=answer if i % 2 == 0 else '',
+            glass_ceiling_answer=answer if i % 2 == 0 else '',
+            future_self_answer=answer if i % 2 == 0 else '',
+        )
+        for i in range(n_surveys)
+    ])
+    SurveyFeedback.objects.bulk_create([
+        SurveyFeedback(survey=s, sentiment=['insightful', 'intense', 'confusing'][i % 3], comment="Synthetic comment")
+        for i, s in enumerate(surveys) if s.is_completed
+    ])
+    profile.rebuild_feedback_context()
+    return user
+
+
+# --- Route cases ---
+
+class Case:
+    """One request against one route. `url`/`data`/`setup` take the seeded user."""
+
+    def __init__(self, name, method, url, data=None, json=False, setup=None, superuser=False):
+        self.name = name
+        self.method = method
+        self.url = url
+        self.data = data
+        self.json = json
+        self.setup = setup
+        self.superuser = superuser
+
+    def prepare(self, user):
+        context = self.setup(user) if self.setup else None
+        url = self.url(user, context)
+        data = self.data(user, context) if callable(self.data) else self.data
+        return url, data
+
+    def perform(self, client, url, data):
+        if self.method == 'get':
+            return client.get(url)
+        if self.json:
+            return client.post(url, data or '{}', content_type='application/json')
+        return client.post(url, data or {})
+
+
+def pending_survey(user):
+    return Survey.objects.create(user=user, respondent_name='Pending', respondent_email='pending@example.com')
+
+
+def completed_survey(user):
+    return Survey.objects.filter(user=user, is_completed=True).first()
+
+
+CASES = [
+    Case('landing', 'get', lambda u, c: reverse('landing')),
+    Case('dashboard', 'get', lambda u, c: reverse('dashboard')),
+    Case('invitation_page', 'get', lambda u, c: f"{reverse('invitation_page')}?cursor={c or ''}",
+         setup=lambda u: SurveyPage(u.pk).next_cursor),
+    Case('onboarding', 'get', lambda u, c: reverse('onboarding')),
+    Case('onboarding_submit', 'post', lambda u, c: reverse('onboarding'),
+         data={'role': 'Director', 'values': 'Candor'}),
+    Case('stats', 'get', lambda u, c: reverse('stats'), superuser=True),
+    Case('feedback_api', 'get', lambda u, c: f"{reverse('feedback_api')}?cursor={c or ''}",
+         setup=lambda u: FeedbackPage().next_cursor, superuser=True),
+    Case('feedback_export', 'get', lambda u, c: reverse('feedback_export'), superuser=True),
+    Case('invite', 'get', lambda u, c: reverse('add_invite')),
+    Case('invite_submit', 'post', lambda u, c: reverse('add_invite'),
+         data={'name': 'New Person', 'email': 'new.person@example.com'}),
+    Case('bulk_invite', 'get', lambda u, c: reverse('bulk_invite')),
+    Case('bulk_invite_submit', 'post', lambda u, c: reverse('bulk_invite'),
+         data=lambda u, c: {'invites': '\n'.join(f"Bulk {i}, bulk{i}.{time.perf_counter_ns()}@example.com" for i in range(20))}),
+    Case('delete_invite', 'post', lambda u, c: reverse('delete_invite', args=[c.uuid]), setup=pending_survey),
+    Case('survey_form', 'get', lambda u, c: reverse('survey_view', args=[c.uuid]), setup=pending_survey),
+    Case('survey_submit', 'post', lambda u, c: reverse('survey_view', args=[c.uuid]), setup=pending_survey,
+         data={'relationship': 'coworker', 'energy_audit': 'E', 'stress_profile': 'S',
+               'glass_ceiling': 'G', 'future_self': 'F'}),
+    Case('survey_feedback', 'post', lambda u, c: reverse('survey_feedback', args=[c.uuid]), setup=completed_survey,
+         data='{"sentiment": "insightful", "comment": "Great"}', json=True),
+    Case('alternative_question', 'post', lambda u, c: reverse('get_alternative_question', args=[c.uuid]),
+         setup=pending_survey, data='{"question_type": "stress_profile", "relationship": "coworker"}', json=True),
+    Case('public_survey', 'get', lambda u, c: reverse('public_survey', args=[u.profile.public_link_uuid])),
+    Case('public_survey_submit', 'post', lambda u, c: reverse('public_survey', args=[u.profile.public_link_uuid]),
+         data={'name': 'Public Person', 'email': 'public@example.com'}),
+    Case('profile_analysis', 'get', lambda u, c: reverse('profile_analysis')),
+    Case('analysis_status', 'get', lambda u, c: reverse('analysis_status')),
+    Case('profile_report', 'get', lambda u, c: reverse('profile_report')),
+    Case('chat', 'post', lambda u, c: reverse('chat_view'), data='{"message": "What is my blind spot?"}', json=True),
+    Case('chat_stream', 'post', lambda u, c: reverse('chat_stream'), data='{"message": "What is my blind spot?"}', json=True),
+]
+
+
+def client_for(user, case):
+    if case.superuser and not user.is_superuser:
+        User.objects.filter(pk=user.pk).update(is_superuser=True, is_staff=True)
+        user.refresh_from_db()
+    client = Client()
+    client.force_login(user)
+    return client
+
+
+def run_case(case, user, client):
+    # One request: returns (status_code, query_count, seconds). Streams are fully consumed.
+    url, data = case.prepare(user)
+    # The query log is capped (9000 entries); once full its length stops changing and
+    # every later request would count 0 queries
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        response = case.perform(client, url, data)
+        if response.streaming:
+            b''.join(response)
+        elapsed = time.perf_counter() - start
+    return response.status_code, len(queries), elapsed
+
+
+def percentile(samples, pct):
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method='inclusive')[pct - 1]
+
+
+def measure(case, user, iterations):
+    client = client_for(user, case)
+    run_case(case, user, client)  # Warm-up: lazy context builds, template loading
+
+    timings, query_counts, status = [], [], None
+    for _ in range(iterations):
+        status, n_queries, elapsed = run_case(case, user, client)
+        timings.append(elapsed)
+        query_counts.append(n_queries)
+
+    tracemalloc.start()
+    run_case(case, user, client)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'status': status,
+        'queries': max(query_counts),
+        'p50_ms': round(percentile(timings, 50) * 1000, 2),
+        'p95_ms': round(percentile(timings, 95) * 1000, 2),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def query_baseline(results):
+    # The committed baseline: status and query counts only. Latency and memory depend on
+    # the machine, so they stay in local result files (`benchmark_views --output`).
+    return {key: {'status': row['status'], 'queries': row['queries']} for key, row in results.items()}
+
+
+def compare(results, baseline, tolerance, slack_ms=5.0, slack_kb=64.0):
+    # Returns human-readable regressions of `results` against `baseline`.
+    # Query counts must not grow at all; time and memory, when the baseline has them (a
+    # local results file), get a relative tolerance plus slack.
+    regressions = []
+    for key, current in sorted(results.items()):
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+        if current['status'] != expected['status']:
+            regressions.append(f"{key}: status {expected['status']} -> {current['status']}")
+        if current['queries'] > expected['queries']:
+            regressions.append(f"{key}: queries {expected['queries']} -> {current['queries']}")
+        if 'p95_ms' in expected and current['p95_ms'] > expected['p95_ms'] * (1 + tolerance) + slack_ms:
+            regressions.append(f"{key}: p95 {expected['p95_ms']}ms -> {current['p95_ms']}ms")
+        if 'peak_kb' in expected and current['peak_kb'] > expected['peak_kb'] * (1 + tolerance) + slack_kb:
+            regressions.append(f"{key}: peak memory {expected['peak_kb']}KB -> {current['peak_kb']}KB")
+    return regressions
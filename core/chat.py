@@ -0,0 +1,158 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import llm
+from .models import ChatMessage, ChatSession, Profile
+from .prompts import PromptBuilder
+from .ratelimit import LLMSlot
+from .retrieval import format_excerpts, relevant_excerpts
+
+# Conversation memory for the coach chat.
+# The coaching rules and the user's onboarding answers go into the session's stored
+# system prompt once. Each turn then sends the survey answers most relevant to the
+# question (core/retrieval.py), the rolling summary of older turns, the last
+# CHAT_RECENT_MESSAGES messages verbatim and the new question, so a turn stays the same
+# size however many respondents and messages there are.
+
+logger = logging.getLogger(__name__)
+
+
+def build_system_prompt(profile):
+    # Survey answers are retrieved per turn; only the user's own answers are sent up front
+    builder = PromptBuilder('chat_system', settings.LLM_CHAT_TOKEN_BUDGET)
+    builder.add_feedback_context([sec for sec in profile.context_sections() if not sec['key'].startswith('survey:')])
+    return builder.build(lambda context_data: f"""
+    You are a confidential executive coach. You have access to the user's own answers below
+    and, with each question, the 360-degree feedback excerpts most relevant to it.
+
+    USER DATA:
+    {context_data}
+
+    CRITICAL RULES:
+    1. **CONFIDENTIALITY**: NEVER reveal the identity of the person who gave specific feedback. Use phrases like "One colleague mentioned..." or "Feedback suggests...".
+    2. **SYNTHESIS**: Aggregate the insights. Don't just quote.
+    3. **TONE**: Professional, encouraging, and growth-oriented.
+
+    Answer the user's questions based on the data.
+    """)
+
+
+def get_session(user, session_id=None):
+    # (session, profile): the requested session if it is the user's, else their latest
+    # active one, else a new one
+    # Only the context version: the context itself is read when a system prompt is (re)built
+    profile = Profile.objects.for_status().get_for_user(user)
+
+    sessions = ChatSession.objects.filter(profile=profile)
+    session = None
+    if session_id:
+        session = sessions.filter(pk=session_id).first()
+    if session is None:
+        idle_cutoff = timezone.now() - timedelta(seconds=settings.CHAT_SESSION_IDLE_TIMEOUT)
+        session = sessions.filter(updated_at__gte=idle_cutoff).order_by('-updated_at').first()
+    if session is None:
+        session = ChatSession.objects.create(
+            profile=profile,
+            system_prompt=build_system_prompt(profile),
+            context_version=profile.feedback_context_version,
+        )
+        return session, profile
+
+    if session.context_version != profile.feedback_context_version:
+        # New feedback since the session started: rebuild the context, keep the conversation
+        session.system_prompt = build_system_prompt(profile)
+        session.context_version = profile.feedback_context_version
+        session.save(update_fields=['system_prompt', 'context_version', 'updated_at'])
+    return session, profile
+
+
+def recent_messages(session):
+    return list(session.messages.filter(id__gt=session.summarised_until).order_by('id'))
+
+
+def format_transcript(messages):
+    return "\n".join(f"{message.get_role_display()}: {message.text}" for message in messages)
+
+
+def retrieval_query(recent, user_message):
+    # The previous question too, so follow-ups ("tell me more") still find their excerpts
+    previous = [m.text for m in recent if m.role == ChatMessage.ROLE_USER][-1:]
+    return " ".join(previous + [user_message])
+
+
+def turn_prompt(session, recent, user_message, excerpts=()):
+    parts = []
+    if excerpts:
+        parts.append(f"RELEVANT FEEDBACK (anonymous excerpts):\n{format_excerpts(excerpts)}")
+    if session.summary:
+        parts.append(f"EARLIER IN THIS CONVERSATION (summary):\n{session.summary}")
+    if recent:
+        parts.append(f"RECENT MESSAGES:\n{format_transcript(recent)}")
+    parts.append(f'USER QUESTION: "{user_message}"')
+    return "\n\n".join(parts)
+
+
+def prepare_turn(user, session_id, user_message):
+    # Returns (session, history, prompt); the session's system_prompt goes along as `system`
+    session, profile = get_session(user, session_id)
+    history = recent_messages(session)
+    recent = history[-settings.CHAT_RECENT_MESSAGES:]
+    excerpts = relevant_excerpts(profile, retrieval_query(recent, user_message))
+    return session, history, turn_prompt(session, recent, user_message, excerpts)
+
+
+def compaction_prompt(summary, messages):
+    return f"""
+    Role: You keep the running notes of a coaching conversation.
+
+    Notes so far:
+    {summary or '(none yet)'}
+
+    New messages:
+    {format_transcript(messages)}
+
+    Task: Rewrite the notes to include the new messages in at most 150 words of plain text.
+    Keep what the user asked, the advice given and any commitments or open questions.
+    No HTML, no markdown, no intro.
+    """
+
+
+def messages_to_fold(history):
+    # Once this turn's question and reply are saved, everything but the most recent
+    # messages goes into the summary. Those are all in `history` already, so compaction
+    # can run while the reply is generated.
+    total = len(history) + 2
+    if total <= settings.CHAT_RECENT_MESSAGES + settings.CHAT_COMPACT_AFTER:
+        return []
+    return history[:total - settings.CHAT_RECENT_MESSAGES]
+
+
+async def compact(session, folded):
+    # Fold `folded` into the rolling summary, touching the session as finish_turn would.
+    # Best effort: when every LLM slot is taken or the call fails, the old summary stays
+    # and the next turn tries again.
+    if not folded:
+        return False
+    sessions = ChatSession.objects.filter(pk=session.pk)
+    try:
+        async with LLMSlot():
+            summary = (await llm.agenerate(compaction_prompt(session.summary, folded))).strip()
+    except Exception as e:
+        logger.warning("Chat %s: compaction skipped (%s)", session.pk, e)
+        await sessions.aupdate(updated_at=timezone.now())
+        return False
+    await sessions.aupdate(summary=summary, summarised_until=folded[-1].pk, updated_at=timezone.now())
+    return True
+
+
+def finish_turn(session, user_message, reply, touch=True):
+    # touch=False when compact() runs for this turn and updates the session anyway
+    ChatMessage.objects.bulk_create([
+        ChatMessage(session=session, role=ChatMessage.ROLE_USER, text=user_message),
+        ChatMessage(session=session, role=ChatMessage.ROLE_MODEL, text=reply),
+    ])
+    if touch:
+        ChatSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
@@ -0,0 +1,32 @@
+import uuid
+
+from django.core.cache import cache
+
+# Versioned keys for cached page fragments (see the {% cache %} blocks in dashboard.html
+# and stats_view). Each scope has a random version token stored in the cache; fragments
+# include it in their key and the model signals replace it when the underlying rows
+# change, so stale fragments are never looked up again and simply age out.
+# Random tokens rather than counters: a cleared cache can't bring an old version back.
+
+STATS_SCOPE = 'stats'
+
+
+def dashboard_scope(user_id):
+    return f"dashboard:{user_id}"
+
+
+def version_key(scope):
+    return f"fragment-version:{scope}"
+
+
+def fragment_version(scope):
+    version = cache.get(version_key(scope))
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(version_key(scope), version, None):
+            version = cache.get(version_key(scope), version)
+    return version
+
+
+def invalidate(scope):
+    cache.set(version_key(scope), uuid.uuid4().hex, None)
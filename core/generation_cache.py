@@ -0,0 +1,52 @@
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import GenerationCache
+
+# Content-addressed cache for LLM generations.
+# Keyed by a hash of the model name and the fully assembled prompt; bounded in size
+# with least-recently-used eviction and an optional TTL.
+
+
+def cache_key(prompt, model_name):
+    digest = hashlib.sha256()
+    digest.update(model_name.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(prompt.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_cached_generation(key):
+    entry = GenerationCache.objects.filter(key=key).only('id', 'output', 'created_at').first()
+    if entry is None:
+        return None
+
+    ttl = settings.GENERATION_CACHE_TTL
+    if ttl and entry.created_at < timezone.now() - timedelta(seconds=ttl):
+        entry.delete()
+        return None
+
+    GenerationCache.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    return entry.output
+
+
+def store_generation(key, model_name, output):
+    GenerationCache.objects.update_or_create(
+        key=key,
+        defaults={'model_name': model_name, 'output': output, 'last_used_at': timezone.now()},
+    )
+    evict_generations()
+
+
+def evict_generations():
+    # Drop the least recently used entries beyond the configured bound
+    max_entries = settings.GENERATION_CACHE_MAX_ENTRIES
+    stale_ids = list(
+        GenerationCache.objects.order_by('-last_used_at').values_list('id', flat=True)[max_entries:]
+    )
+    if stale_ids:
+        GenerationCache.objects.filter(id__in=stale_ids).delete()
@@ -0,0 +1,238 @@
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import llm
+from .analysis import prompt_for_job
+from .fragment_cache import dashboard_scope, invalidate
+from .generation_cache import cache_key, store_generation
+from .models import AnalysisJob, Profile
+
+# Database-backed job queue for profile analysis.
+# Web requests only enqueue; `manage.py run_analysis_worker` claims and runs jobs.
+# Runs are single-flight per profile: the core_job_one_active_per_profile constraint
+# allows one queued/running job, and duplicate requests attach to it.
+
+logger = logging.getLogger(__name__)
+
+
+class JobTimeout(Exception):
+    pass
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def active_job(profile_id):
+    # The profile's in-flight analysis, if any (expired claims don't count)
+    expire_stale_claims(profile_id=profile_id)
+    return AnalysisJob.objects.filter(profile_id=profile_id, status__in=AnalysisJob.ACTIVE_STATUSES).first()
+
+
+def enqueue_analysis(profile, prompt):
+    # Returns (job, created). created is False when the profile already had a run in
+    # flight: the request attaches to that job instead of starting a second generation.
+    expire_stale_claims(profile_id=profile.pk)
+    for _ in range(2):
+        try:
+            with transaction.atomic():  # Savepoint: the constraint may reject the insert
+                job = AnalysisJob.objects.create(
+                    profile=profile,
+                    prompt=prompt,
+                    max_attempts=settings.ANALYSIS_JOB_MAX_ATTEMPTS,
+                )
+            return job, True
+        except IntegrityError:
+            job = AnalysisJob.objects.filter(profile_id=profile.pk, status__in=AnalysisJob.ACTIVE_STATUSES).first()
+            if job is None:
+                continue  # It finished in between; try again
+            # Not picked up yet: let it run on the newest prompt
+            AnalysisJob.objects.filter(pk=job.pk, status=AnalysisJob.STATUS_QUEUED).update(prompt=prompt)
+            return job, False
+    raise RuntimeError(f"Could not enqueue an analysis for profile {profile.pk}")
+
+
+def expire_stale_claims(**lookup):
+    # A job still queued or running ANALYSIS_CLAIM_TTL after it was created has been
+    # abandoned (no worker running, or one that keeps dying). Fail it so it stops
+    # blocking new runs for its profile.
+    cutoff = timezone.now() - timedelta(seconds=settings.ANALYSIS_CLAIM_TTL)
+    expired = AnalysisJob.objects.filter(status__in=AnalysisJob.ACTIVE_STATUSES, created_at__lt=cutoff, **lookup)
+    for job in expired:
+        fail_job(job, "Analysis did not finish in time", retry=False)
+
+
+def requeue_stale_jobs():
+    # A worker that died mid-job leaves its row RUNNING forever; hand it back to the queue,
+    # unless it has already used up its attempts (e.g. it keeps crashing the worker).
+    expire_stale_claims()
+    cutoff = timezone.now() - timedelta(seconds=settings.ANALYSIS_JOB_TIMEOUT * 2)
+    stale = AnalysisJob.objects.filter(status=AnalysisJob.STATUS_RUNNING, locked_at__lt=cutoff)
+
+    for job in stale.filter(attempts__gte=F('max_attempts')):
+        fail_job(job, "Worker stopped responding")
+
+    return stale.update(
+        status=AnalysisJob.STATUS_QUEUED,
+        locked_by='',
+        locked_at=None,
+        run_after=timezone.now(),
+    )
+
+
+def claim_next_job(owner):
+    # SKIP LOCKED lets several workers poll the same table without blocking each other.
+    # On SQLite select_for_update is a no-op, so the conditional UPDATE below is what
+    # actually guarantees a job is only handed to one worker.
+    with transaction.atomic():
+        job = (
+            AnalysisJob.objects.select_for_update(skip_locked=True)
+            .filter(status=AnalysisJob.STATUS_QUEUED, run_after__lte=timezone.now())
+            .order_by('run_after', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        claimed = AnalysisJob.objects.filter(pk=job.pk, status=AnalysisJob.STATUS_QUEUED).update(
+            status=AnalysisJob.STATUS_RUNNING,
+            locked_by=owner,
+            locked_at=timezone.now(),
+            attempts=F('attempts') + 1,
+            partial_output='',  # A retry streams the report again from the start
+        )
+    if not claimed:
+        return None
+    job.refresh_from_db()
+    return job
+
+
+def retry_delay(attempts):
+    # Exponential backoff: base, 2*base, 4*base, ... capped at ten minutes.
+    return min(settings.ANALYSIS_JOB_RETRY_BACKOFF * (2 ** max(attempts - 1, 0)), 600)
+
+
+def complete_job(job):
+    AnalysisJob.objects.filter(pk=job.pk).update(
+        status=AnalysisJob.STATUS_DONE,
+        locked_by='',
+        locked_at=None,
+        finished_at=timezone.now(),
+        partial_output='',  # The finished report lives on the profile
+    )
+
+
+def fail_job(job, error, retry=True):
+    if retry and job.attempts < job.max_attempts:
+        AnalysisJob.objects.filter(pk=job.pk).update(
+            status=AnalysisJob.STATUS_QUEUED,
+            locked_by='',
+            locked_at=None,
+            last_error=str(error),
+            run_after=timezone.now() + timedelta(seconds=retry_delay(job.attempts)),
+        )
+        return False
+
+    AnalysisJob.objects.filter(pk=job.pk).update(
+        status=AnalysisJob.STATUS_FAILED,
+        locked_by='',
+        locked_at=None,
+        last_error=str(error),
+        finished_at=timezone.now(),
+    )
+    # Whatever was streamed before the failure is still worth showing
+    partial = AnalysisJob.objects.filter(pk=job.pk).values_list('partial_output', flat=True).first()
+    notice = f"Error during analysis: {error}. Please try again."
+    Profile.objects.filter(pk=job.profile_id).update(
+        ai_summary=f'{partial}<p class="analysis-error">{notice}</p>' if partial else notice,
+        last_updated=timezone.now(),
+    )
+    user_id = Profile.objects.filter(pk=job.profile_id).values_list('user_id', flat=True).first()
+    invalidate(dashboard_scope(user_id))  # update() sends no post_save
+    return True
+
+
+class PartialOutput:
+    """Buffers streamed chunks and writes the text so far to the job every
+    ANALYSIS_FLUSH_CHUNKS chunks or ANALYSIS_FLUSH_INTERVAL_MS, whichever comes first."""
+
+    def __init__(self, job):
+        self.job_id = job.pk
+        self.chunks = []
+        self.pending = 0
+        self.flushed_at = time.monotonic()
+
+    def add(self, text):
+        self.chunks.append(text)
+        self.pending += 1
+        elapsed_ms = (time.monotonic() - self.flushed_at) * 1000
+        if self.pending >= settings.ANALYSIS_FLUSH_CHUNKS or elapsed_ms >= settings.ANALYSIS_FLUSH_INTERVAL_MS:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        # Single-column write; the status poller sees the new length and fetches the report
+        AnalysisJob.objects.filter(pk=self.job_id).update(partial_output=self.text)
+        self.pending = 0
+        self.flushed_at = time.monotonic()
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+
+def run_ai_analysis(job):
+    if not llm.is_configured():
+        raise RuntimeError("No Google API Key found.")
+
+    deadline = timezone.now() + timedelta(seconds=settings.ANALYSIS_JOB_TIMEOUT)
+
+    def check_deadline():
+        if timezone.now() > deadline:
+            raise JobTimeout(f"Analysis exceeded {settings.ANALYSIS_JOB_TIMEOUT}s")
+
+    # Large profiles are summarised first; finished summaries survive a timeout and retry
+    prompt = prompt_for_job(job, check_deadline)
+
+    # Stream the response, persisting it as it arrives so the dashboard can show it
+    # and a failure keeps what was generated
+    output = PartialOutput(job)
+    try:
+        for text in llm.stream(prompt, timeout=settings.ANALYSIS_JOB_TIMEOUT):
+            output.add(text)
+            check_deadline()
+    except Exception:
+        output.flush()
+        raise
+    full_text = output.text
+
+    store_generation(cache_key(job.prompt, settings.GEMINI_MODEL), settings.GEMINI_MODEL, full_text)
+
+    profile = Profile.objects.only('id', 'user_id').get(id=job.profile_id)
+    profile.ai_summary = full_text
+    profile.save(update_fields=['ai_summary', 'last_updated'])
+
+
+def process_job(job):
+    try:
+        run_ai_analysis(job)
+    except Exception as e:
+        gave_up = fail_job(job, e)
+        logger.exception(
+            "Analysis job %s attempt %s/%s failed (%s)",
+            job.pk, job.attempts, job.max_attempts, 'giving up' if gave_up else 'will retry',
+        )
+        return False
+
+    complete_job(job)
+    logger.info("Analysis saved for profile %s (job %s)", job.profile_id, job.pk)
+    return True
@@ -0,0 +1,288 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import time
+import weakref
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .prompts import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Process-wide LLM client.
+# Configures the provider once and reuses the same model objects (and with them the
+# underlying gRPC channel), so requests don't pay for setup and a fresh handshake.
+# Also owns timeouts, retry/backoff on 429/5xx and a cap on concurrent calls, and logs
+# estimated prompt/output tokens and latency for every call.
+#
+# Select the backend with settings.LLM_BACKEND: 'gemini', 'fake' (local, no network) or
+# a dotted path to a class with the same interface as GeminiBackend.
+#
+# `system` is an optional system instruction (e.g. a chat session's 360 context). Gemini
+# uploads large ones once as cached content (LLM_CONTEXT_CACHE_TTL), so repeated calls
+# only send the per-turn prompt.
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMNotConfigured(LLMError):
+    pass
+
+
+class GeminiBackend:
+    def __init__(self):
+        import google.generativeai as genai
+        from google.api_core import exceptions
+
+        self.genai = genai
+        self.retryable = (
+            exceptions.TooManyRequests,      # 429
+            exceptions.ResourceExhausted,    # 429 (quota)
+            exceptions.InternalServerError,  # 500
+            exceptions.BadGateway,           # 502
+            exceptions.ServiceUnavailable,   # 503
+            exceptions.GatewayTimeout,       # 504
+            exceptions.DeadlineExceeded,
+        )
+        self.api_key = os.environ.get("GOOGLE_API_KEY")
+        if self.api_key:
+            genai.configure(api_key=self.api_key)
+        self._models = {}
+        self._contexts = {}  # sha256(model, system) -> (model bound to cached content, expiry)
+        self._lock = threading.Lock()
+
+    def is_configured(self):
+        return bool(self.api_key)
+
+    def model(self, name, system=None):
+        if not self.api_key:
+            raise LLMNotConfigured("Google API Key not configured.")
+        if system:
+            return self.system_model(name, system)
+        with self._lock:
+            if name not in self._models:
+                self._models[name] = self.genai.GenerativeModel(name)
+            return self._models[name]
+
+    def system_model(self, name, system):
+        key = hashlib.sha256(f"{name}\0{system}".encode('utf-8')).hexdigest()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._contexts.get(key)
+            if entry and entry[1] > now:
+                return entry[0]
+
+        ttl = settings.LLM_CONTEXT_CACHE_TTL
+        if ttl and estimate_tokens(system) >= settings.LLM_CONTEXT_CACHE_MIN_TOKENS:
+            try:
+                from google.generativeai import caching
+                cached = caching.CachedContent.create(model=name, system_instruction=system, ttl=timedelta(seconds=ttl))
+                model = self.genai.GenerativeModel.from_cached_content(cached_content=cached)
+            except Exception as e:
+                logger.warning("llm context cache unavailable, sending system prompt inline: %s", e)
+            else:
+                with self._lock:
+                    self._contexts = {k: v for k, v in self._contexts.items() if v[1] > now}
+                    self._contexts[key] = (model, now + ttl - 60)  # Stop using it shortly before it expires
+                return model
+        return self.genai.GenerativeModel(name, system_instruction=system)
+
+    def request_options(self, timeout):
+        return {'timeout': timeout}
+
+    def generate(self, prompt, model, timeout, system=None):
+        response = self.model(model, system).generate_content(prompt, request_options=self.request_options(timeout))
+        return response.text
+
+    def stream(self, prompt, model, timeout, system=None):
+        response = self.model(model, system).generate_content(prompt, stream=True, request_options=self.request_options(timeout))
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+    async def agenerate(self, prompt, model, timeout, system=None):
+        response = await self.model(model, system).generate_content_async(prompt, request_options=self.request_options(timeout))
+        return response.text
+
+    async def astream(self, prompt, model, timeout, system=None):
+        response = await self.model(model, system).generate_content_async(
+            prompt, stream=True, request_options=self.request_options(timeout)
+        )
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class FakeBackend:
+    # Deterministic local stand-in for tests, benchmarks and offline development
+    reply = '<div class="report-section"><h3>Stubbed Reply</h3><p>Generated locally without calling Gemini.</p></div>'
+    retryable = ()
+
+    def is_configured(self):
+        return True
+
+    def chunks(self):
+        parts = self.reply.split('</p>')
+        return [part + '</p>' for part in parts[:-1]] + [parts[-1]]
+
+    def generate(self, prompt, model, timeout, system=None):
+        return self.reply
+
+    def stream(self, prompt, model, timeout, system=None):
+        yield from self.chunks()
+
+    async def agenerate(self, prompt, model, timeout, system=None):
+        return self.reply
+
+    async def astream(self, prompt, model, timeout, system=None):
+        for chunk in self.chunks():
+            yield chunk
+
+
+BACKENDS = {
+    'gemini': GeminiBackend,
+    'fake': FakeBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+_sync_slots = None
+_async_slots = weakref.WeakKeyDictionary()  # event loop -> asyncio.Semaphore
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = settings.LLM_BACKEND
+                _backend = (BACKENDS.get(name) or import_string(name))()
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend, _sync_slots
+    if setting in ('LLM_BACKEND', 'LLM_MAX_CONCURRENCY'):
+        _backend = None
+        _sync_slots = None
+        _async_slots.clear()
+
+
+def is_configured():
+    return get_backend().is_configured()
+
+
+def sync_slots():
+    global _sync_slots
+    if _sync_slots is None:
+        with _backend_lock:
+            if _sync_slots is None:
+                _sync_slots = threading.BoundedSemaphore(settings.LLM_MAX_CONCURRENCY)
+    return _sync_slots
+
+
+def async_slots():
+    loop = asyncio.get_running_loop()
+    if loop not in _async_slots:
+        _async_slots[loop] = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+    return _async_slots[loop]
+
+
+def retry_delay(attempt):
+    return settings.LLM_RETRY_BACKOFF * (2 ** attempt)
+
+
+def log_call(kind, model, prompt, system, output, started, attempts, first_chunk_at=None):
+    extra = f" ttft_ms={(first_chunk_at - started) * 1000:.0f}" if first_chunk_at else ""
+    logger.info(
+        "llm call=%s model=%s prompt_tokens=%d system_tokens=%d output_tokens=%d latency_ms=%.0f attempts=%d%s",
+        kind, model, estimate_tokens(prompt), estimate_tokens(system or ""), estimate_tokens(output),
+        (time.monotonic() - started) * 1000, attempts, extra,
+    )
+
+
+# --- Public API ---
+
+def generate(prompt, model=None, timeout=None, system=None):
+    backend = get_backend()
+    model = model or settings.GEMINI_MODEL
+    timeout = timeout or settings.LLM_TIMEOUT
+    started = time.monotonic()
+    for attempt in range(settings.LLM_MAX_RETRIES + 1):
+        try:
+            with sync_slots():
+                output = backend.generate(prompt, model, timeout, system=system)
+            log_call('generate', model, prompt, system, output, started, attempt + 1)
+            return output
+        except backend.retryable:
+            if attempt == settings.LLM_MAX_RETRIES:
+                raise
+            time.sleep(retry_delay(attempt))
+
+
+def stream(prompt, model=None, timeout=None, system=None):
+    # Retries only until the first chunk arrives; after that a failure would duplicate output
+    backend = get_backend()
+    model = model or settings.GEMINI_MODEL
+    timeout = timeout or settings.LLM_TIMEOUT
+    started, first_chunk_at, output = time.monotonic(), None, []
+    for attempt in range(settings.LLM_MAX_RETRIES + 1):
+        try:
+            with sync_slots():
+                for text in backend.stream(prompt, model, timeout, system=system):
+                    first_chunk_at = first_chunk_at or time.monotonic()
+                    output.append(text)
+                    yield text
+            log_call('stream', model, prompt, system, "".join(output), started, attempt + 1, first_chunk_at)
+            return
+        except backend.retryable:
+            if first_chunk_at or attempt == settings.LLM_MAX_RETRIES:
+                raise
+            time.sleep(retry_delay(attempt))
+
+
+async def agenerate(prompt, model=None, timeout=None, system=None):
+    backend = get_backend()
+    model = model or settings.GEMINI_MODEL
+    timeout = timeout or settings.LLM_TIMEOUT
+    started = time.monotonic()
+    for attempt in range(settings.LLM_MAX_RETRIES + 1):
+        try:
+            async with async_slots():
+                output = await backend.agenerate(prompt, model, timeout, system=system)
+            log_call('agenerate', model, prompt, system, output, started, attempt + 1)
+            return output
+        except backend.retryable:
+            if attempt == settings.LLM_MAX_RETRIES:
+                raise
+            await asyncio.sleep(retry_delay(attempt))
+
+
+async def astream(prompt, model=None, timeout=None, system=None):
+    backend = get_backend()
+    model = model or settings.GEMINI_MODEL
+    timeout = timeout or settings.LLM_TIMEOUT
+    started, first_chunk_at, output = time.monotonic(), None, []
+    for attempt in range(settings.LLM_MAX_RETRIES + 1):
+        try:
+            async with async_slots():
+                async for text in backend.astream(prompt, model, timeout, system=system):
+                    first_chunk_at = first_chunk_at or time.monotonic()
+                    output.append(text)
+                    yield text
+            log_call('astream', model, prompt, system, "".join(output), started, attempt + 1, first_chunk_at)
+            return
+        except backend.retryable:
+            if first_chunk_at or attempt == settings.LLM_MAX_RETRIES:
+                raise
+            await asyncio.sleep(retry_delay(attempt))
@@ -0,0 +1,87 @@
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core import benchmarks
+
+DEFAULT_BASELINE = Path(__file__).resolve().parents[2] / 'benchmark_baseline.json'
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every core route against synthetic users with 10/100/1000 surveys "
+        "(Gemini stubbed) and compare query counts to the committed baseline. p50/p95 latency and "
+        "peak memory are compared too when the baseline is a local --output file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=list(benchmarks.SIZES))
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--routes', nargs='+', help="Only benchmark these case names.")
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE))
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help="Allowed relative growth of p95 latency and peak memory (0.5 = +50%%).",
+        )
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help="Write status and query counts as the new baseline.",
+        )
+        parser.add_argument(
+            '--output',
+            help="Also write the raw results, with timings, to this JSON file (a local --baseline for later runs).",
+        )
+
+    def handle(self, *args, **options):
+        cases = [c for c in benchmarks.CASES if not options['routes'] or c.name in options['routes']]
+        if not cases:
+            raise CommandError("No matching routes.")
+
+        # Run against a throwaway test database, never the real one
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        stub = benchmarks.isolated_environment()
+        try:
+            results = self.run_benchmarks(cases, options['sizes'], options['iterations'])
+        finally:
+            stub.close()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(results, indent=2, sort_keys=True) + '\n')
+
+        baseline_path = Path(options['baseline'])
+        if options['update_baseline']:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(json.dumps(benchmarks.query_baseline(results), indent=2, sort_keys=True) + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Baseline written to {baseline_path}"))
+            return
+
+        if not baseline_path.exists():
+            self.stdout.write(self.style.WARNING(f"No baseline at {baseline_path}; run with --update-baseline."))
+            return
+
+        regressions = benchmarks.compare(results, json.loads(baseline_path.read_text()), options['tolerance'])
+        if regressions:
+            for line in regressions:
+                self.stderr.write(f"REGRESSION {line}")
+            raise CommandError(f"{len(regressions)} benchmark regression(s)")
+        self.stdout.write(self.style.SUCCESS("No regressions against baseline."))
+
+    def run_benchmarks(self, cases, sizes, iterations):
+        results = {}
+        self.stdout.write(f"{'route':<24}{'surveys':>8}{'status':>8}{'queries':>9}{'p50 ms':>10}{'p95 ms':>10}{'peak KB':>10}")
+        for size in sizes:
+            user = benchmarks.seed_user(size)
+            for case in cases:
+                row = benchmarks.measure(case, user, iterations)
+                results[f"{case.name}@{size}"] = row
+                self.stdout.write(
+                    f"{case.name:<24}{size:>8}{row['status']:>8}{row['queries']:>9}"
+                    f"{row['p50_ms']:>10}{row['p95_ms']:>10}{row['peak_kb']:>10}"
+                )
+        return results
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import llm
+from core.models import AlternativeQuestion
+from core.question_bank import RELATIONSHIPS, fill_pair
+
+
+class Command(BaseCommand):
+    help = "Pre-generate alternative survey questions for every (question_type, relationship) pair."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--per-pair', type=int, default=5, help="Questions to keep per pair.")
+        parser.add_argument('--replace', action='store_true', help="Delete the existing bank first.")
+
+    def handle(self, *args, **options):
+        if not llm.is_configured():
+            raise CommandError("LLM backend is not configured (GOOGLE_API_KEY missing).")
+
+        if options['replace']:
+            AlternativeQuestion.objects.all().delete()
+
+        total = 0
+        for question_type in AlternativeQuestion.QUESTION_TYPES:
+            for relationship in RELATIONSHIPS:
+                try:
+                    created = fill_pair(question_type, relationship, options['per_pair'])
+                except Exception as e:
+                    self.stderr.write(f"{question_type}/{relationship}: {e}")
+                    continue
+                total += created
+                self.stdout.write(f"{question_type}/{relationship}: +{created}")
+        self.stdout.write(self.style.SUCCESS(f"Added {total} questions to the bank."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.sentiment_stats import recount
+
+
+class Command(BaseCommand):
+    help = "Rebuild the stats page's sentiment counters from the feedback table."
+
+    def handle(self, *args, **options):
+        counted = recount()
+        self.stdout.write(self.style.SUCCESS(f"Recounted {counted} feedback rows."))
@@ -0,0 +1,53 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    help = "Claim and run queued profile analysis jobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.ANALYSIS_WORKER_CONCURRENCY,
+            help="Maximum number of analyses (Gemini calls) running at once on this node.",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=2.0,
+            help="Seconds to sleep when the queue is empty.",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Drain the queue and exit instead of polling forever.",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(options['concurrency'], 1)
+        self.stdout.write(f"Analysis worker started (concurrency={concurrency})")
+
+        # Each slot claims its own jobs, so one slow generation never holds up the others.
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for _ in range(concurrency):
+                pool.submit(self.run_slot, options['poll_interval'], options['once'])
+
+    def run_slot(self, poll_interval, once):
+        while True:
+            close_old_connections()
+            try:
+                jobs.requeue_stale_jobs()
+                job = jobs.claim_next_job(jobs.worker_id())
+                if job is not None:
+                    jobs.process_job(job)
+                    continue
+            except Exception as e:
+                self.stderr.write(f"Worker slot error: {e}")
+            finally:
+                close_old_connections()
+
+            if once:
+                return
+            time.sleep(poll_interval)
@@ -0,0 +1,41 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import outbox
+
+
+class Command(BaseCommand):
+    help = "Deliver queued outbound emails in batches over a shared SMTP connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE,
+            help="Maximum number of emails sent per SMTP connection.",
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=5.0,
+            help="Seconds to sleep when the outbox is empty.",
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Drain the outbox and exit instead of polling forever.",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Outbox sender started (batch size={options['batch_size']})")
+
+        while True:
+            close_old_connections()
+            outbox.requeue_stale_emails()
+            batch = outbox.claim_batch(options['batch_size'])
+            if batch:
+                sent = outbox.send_batch(batch)
+                self.stdout.write(f"Sent {sent}/{len(batch)} emails")
+                continue
+
+            if options['once']:
+                return
+            time.sleep(options['poll_interval'])
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_generationcache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='feedback_context',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='feedback_context_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_outboundemail'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(condition=models.Q(('is_completed', True)), fields=['user', 'created_at'], name='core_survey_user_completed'),
+        ),
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(fields=['user', '-created_at'], name='core_survey_user_created'),
+        ),
+        migrations.AddIndex(
+            model_name='surveyfeedback',
+            index=models.Index(fields=['-created_at'], name='core_feedback_created'),
+        ),
+        migrations.AddIndex(
+            model_name='surveyfeedback',
+            index=models.Index(fields=['sentiment'], name='core_feedback_sentiment'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_survey_feedback_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlternativeQuestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question_type', models.CharField(max_length=50)),
+                ('relationship', models.CharField(choices=[('friend', 'Friend'), ('family', 'Family'), ('coworker', 'Co-worker'), ('manager', 'Manager'), ('direct_report', 'Direct Report'), ('other', 'Other')], max_length=50)),
+                ('text', models.TextField()),
+                ('served_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['question_type', 'relationship', 'served_count'], name='core_altq_lookup')],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_alternativequestion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurveySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_hash', models.CharField(max_length=64)),
+                ('model_name', models.CharField(max_length=100)),
+                ('summary', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('survey', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='core.survey')),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-17 20:57
+
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+
+
+def backfill(apps, schema_editor):
+    SurveyFeedback = apps.get_model('core', 'SurveyFeedback')
+    SentimentCounter = apps.get_model('core', 'SentimentCounter')
+    SentimentDaily = apps.get_model('core', 'SentimentDaily')
+
+    SentimentCounter.objects.all().delete()
+    SentimentDaily.objects.all().delete()
+
+    totals = SurveyFeedback.objects.values('sentiment').annotate(n=Count('id'))
+    SentimentCounter.objects.bulk_create(
+        [SentimentCounter(sentiment=row['sentiment'], count=row['n']) for row in totals]
+    )
+    daily = (
+        SurveyFeedback.objects.annotate(day=TruncDate('created_at'))
+        .values('day', 'sentiment')
+        .annotate(n=Count('id'))
+    )
+    SentimentDaily.objects.bulk_create(
+        [SentimentDaily(day=row['day'], sentiment=row['sentiment'], count=row['n']) for row in daily],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_sentiment_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_backfill_sentiment_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='survey',
+            name='core_survey_user_created',
+        ),
+        migrations.AddIndex(
+            model_name='survey',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='core_survey_user_created'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-17 22:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_survey_keyset_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='surveyfeedback',
+            name='core_feedback_created',
+        ),
+        migrations.AddIndex(
+            model_name='surveyfeedback',
+            index=models.Index(fields=['-created_at', '-id'], name='core_feedback_created'),
+        ),
+    ]
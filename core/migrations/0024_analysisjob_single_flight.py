@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:10
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fail_duplicate_active_jobs(apps, schema_editor):
+    # Keep the newest queued/running job per profile; the constraint forbids the rest
+    AnalysisJob = apps.get_model('core', 'AnalysisJob')
+    active = AnalysisJob.objects.filter(status__in=['queued', 'running']).order_by('profile_id', '-created_at', '-id')
+    seen, duplicates = set(), []
+    for job_id, profile_id in active.values_list('id', 'profile_id'):
+        if profile_id in seen:
+            duplicates.append(job_id)
+        seen.add(profile_id)
+    AnalysisJob.objects.filter(id__in=duplicates).update(
+        status='failed',
+        locked_by='',
+        locked_at=None,
+        last_error="Superseded by a newer analysis of the same profile",
+        finished_at=timezone.now(),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_feedback_keyset_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_duplicate_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='analysisjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('profile',), name='core_job_one_active_per_profile'),
+        ),
+    ]
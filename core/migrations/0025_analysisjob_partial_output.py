@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_analysisjob_single_flight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analysisjob',
+            name='partial_output',
+            field=models.TextField(blank=True),
+        ),
+    ]
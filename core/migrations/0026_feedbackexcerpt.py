@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_analysisjob_partial_output'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedbackExcerpt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('question', models.CharField(max_length=50)),
+                ('text', models.TextField()),
+                ('terms', models.JSONField(default=dict)),
+                ('length', models.PositiveIntegerField(default=0)),
+                ('profile', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='excerpts', to='core.profile')),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='excerpts', to='core.survey')),
+            ],
+        ),
+    ]
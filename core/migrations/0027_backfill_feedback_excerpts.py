@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:16
+
+import re
+from collections import Counter
+
+from django.db import migrations
+
+# Frozen copy of core.retrieval as of this migration: later changes to the tokenizer or
+# the answer fields must not change what this backfill does (the live index is rebuilt
+# from the current code whenever a profile's feedback context is).
+ANSWER_FIELDS = [
+    ('energy_audit_answer', 'Energy Audit'),
+    ('stress_profile_answer', 'Stress Profile'),
+    ('glass_ceiling_answer', 'Glass Ceiling'),
+    ('future_self_answer', 'Future Self'),
+]
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = frozenset("""
+    a about after all also am an and any are as at be because been before being but by can
+    could did do does doing don't for from had has have having he her here him his how i i'm
+    if in into is it it's its just me more most my no not of on only or other our out over
+    she should so some such than that the their them then there these they this those to
+    too up very was we were what when where which while who why will with would you your
+""".split())
+
+
+def stem(token):
+    if len(token) > 4 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [stem(token) for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS and len(token) > 1]
+
+
+def backfill(apps, schema_editor):
+    Profile = apps.get_model('core', 'Profile')
+    Survey = apps.get_model('core', 'Survey')
+    FeedbackExcerpt = apps.get_model('core', 'FeedbackExcerpt')
+
+    FeedbackExcerpt.objects.all().delete()
+    profile_ids = dict(Profile.objects.values_list('user_id', 'id'))
+    batch = []
+    for survey in Survey.objects.filter(is_completed=True).iterator(chunk_size=500):
+        profile_id = profile_ids.get(survey.user_id)
+        if profile_id is None:
+            continue
+        for field, question in ANSWER_FIELDS:
+            text = (getattr(survey, field) or '').strip()
+            tokens = tokenize(text)
+            if tokens:
+                batch.append(FeedbackExcerpt(
+                    profile_id=profile_id, survey_id=survey.pk, question=question,
+                    text=text, terms=dict(Counter(tokens)), length=len(tokens),
+                ))
+        if len(batch) >= 1000:
+            FeedbackExcerpt.objects.bulk_create(batch)
+            batch = []
+    FeedbackExcerpt.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_feedbackexcerpt'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
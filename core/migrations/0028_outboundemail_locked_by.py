@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0027_backfill_feedback_excerpts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboundemail',
+            name='locked_by',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
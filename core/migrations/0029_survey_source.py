@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0028_outboundemail_locked_by'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='survey',
+            name='source',
+            field=models.CharField(choices=[('invite', 'Invite'), ('public_link', 'Public link')], default='invite', max_length=20),
+        ),
+    ]
@@ -1,7 +1,27 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.utils import timezone
 import uuid
 
+class SurveyQuerySet(models.QuerySet):
+    # Projections, so list and status paths don't load the free-text answers
+
+    def for_list(self):
+        # What an invitation card shows
+        return self.only('id', 'uuid', 'user_id', 'respondent_name', 'respondent_email', 'is_completed', 'created_at')
+
+    def for_status(self):
+        # Lookups that only need to know the survey exists, whose it is and whether it's done
+        return self.only('id', 'uuid', 'user_id', 'is_completed')
+
+    def for_context(self):
+        # What Profile.survey_context_section and the analysis prompts read
+        return self.only(
+            'id', 'user_id', 'created_at', 'respondent_name', 'relationship_type', 'relationship_context',
+            'energy_audit_answer', 'stress_profile_answer', 'glass_ceiling_answer', 'future_self_answer',
+        )
+
+
 class Survey(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='surveys')
@@ -23,6 +43,15 @@ class Survey(models.Model):
     relationship_type = models.CharField(max_length=50, choices=RELATIONSHIP_CHOICES, blank=True)
     relationship_context = models.TextField(blank=True, verbose_name="How do you know them?")
     
+    # How the respondent got the survey: a personal invite, or a signup through the public link
+    SOURCE_INVITE = 'invite'
+    SOURCE_PUBLIC_LINK = 'public_link'
+    SOURCE_CHOICES = [
+        (SOURCE_INVITE, 'Invite'),
+        (SOURCE_PUBLIC_LINK, 'Public link'),
+    ]
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES, default=SOURCE_INVITE)
+
     # Status
     is_completed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -43,6 +72,22 @@ class Survey(models.Model):
     # 5. Final Thoughts
     final_thoughts = models.TextField(blank=True, verbose_name="Final Thoughts")
     
+    class Meta:
+        indexes = [
+            # Completed surveys for a user (analysis, chat, context rebuilds). Partial rather than
+            # (user, is_completed): Django emits a bare boolean test, which SQLite only matches
+            # against an identical partial-index predicate.
+            models.Index(
+                fields=['user', 'created_at'],
+                condition=models.Q(is_completed=True),
+                name='core_survey_user_completed',
+            ),
+            # Dashboard invitation list, newest first (keyset pages on created_at, id)
+            models.Index(fields=['user', '-created_at', '-id'], name='core_survey_user_created'),
+        ]
+
+    objects = SurveyQuerySet.as_manager()
+
     def __str__(self):
         return f"Invite to {self.relationship_type or 'Anonymous'} ({self.user.username})"
 
@@ -52,9 +97,48 @@ class SurveyFeedback(models.Model):
     comment = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='core_feedback_created'),
+            models.Index(fields=['sentiment'], name='core_feedback_sentiment'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Remember the stored sentiment, so the counters can move it when it changes
+        instance = super().from_db(db, field_names, values)
+        instance._counted_sentiment = instance.__dict__.get('sentiment')
+        return instance
+
     def __str__(self):
         return f"Feedback for {self.survey}: {self.sentiment}"
 
+class ProfileQuerySet(models.QuerySet):
+    # Projections for the per-request profile lookups. The report HTML, the onboarding
+    # answers and the feedback_context document are only loaded where they are used.
+
+    def for_status(self):
+        return self.only('id', 'user_id', 'onboarding_completed', 'feedback_context_version', 'last_updated')
+
+    def for_report(self):
+        return self.only('id', 'user_id', 'ai_summary', 'last_updated')
+
+    def for_dashboard(self):
+        return self.defer('feedback_context', 'career_goal')
+
+    def for_context(self):
+        return self.only(
+            'id', 'user_id', 'feedback_context', 'feedback_context_version', *Profile.ONBOARDING_FIELDS,
+        )
+
+    def get_for_user(self, user):
+        # The user's profile through this projection, created if it is missing
+        try:
+            return self.get(user=user)
+        except Profile.DoesNotExist:
+            return Profile.objects.create(user=user)
+
+
 class Profile(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='profile')
     ai_summary = models.TextField(blank=True, null=True)
@@ -84,13 +168,140 @@ class Profile(models.Model):
     # Deprecated / Replaced (Keep for now or remove if fresh start? User just wiped DB so we can keep or repurpose)
     career_goal = models.TextField(blank=True) # Can be deprecated or kept as summary
 
+    objects = ProfileQuerySet.as_manager()
+
+    ONBOARDING_FIELDS = [
+        'current_role', 'responsibilities', 'family_context', 'core_values',
+        'vision_perfect_tuesday', 'vision_toast_test', 'vision_anti_vision',
+        'stress_response', 'internal_anchor',
+    ]
+
+    # Pre-built 360 context shared by the analysis and chat prompts.
+    # A list of {"key", "title", "body"} sections, patched whenever a survey completes or
+    # onboarding changes, so prompts never have to walk every survey again.
+    feedback_context = models.JSONField(default=list, blank=True)
+    feedback_context_version = models.PositiveIntegerField(default=0)  # 0 = never built
+
     def __str__(self):
         return f"Profile for {self.user.username}"
 
+    # --- Feedback context ---
+
+    def profile_context_sections(self):
+        return [
+            {
+                'key': 'user_context',
+                'title': 'USER CONTEXT',
+                'body': (
+                    f"Role: {self.current_role}\n"
+                    f"Responsibilities: {self.responsibilities}\n"
+                    f"Family: {self.family_context}\n"
+                    f"Values: {self.core_values}\n"
+                ),
+            },
+            {
+                'key': 'vision',
+                'title': '10-YEAR VISION',
+                'body': (
+                    f"Perfect Tuesday (2035): {self.vision_perfect_tuesday}\n"
+                    f"Toast Test: {self.vision_toast_test}\n"
+                    f"Anti-Vision: {self.vision_anti_vision}\n"
+                ),
+            },
+            {
+                'key': 'internal_os',
+                'title': 'INTERNAL OPERATING SYSTEM',
+                'body': (
+                    f"Stress Response: {self.stress_response}\n"
+                    f"The Anchor: {self.internal_anchor}\n"
+                ),
+            },
+        ]
+
+    @staticmethod
+    def survey_context_section(survey):
+        # The title names the respondent for the analysis document; anything shown to the
+        # coach chat or summarised per survey uses the anonymous body only
+        return {
+            'key': f"survey:{survey.pk}",
+            'title': f"Feedback from {survey.respondent_name}",
+            'body': (
+                f"Context: {survey.relationship_context}\n"
+                f"Energy Audit: {survey.energy_audit_answer}\n"
+                f"Stress Profile: {survey.stress_profile_answer}\n"
+                f"Glass Ceiling: {survey.glass_ceiling_answer}\n"
+                f"Future Self: {survey.future_self_answer}\n"
+            ),
+        }
+
+    def rebuild_feedback_context(self):
+        deferred = self.get_deferred_fields() & set(self.ONBOARDING_FIELDS)
+        if deferred:
+            self.refresh_from_db(fields=sorted(deferred))  # One query rather than one per field
+        surveys = list(Survey.objects.for_context().filter(user_id=self.user_id, is_completed=True).order_by('created_at', 'id'))
+        sections = self.profile_context_sections() + [self.survey_context_section(s) for s in surveys]
+
+        from .retrieval import index_surveys
+        with transaction.atomic():
+            # Excerpts before the version bump: retrieval caches its index per version
+            index_surveys(self.pk, surveys, replace_all=True)
+            self._store_feedback_context(sections)
+
+    def update_feedback_context(self, upsert=(), remove_keys=(), reindex=()):
+        # Patch individual sections in place under a row lock so concurrent
+        # survey completions for the same profile don't overwrite each other.
+        # `reindex`: surveys whose retrieval excerpts change with this patch, written in the
+        # same transaction before the version bump so no index is cached without them.
+        with transaction.atomic():
+            current = (
+                Profile.objects.select_for_update()
+                .only('feedback_context', 'feedback_context_version')
+                .get(pk=self.pk)
+            )
+            if not current.feedback_context_version:
+                # Never built: a full rebuild already includes the change
+                self.rebuild_feedback_context()
+                return
+
+            sections = [sec for sec in current.feedback_context if sec['key'] not in remove_keys]
+            for new_section in upsert:
+                for i, sec in enumerate(sections):
+                    if sec['key'] == new_section['key']:
+                        sections[i] = new_section
+                        break
+                else:
+                    sections.append(new_section)
+            if reindex:
+                from .retrieval import index_surveys
+                index_surveys(self.pk, reindex)
+            self._store_feedback_context(sections)
+
+    def _store_feedback_context(self, sections):
+        Profile.objects.filter(pk=self.pk).update(
+            feedback_context=sections,
+            feedback_context_version=models.F('feedback_context_version') + 1,
+        )
+        self.feedback_context = sections
+        self.refresh_from_db(fields=['feedback_context_version'])
+
+    def context_sections(self):
+        if not self.feedback_context_version:
+            self.rebuild_feedback_context()
+        return self.feedback_context
+
+    def get_feedback_context(self):
+        return self.format_context(self.context_sections())
+
+    @staticmethod
+    def format_context(sections):
+        return "".join(f"\n--- {sec['title']} ---\n{sec['body']}" for sec in sections)
+
 # Signal to create Profile automatically when User is created
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 
+from .fragment_cache import STATS_SCOPE, dashboard_scope, invalidate
+
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
@@ -98,7 +309,270 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def save_user_profile(sender, instance, **kwargs):
-    try:
-        instance.profile.save()
-    except Profile.DoesNotExist:
-        Profile.objects.create(user=instance)
\ No newline at end of file
+    # Only make sure the profile exists: re-saving it on every login would load and
+    # rewrite every text field (and could overwrite a concurrent context update)
+    if not Profile.objects.filter(user=instance).exists():
+        Profile.objects.create(user=instance)
+
+# Keep Profile.feedback_context in step with completed surveys
+@receiver(post_save, sender=Survey)
+def add_survey_to_feedback_context(sender, instance, **kwargs):
+    if not instance.is_completed:
+        return
+    profile = Profile.objects.only('id', 'user_id').filter(user_id=instance.user_id).first()
+    if profile:
+        profile.update_feedback_context(upsert=[Profile.survey_context_section(instance)], reindex=[instance])
+
+@receiver(post_delete, sender=Survey)
+def remove_survey_from_feedback_context(sender, instance, **kwargs):
+    if not instance.is_completed:
+        return
+    profile = Profile.objects.only('id', 'user_id').filter(user_id=instance.user_id).first()
+    if profile:
+        profile.update_feedback_context(remove_keys={f"survey:{instance.pk}"})
+
+# Drop cached dashboard / stats fragments when the rows they show change
+@receiver(post_save, sender=Survey)
+@receiver(post_delete, sender=Survey)
+def invalidate_survey_fragments(sender, instance, **kwargs):
+    invalidate(dashboard_scope(instance.user_id))
+
+@receiver(post_save, sender=Profile)
+def invalidate_profile_fragments(sender, instance, **kwargs):
+    invalidate(dashboard_scope(instance.user_id))
+
+@receiver(post_save, sender=SurveyFeedback)
+@receiver(post_delete, sender=SurveyFeedback)
+def invalidate_stats_fragments(sender, **kwargs):
+    invalidate(STATS_SCOPE)
+
+# Stats counters follow every saved and deleted SurveyFeedback, wherever it happens.
+# bulk_create() and queryset.update() send no signals: run `manage.py recount_sentiment`
+# after using them on feedback.
+@receiver(post_save, sender=SurveyFeedback)
+def count_feedback(sender, instance, created, **kwargs):
+    from .sentiment_stats import record_sentiment
+    old = None if created else getattr(instance, '_counted_sentiment', instance.sentiment)
+    record_sentiment(instance.created_at, instance.sentiment, old=old)
+    instance._counted_sentiment = instance.sentiment
+
+@receiver(post_delete, sender=SurveyFeedback)
+def remove_feedback_from_counters(sender, instance, **kwargs):
+    from .sentiment_stats import record_sentiment
+    record_sentiment(instance.created_at, None, old=getattr(instance, '_counted_sentiment', instance.sentiment))
+
+class SentimentCounter(models.Model):
+    # Running total of SurveyFeedback rows per sentiment (see core/sentiment_stats.py)
+    sentiment = models.CharField(max_length=50, unique=True)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.sentiment or '(none)'}: {self.count}"
+
+
+class SentimentDaily(models.Model):
+    # Same counts bucketed by the day the feedback was first given, for the stats time series
+    day = models.DateField()
+    sentiment = models.CharField(max_length=50)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'sentiment'], name='core_sentiment_daily_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} {self.sentiment or '(none)'}: {self.count}"
+
+
+class SurveySummary(models.Model):
+    # Condensed version of one completed survey (the "map" step of the profile analysis).
+    # `source_hash` is the cache key of the prompt that produced it, so an edited survey,
+    # prompt or model gets summarised again; unchanged surveys never are.
+    survey = models.OneToOneField(Survey, on_delete=models.CASCADE, related_name='summary')
+    source_hash = models.CharField(max_length=64)
+    model_name = models.CharField(max_length=100)
+    summary = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Summary of {self.survey}"
+
+
+class FeedbackExcerpt(models.Model):
+    # One survey answer as a retrieval unit for the coach chat (see core/retrieval.py).
+    # `terms` holds the answer's term counts, computed once when the survey completes,
+    # so searching never re-tokenises the feedback.
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='excerpts')
+    survey = models.ForeignKey(Survey, on_delete=models.CASCADE, related_name='excerpts')
+    question = models.CharField(max_length=50)
+    text = models.TextField()
+    terms = models.JSONField(default=dict)
+    length = models.PositiveIntegerField(default=0)  # Total terms, for BM25 length normalisation
+
+    def __str__(self):
+        return f"{self.question} excerpt of {self.survey}"
+
+
+class AnalysisJob(models.Model):
+    # Durable queue entry for a leadership-profile generation.
+    # Claimed and executed by `manage.py run_analysis_worker`, never by a web worker.
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    ACTIVE_STATUSES = [STATUS_QUEUED, STATUS_RUNNING]
+
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='analysis_jobs')
+    prompt = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+
+    # Retry bookkeeping
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    # Lock held by the worker currently executing the job
+    locked_by = models.CharField(max_length=255, blank=True)
+    locked_at = models.DateTimeField(blank=True, null=True)
+
+    # Report text streamed so far, flushed periodically while the job runs
+    partial_output = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='core_job_status_run_after'),
+        ]
+        constraints = [
+            # Single flight: at most one queued or running analysis per profile
+            models.UniqueConstraint(
+                fields=['profile'],
+                condition=models.Q(status__in=['queued', 'running']),
+                name='core_job_one_active_per_profile',
+            ),
+        ]
+
+    def __str__(self):
+        return f"Analysis job {self.pk} for {self.profile} ({self.status})"
+
+
+class GenerationCache(models.Model):
+    # Content-addressed store of finished Gemini generations.
+    # `key` is sha256(model + prompt), so identical inputs reuse the earlier output.
+    key = models.CharField(max_length=64, unique=True)
+    model_name = models.CharField(max_length=100)
+    output = models.TextField()
+    hits = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.model_name} generation {self.key[:12]}"
+
+
+class OutboundEmail(models.Model):
+    # Outbox row for one email. Web requests only insert these;
+    # `manage.py send_outbox` delivers them in batches over a single SMTP connection.
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    to_email = models.EmailField()
+    domain = models.CharField(max_length=255)  # Recipient domain, for per-domain rate limits
+    from_email = models.CharField(max_length=255)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    send_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    locked_by = models.CharField(max_length=32, blank=True)  # Claim token of the sender holding the row
+    locked_at = models.DateTimeField(blank=True, null=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'send_after'], name='core_outbox_status_send_after'),
+            models.Index(fields=['domain', 'sent_at'], name='core_outbox_domain_sent_at'),
+        ]
+
+    def __str__(self):
+        return f"Email to {self.to_email} ({self.status})"
+
+
+class AlternativeQuestion(models.Model):
+    # Pre-generated softer versions of the survey questions, served by the
+    # "I'm not sure" button instead of a live Gemini call (see core/question_bank.py).
+    QUESTION_TYPES = ['energy_audit', 'stress_profile', 'glass_ceiling', 'future_self']
+
+    question_type = models.CharField(max_length=50)
+    relationship = models.CharField(max_length=50, choices=Survey.RELATIONSHIP_CHOICES)
+    text = models.TextField()
+    served_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['question_type', 'relationship', 'served_count'], name='core_altq_lookup'),
+        ]
+
+    def __str__(self):
+        return f"{self.question_type} / {self.relationship}: {self.text[:50]}"
+
+
+class ChatSession(models.Model):
+    # One coaching conversation. The 360 context is rendered into `system_prompt` once
+    # (and again only when the feedback changes); each turn then sends just the rolling
+    # `summary` of older turns, the most recent messages and the new question.
+    profile = models.ForeignKey(Profile, on_delete=models.CASCADE, related_name='chat_sessions')
+    system_prompt = models.TextField()
+    context_version = models.PositiveIntegerField(default=0)  # Profile.feedback_context_version it was built from
+    summary = models.TextField(blank=True)
+    summarised_until = models.PositiveBigIntegerField(default=0)  # Last ChatMessage id folded into `summary`
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['profile', '-updated_at'], name='core_chat_profile_updated'),
+        ]
+
+    def __str__(self):
+        return f"Chat {self.pk} for {self.profile}"
+
+
+class ChatMessage(models.Model):
+    ROLE_USER = 'user'
+    ROLE_MODEL = 'model'
+    ROLE_CHOICES = [
+        (ROLE_USER, 'User'),
+        (ROLE_MODEL, 'Coach'),
+    ]
+
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    text = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.get_role_display()} message in chat {self.session_id}"
@@ -0,0 +1,162 @@
+import logging
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+# Outbox for transactional email.
+# Requests queue rows; `manage.py send_outbox` sends them in batches over one reused
+# SMTP connection, retrying with backoff and pacing each recipient domain.
+
+logger = logging.getLogger(__name__)
+
+
+def queue_email(subject, body, to_email, from_email=None):
+    return OutboundEmail.objects.create(**_outbox_fields(subject, body, to_email, from_email))
+
+
+def queue_emails(messages):
+    # messages: iterable of (subject, body, to_email)
+    return OutboundEmail.objects.bulk_create(
+        [OutboundEmail(**_outbox_fields(subject, body, to_email)) for subject, body, to_email in messages]
+    )
+
+
+def _outbox_fields(subject, body, to_email, from_email=None):
+    return {
+        'to_email': to_email,
+        'domain': to_email.rsplit('@', 1)[-1].lower(),
+        'from_email': from_email or settings.DEFAULT_FROM_EMAIL,
+        'subject': subject,
+        'body': body,
+    }
+
+
+def requeue_stale_emails():
+    # Rows left SENDING by a worker that died mid-batch go back to the queue
+    cutoff = timezone.now() - timedelta(seconds=settings.EMAIL_OUTBOX_LOCK_TIMEOUT)
+    return OutboundEmail.objects.filter(status=OutboundEmail.STATUS_SENDING, locked_at__lt=cutoff).update(
+        status=OutboundEmail.STATUS_PENDING, locked_by='', locked_at=None
+    )
+
+
+def claim_batch(size):
+    # Each claim writes its own token, and the batch is read back by that token: on
+    # SQLite select_for_update is a no-op, so two senders can pick the same ids, but only
+    # the one whose conditional update won a row gets it back.
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        ids = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboundEmail.STATUS_PENDING, send_after__lte=timezone.now())
+            .order_by('send_after', 'id')
+            .values_list('id', flat=True)[:size]
+        )
+        if not ids:
+            return []
+        OutboundEmail.objects.filter(id__in=ids, status=OutboundEmail.STATUS_PENDING).update(
+            status=OutboundEmail.STATUS_SENDING, locked_by=token, locked_at=timezone.now()
+        )
+    return list(OutboundEmail.objects.filter(locked_by=token, status=OutboundEmail.STATUS_SENDING).order_by('send_after', 'id'))
+
+
+def apply_domain_limits(batch):
+    # Split the batch into rows we may send now and rows that would exceed
+    # EMAIL_DOMAIN_RATE_LIMIT messages per minute for their recipient domain.
+    limit = settings.EMAIL_DOMAIN_RATE_LIMIT
+    if not limit:
+        return batch, []
+
+    window_start = timezone.now() - timedelta(minutes=1)
+    recent = dict(
+        OutboundEmail.objects.filter(domain__in={e.domain for e in batch}, sent_at__gte=window_start)
+        .values_list('domain')
+        .annotate(n=Count('id'))
+    )
+    used = Counter(recent)
+
+    allowed, deferred = [], []
+    for email in batch:
+        if used[email.domain] < limit:
+            used[email.domain] += 1
+            allowed.append(email)
+        else:
+            deferred.append(email)
+    return allowed, deferred
+
+
+def retry_delay(attempts):
+    # 30s, 60s, 120s, ... capped at one hour
+    return min(30 * (2 ** max(attempts - 1, 0)), 3600)
+
+
+def mark_failed(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    email.locked_by = ''
+    email.locked_at = None
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = OutboundEmail.STATUS_FAILED
+    else:
+        email.status = OutboundEmail.STATUS_PENDING
+        email.send_after = timezone.now() + timedelta(seconds=retry_delay(email.attempts))
+    email.save(update_fields=['attempts', 'last_error', 'locked_by', 'locked_at', 'status', 'send_after'])
+
+
+def send_batch(batch):
+    allowed, deferred = apply_domain_limits(batch)
+    if deferred:
+        OutboundEmail.objects.filter(id__in=[e.id for e in deferred]).update(
+            status=OutboundEmail.STATUS_PENDING,
+            locked_by='',
+            locked_at=None,
+            send_after=timezone.now() + timedelta(minutes=1),
+        )
+    if not allowed:
+        return 0
+
+    # One connection (and one TLS handshake) for the whole batch
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        logger.error("Outbox: could not connect: %s", e)
+        for email in allowed:
+            mark_failed(email, e)
+        return 0
+
+    sent = 0
+    try:
+        for email in allowed:
+            message = EmailMessage(
+                subject=email.subject,
+                body=email.body,
+                from_email=email.from_email,
+                to=[email.to_email],
+                connection=connection,
+            )
+            try:
+                connection.send_messages([message])
+            except Exception as e:
+                logger.warning("Outbox: sending email %s to %s failed: %s", email.pk, email.to_email, e)
+                mark_failed(email, e)
+                continue
+
+            OutboundEmail.objects.filter(pk=email.pk).update(
+                status=OutboundEmail.STATUS_SENT,
+                attempts=email.attempts + 1,
+                locked_by='',
+                locked_at=None,
+                sent_at=timezone.now(),
+            )
+            sent += 1
+    finally:
+        connection.close()
+    return sent
@@ -0,0 +1,111 @@
+import base64
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .models import Survey, SurveyFeedback
+
+# Keyset (cursor) pagination for the dashboard invitation list and the feedback API.
+# Pages are ordered by (created_at, id) descending, which the core_survey_user_created
+# and core_feedback_created indexes serve directly, and continue strictly after the last
+# row of the previous page, so deep pages cost the same as the first and nothing shifts
+# when rows are added.
+
+def encode_cursor(row):
+    raw = f"{row.created_at.isoformat()}|{row.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    # Raises ValueError for anything that isn't a cursor we issued
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.split('|')
+        created_at = datetime.fromisoformat(created_at)
+        pk = int(pk)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {e}") from e
+    if created_at.tzinfo is None:
+        raise ValueError("Invalid cursor: naive timestamp")
+    return created_at, pk
+
+
+class KeysetPage:
+    """One page of `queryset()`, newest first. Queried on first access."""
+
+    def __init__(self, cursor, size):
+        self.after = decode_cursor(cursor) if cursor else None
+        self.size = size
+
+    def queryset(self):
+        raise NotImplementedError
+
+    @cached_property
+    def rows(self):
+        rows = self.queryset().order_by('-created_at', '-id')
+        if self.after:
+            created_at, pk = self.after
+            rows = rows.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+        return list(rows[:self.size + 1])  # One extra row tells us whether there is a next page
+
+    @property
+    def items(self):
+        return self.rows[:self.size]
+
+    @property
+    def next_cursor(self):
+        if len(self.rows) > self.size:
+            return encode_cursor(self.rows[self.size - 1])
+        return None
+
+
+class SurveyPage(KeysetPage):
+    """One page of a user's invitations."""
+
+    def __init__(self, user_id, cursor=None, size=None):
+        self.user_id = user_id
+        super().__init__(cursor, size or settings.DASHBOARD_PAGE_SIZE)
+
+    def queryset(self):
+        return Survey.objects.for_list().filter(user_id=self.user_id)
+
+    @property
+    def surveys(self):
+        return self.items
+
+
+class FeedbackPage(KeysetPage):
+    """One page of all feedback, optionally limited to `since <= created_at < until`."""
+
+    def __init__(self, cursor=None, size=None, since=None, until=None):
+        self.since = since
+        self.until = until
+        super().__init__(cursor, size or settings.FEEDBACK_PAGE_SIZE)
+
+    def queryset(self):
+        # One join instead of a survey and a user query per row
+        feedback = SurveyFeedback.objects.select_related('survey__user').only(
+            'id', 'sentiment', 'comment', 'created_at',
+            'survey__id', 'survey__uuid', 'survey__relationship_type', 'survey__user__username',
+        )
+        if self.since:
+            feedback = feedback.filter(created_at__gte=self.since)
+        if self.until:
+            feedback = feedback.filter(created_at__lt=self.until)
+        return feedback
+
+    def next_page(self):
+        if self.next_cursor:
+            return FeedbackPage(self.next_cursor, self.size, self.since, self.until)
+        return None
+
+    async def abatches(self):
+        # This page and every later one, each queried in a worker thread; only one
+        # page is held in memory at a time
+        page = self
+        while page is not None:
+            yield await sync_to_async(lambda: page.items)()
+            page = page.next_page()
@@ -0,0 +1,99 @@
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Token budgeting for LLM prompts.
+# A PromptBuilder collects the context sections of a prompt, estimates their size and
+# fits them into a token budget: required sections are always kept, the rest are kept
+# by priority (highest first, ties in insertion order) and the first one that no longer
+# fits is truncated. The same input always produces the same prompt, so the result
+# stays usable as a generation-cache key.
+
+TRUNCATION_MARKER = "\n[... truncated to fit the prompt budget]\n"
+MIN_TRUNCATED_TOKENS = 64  # Below this a cut-down section is dropped instead
+
+
+def estimate_tokens(text):
+    # Offline estimate (ceil of chars / LLM_CHARS_PER_TOKEN); no API round trip per prompt
+    return -(-len(text) // settings.LLM_CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text, tokens):
+    return text[:max(tokens, 0) * settings.LLM_CHARS_PER_TOKEN]
+
+
+class PromptBuilder:
+    def __init__(self, name, budget):
+        self.name = name
+        self.budget = budget
+        self.sections = []
+        self.report = []
+
+    def add(self, key, title, body, priority=0, required=False):
+        self.sections.append({
+            'key': key, 'title': title, 'body': body,
+            'priority': priority, 'required': required,
+        })
+        return self
+
+    def add_feedback_context(self, sections):
+        # Onboarding answers are always sent; surveys compete for the rest of the budget,
+        # newest first (sections are stored oldest first).
+        for position, sec in enumerate(sections):
+            is_survey = sec['key'].startswith('survey:')
+            self.add(sec['key'], sec['title'], sec['body'], priority=position, required=not is_survey)
+        return self
+
+    def fit(self, available):
+        # Returns {index: body} for the sections that make it into the prompt
+        kept = {}
+        order = sorted(
+            range(len(self.sections)),
+            key=lambda i: (not self.sections[i]['required'], -self.sections[i]['priority'], i),
+        )
+        for i in order:
+            sec = self.sections[i]
+            cost = estimate_tokens(f"\n--- {sec['title']} ---\n{sec['body']}")
+            if sec['required'] or cost <= available:
+                kept[i] = sec['body']
+                available -= cost
+            elif available - estimate_tokens(TRUNCATION_MARKER) >= MIN_TRUNCATED_TOKENS:
+                overhead = estimate_tokens(f"\n--- {sec['title']} ---\n") + estimate_tokens(TRUNCATION_MARKER)
+                kept[i] = truncate_to_tokens(sec['body'], available - overhead) + TRUNCATION_MARKER
+                available = 0
+        return kept
+
+    def build(self, render):
+        # `render` turns the joined context text into the full prompt
+        available = self.budget - estimate_tokens(render(""))
+        kept = self.fit(available)
+
+        parts = []
+        self.report = []
+        for i, sec in enumerate(self.sections):
+            body = kept.get(i)
+            if body is not None:
+                parts.append(f"\n--- {sec['title']} ---\n{body}")
+            self.report.append({
+                'key': sec['key'],
+                'tokens': estimate_tokens(sec['body']),
+                'sent': 'dropped' if body is None else ('truncated' if body != sec['body'] else 'full'),
+            })
+
+        prompt = render("".join(parts))
+        self.log(prompt)
+        return prompt
+
+    def log(self, prompt):
+        tokens = estimate_tokens(prompt)
+        truncated = sum(1 for row in self.report if row['sent'] == 'truncated')
+        dropped = sum(1 for row in self.report if row['sent'] == 'dropped')
+        level = logging.WARNING if tokens > self.budget else logging.INFO
+        logger.log(
+            level, "prompt=%s tokens=%d budget=%d sections=%d truncated=%d dropped=%d",
+            self.name, tokens, self.budget, len(self.sections), truncated, dropped,
+        )
+        for row in self.report:
+            logger.debug("prompt=%s section=%s tokens=%d sent=%s", self.name, row['key'], row['tokens'], row['sent'])
@@ -0,0 +1,86 @@
+import re
+
+from django.db.models import F
+
+from . import llm
+from .models import AlternativeQuestion, Survey
+
+# Bank of alternative survey questions.
+# The inputs are only question_type x relationship, so every pair is generated ahead of
+# time (`manage.py fill_question_bank`) and served by rotation; the live LLM call is
+# only a fallback for pairs the bank doesn't cover yet.
+
+QUESTION_CONTEXT = {
+    'energy_audit': "The original question asked about 'flow state' and competence vs genius.",
+    'stress_profile': "The original question asked about their 'stress character' or shadow side.",
+    'glass_ceiling': "The original question asked about a 'hard truth' or behavior limiting their potential.",
+    'future_self': "The original question asked to imagine them 3 years from now as a leader.",
+}
+
+RELATIONSHIPS = [value for value, _ in Survey.RELATIONSHIP_CHOICES]
+
+
+def normalise_relationship(relationship):
+    return relationship if relationship in RELATIONSHIPS else 'other'
+
+
+def alternative_prompt(question_type, relationship, count=1):
+    specific_context = QUESTION_CONTEXT.get(question_type, "General leadership feedback.")
+    if count == 1:
+        objective = f'Generate a SINGLE, simple, open-ended interview question for a respondent who knows the subject as a "{relationship}".'
+        output = "Output ONLY the text of the new question. No quotes, no intro."
+    else:
+        objective = f'Generate {count} DIFFERENT simple, open-ended interview questions for a respondent who knows the subject as a "{relationship}".'
+        output = "Output ONLY the questions, one per line. No numbering, no quotes, no intro."
+
+    return f"""
+    Objective: {objective}
+    
+    Constraint: The respondent clicked "I'm not sure" on a deep psychological question about "{question_type}".
+    Context of original question: {specific_context}
+    
+    Task: Create a softer, broader, easier-to-answer alternative question that still gets at the same underlying insight but requires less specific observation.
+    
+    Example for 'Stress': 
+    - Hard: "Who do they turn into when threatened?"
+    - Easy: "When things get difficult at work, how do you typically see them react?"
+
+    {output}
+    """
+
+
+def parse_questions(text):
+    questions = []
+    for line in text.splitlines():
+        line = re.sub(r'^\s*(?:[-*•]|\d+[.)])\s*', '', line).strip().strip('"').strip()
+        if line.endswith('?') and line not in questions:
+            questions.append(line)
+    return questions
+
+
+async def aserve_alternative(question_type, relationship):
+    # Least-served first, so every stored variant gets rotated through
+    entry = await (
+        AlternativeQuestion.objects.filter(question_type=question_type, relationship=relationship)
+        .order_by('served_count', '?')
+        .only('id', 'text')
+        .afirst()
+    )
+    if entry is None:
+        return None
+    await AlternativeQuestion.objects.filter(pk=entry.pk).aupdate(served_count=F('served_count') + 1)
+    return entry.text
+
+
+def fill_pair(question_type, relationship, per_pair):
+    missing = per_pair - AlternativeQuestion.objects.filter(
+        question_type=question_type, relationship=relationship
+    ).count()
+    if missing <= 0:
+        return 0
+    questions = parse_questions(llm.generate(alternative_prompt(question_type, relationship, count=missing)))
+    AlternativeQuestion.objects.bulk_create([
+        AlternativeQuestion(question_type=question_type, relationship=relationship, text=q)
+        for q in questions[:missing]
+    ])
+    return len(questions[:missing])
@@ -0,0 +1,198 @@
+import math
+import random
+import time
+import uuid
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+
+# Admission control for the public and LLM-backed endpoints.
+# `rate_limit` is a cache-backed token bucket per client IP, user, public link or survey:
+# each bucket holds up to `burst` requests and refills over `period` seconds (both from
+# settings.RATE_LIMITS). LLMSlot caps LLM calls in flight across every web process.
+# Either way, a request over the limit gets an immediate 429 with Retry-After instead of
+# waiting for a worker until the server's request timeout.
+# State lives in the 'ratelimit' cache, which every process must share and whose add()
+# must be atomic: Redis, or the database cache (check_rate_limit_cache enforces this).
+# Buckets are read-modify-write without a lock, so concurrent requests can slip a token
+# or two past the limit; that is fine for admission control.
+
+SHARED_BACKENDS = (
+    'django.core.cache.backends.redis.RedisCache',
+    'django.core.cache.backends.db.DatabaseCache',
+)
+
+
+def store():
+    return caches['ratelimit']
+
+
+@checks.register(checks.Tags.caches)
+def check_rate_limit_cache(app_configs, **kwargs):
+    # The file cache's add() is check-then-write and its culling can drop live keys, so
+    # two processes could both take one LLM slot; a per-process cache isn't shared at all
+    backend = settings.CACHES.get('ratelimit', {}).get('BACKEND')
+    if not settings.RATE_LIMIT_ENABLED or settings.DEBUG or backend in SHARED_BACKENDS:
+        return []
+    return [checks.Error(
+        f"The 'ratelimit' cache uses {backend}, which is not shared atomically between processes.",
+        hint="Use Redis or the database cache for it, or set RATE_LIMIT_ENABLED=False.",
+        id='core.E001',
+    )]
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+def refill(state, burst, period, now):
+    # Returns (tokens now, seconds until the next token if none is left)
+    rate = burst / period
+    tokens, stamp = state or (burst, now)
+    tokens = min(burst, tokens + (now - stamp) * rate)
+    return tokens, (0 if tokens >= 1 else (1 - tokens) / rate)
+
+
+def take(key, burst, period):
+    # Returns 0 when a token was taken, else the seconds until one will be available
+    now = time.time()
+    tokens, wait = refill(store().get(key), burst, period, now)
+    if not wait:
+        store().set(key, (tokens - 1, now), period)
+    return wait
+
+
+async def atake(key, burst, period):
+    now = time.time()
+    tokens, wait = refill(await store().aget(key), burst, period, now)
+    if not wait:
+        await store().aset(key, (tokens - 1, now), period)
+    return wait
+
+
+def client_ip(request):
+    # Behind RATE_LIMIT_PROXY_COUNT trusted proxies the client is that many entries from
+    # the right of X-Forwarded-For; anything further left is client-supplied
+    proxies = settings.RATE_LIMIT_PROXY_COUNT
+    forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+    if proxies and len(forwarded) >= proxies:
+        return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def scope_value(scope, request, kwargs, user):
+    if scope == 'ip':
+        return client_ip(request)
+    if scope == 'user':
+        return user.pk if user is not None and user.is_authenticated else f"ip:{client_ip(request)}"
+    # 'link' / 'survey': the uuid in the URL
+    return str(kwargs['uuid'])
+
+
+def too_many_requests(request, retry_after):
+    seconds = max(1, math.ceil(retry_after))
+    if request.content_type == 'application/json':
+        response = JsonResponse({'error': 'Too many requests. Please try again shortly.', 'retry_after': seconds}, status=429)
+    else:
+        response = HttpResponse(f"Too many requests. Please try again in {seconds} seconds.", status=429, content_type='text/plain')
+    response['Retry-After'] = str(seconds)
+    return response
+
+
+def rate_limit(name, by=('ip',), methods=('POST',)):
+    """Limit `methods` requests to the view with one token bucket per `by` scope
+    ('ip', 'user', 'link', 'survey'), sized by settings.RATE_LIMITS[f"{name}:{scope}"].
+    Works on sync and async views."""
+
+    def buckets(request, kwargs, user):
+        if not settings.RATE_LIMIT_ENABLED or request.method not in methods:
+            return
+        for scope in by:
+            burst, period = settings.RATE_LIMITS[f"{name}:{scope}"]
+            yield f"ratelimit:{name}:{scope}:{scope_value(scope, request, kwargs, user)}", burst, period
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+            async def wrapper(request, *args, **kwargs):
+                user = await request.auser() if 'user' in by else None
+                for key, burst, period in buckets(request, kwargs, user):
+                    wait = await atake(key, burst, period)
+                    if wait:
+                        return too_many_requests(request, wait)
+                return await view(request, *args, **kwargs)
+        else:
+            def wrapper(request, *args, **kwargs):
+                user = request.user if 'user' in by else None
+                for key, burst, period in buckets(request, kwargs, user):
+                    wait = take(key, burst, period)
+                    if wait:
+                        return too_many_requests(request, wait)
+                return view(request, *args, **kwargs)
+
+        return wraps(view)(wrapper)
+
+    return decorator
+
+
+class LLMSlot:
+    """One of LLM_GLOBAL_MAX_IN_FLIGHT cache-held slots for the duration of an LLM call.
+    Acquiring raises RateLimited when all are taken. A slot left behind by a crashed
+    process expires after LLM_SLOT_TIMEOUT, so the cap can't leak away."""
+
+    def __init__(self):
+        self.key = None
+        self.token = uuid.uuid4().hex
+
+    @staticmethod
+    def keys():
+        # Every slot, starting at a random one to spread processes over them
+        capacity = settings.LLM_GLOBAL_MAX_IN_FLIGHT
+        start = random.randrange(capacity)
+        return [f"ratelimit:llm-slot:{(start + i) % capacity}" for i in range(capacity)]
+
+    @classmethod
+    async def available(cls):
+        # Unreserved check, for failing fast before work that takes a slot later
+        return len(await store().aget_many(cls.keys())) < settings.LLM_GLOBAL_MAX_IN_FLIGHT
+
+    def acquire(self):
+        for key in self.keys():
+            if store().add(key, self.token, settings.LLM_SLOT_TIMEOUT):
+                self.key = key
+                return self
+        raise RateLimited(settings.LLM_BUSY_RETRY_AFTER)
+
+    async def aacquire(self):
+        for key in self.keys():
+            if await store().aadd(key, self.token, settings.LLM_SLOT_TIMEOUT):
+                self.key = key
+                return self
+        raise RateLimited(settings.LLM_BUSY_RETRY_AFTER)
+
+    def release(self):
+        if self.key and store().get(self.key) == self.token:
+            store().delete(self.key)
+        self.key = None
+
+    async def arelease(self):
+        if self.key and await store().aget(self.key) == self.token:
+            await store().adelete(self.key)
+        self.key = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+    async def __aenter__(self):
+        return await self.aacquire()
+
+    async def __aexit__(self, *exc):
+        await self.arelease()
@@ -0,0 +1,151 @@
+import math
+import re
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import FeedbackExcerpt
+
+# Local BM25 retrieval over a user's survey answers, for the coach chat.
+# Each completed survey is split into one FeedbackExcerpt per answer with its term counts
+# stored alongside. At question time the profile's excerpts are compiled into a postings
+# index (NumPy arrays, cached per feedback_context_version so any change rebuilds it) and
+# scored against the question, and only the top-k answers go into the chat turn.
+# Everything runs in-process: no embedding API, no network.
+
+ANSWER_FIELDS = [
+    ('energy_audit_answer', 'Energy Audit'),
+    ('stress_profile_answer', 'Stress Profile'),
+    ('glass_ceiling_answer', 'Glass Ceiling'),
+    ('future_self_answer', 'Future Self'),
+]
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = frozenset("""
+    a about after all also am an and any are as at be because been before being but by can
+    could did do does doing don't for from had has have having he her here him his how i i'm
+    if in into is it it's its just me more most my no not of on only or other our out over
+    she should so some such than that the their them then there these they this those to
+    too up very was we were what when where which while who why will with would you your
+""".split())
+
+
+def stem(token):
+    # Plural folding only ("manages" / "manage"): cheap, and never merges unrelated words
+    if len(token) > 4 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [stem(token) for token in TOKEN_RE.findall(text.lower()) if token not in STOPWORDS and len(token) > 1]
+
+
+# --- Indexing (when surveys complete) ---
+
+def survey_excerpts(profile_id, survey):
+    excerpts = []
+    for field, question in ANSWER_FIELDS:
+        text = (getattr(survey, field) or '').strip()
+        tokens = tokenize(text)
+        if tokens:
+            excerpts.append(FeedbackExcerpt(
+                profile_id=profile_id, survey_id=survey.pk, question=question,
+                text=text, terms=dict(Counter(tokens)), length=len(tokens),
+            ))
+    return excerpts
+
+
+def index_surveys(profile_id, surveys, replace_all=False):
+    # Replace the excerpts of `surveys` (or of the whole profile). Deleted surveys
+    # take theirs with them (on_delete=CASCADE).
+    stale = FeedbackExcerpt.objects.filter(profile_id=profile_id)
+    if not replace_all:
+        stale = stale.filter(survey_id__in=[survey.pk for survey in surveys])
+    stale.delete()
+    excerpts = [excerpt for survey in surveys for excerpt in survey_excerpts(profile_id, survey)]
+    FeedbackExcerpt.objects.bulk_create(excerpts, batch_size=500)
+
+
+# --- Search (per chat turn) ---
+
+class ExcerptIndex:
+    """Term-major postings of one profile's excerpts: for term t, rows
+    doc_ids[offsets[t]:offsets[t + 1]] contain it tf[...] times."""
+
+    def __init__(self, rows):
+        # rows: [(excerpt_id, terms, length)]
+        self.ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.lengths = np.array([row[2] for row in rows], dtype=np.float32)
+        self.avg_length = float(self.lengths.mean()) if rows else 0.0
+
+        postings = {}
+        for doc, (_, terms, _) in enumerate(rows):
+            for term, count in terms.items():
+                postings.setdefault(term, []).append((doc, count))
+        self.vocabulary = {term: i for i, term in enumerate(postings)}
+        self.offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum([len(p) for p in postings.values()])
+        pairs = [pair for p in postings.values() for pair in p]
+        self.doc_ids = np.array([doc for doc, _ in pairs], dtype=np.int64)
+        self.tf = np.array([count for _, count in pairs], dtype=np.float32)
+
+    def scores(self, query_terms):
+        n_docs = len(self.ids)
+        scores = np.zeros(n_docs, dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths / (self.avg_length or 1))
+        for term in set(query_terms):
+            t = self.vocabulary.get(term)
+            if t is None:
+                continue
+            docs = self.doc_ids[self.offsets[t]:self.offsets[t + 1]]
+            tf = self.tf[self.offsets[t]:self.offsets[t + 1]]
+            idf = math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + norm[docs])
+        return scores
+
+    def top(self, query_terms, k):
+        # Excerpt ids of the k best matches, best first; the newest answers when nothing matches
+        if not len(self.ids):
+            return []
+        scores = self.scores(query_terms)
+        k = min(k, len(self.ids))
+        if not scores.any():
+            return self.ids[np.argsort(-self.ids)[:k]].tolist()
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        return self.ids[best[scores[best] > 0]].tolist()
+
+
+def index_for(profile):
+    # Compiled once per context version: every survey change bumps it
+    key = f"excerpt-index:{profile.pk}:{profile.feedback_context_version}"
+    index = cache.get(key)
+    if index is None:
+        rows = list(FeedbackExcerpt.objects.filter(profile_id=profile.pk).order_by('id').values_list('id', 'terms', 'length'))
+        index = ExcerptIndex(rows)
+        cache.set(key, index, settings.CHAT_INDEX_CACHE_TIMEOUT)
+    return index
+
+
+def relevant_excerpts(profile, query, k=None):
+    ids = index_for(profile).top(tokenize(query), k or settings.CHAT_RETRIEVAL_TOP_K)
+    if not ids:
+        return []
+    excerpts = FeedbackExcerpt.objects.select_related('survey').only(
+        'id', 'question', 'text', 'survey__id', 'survey__relationship_type',
+    ).in_bulk(ids)
+    return [excerpts[pk] for pk in ids if pk in excerpts]
+
+
+def format_excerpts(excerpts):
+    # Respondents stay anonymous: relationship and question only
+    return "\n".join(
+        f"- ({excerpt.survey.get_relationship_type_display() or 'Respondent'}, {excerpt.question}) {excerpt.text}"
+        for excerpt in excerpts
+    )
@@ -0,0 +1,70 @@
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import SentimentCounter, SentimentDaily, SurveyFeedback
+
+# Materialised SurveyFeedback aggregates.
+# Totals per sentiment and per (day, sentiment) are adjusted with atomic F() updates as
+# feedback is given, changed or deleted (signals in core/models.py), so the stats page
+# reads a handful of rows instead of counting the whole feedback table. recount()
+# rebuilds them from the feedback table after bulk writes that send no signals.
+
+
+def bump(model, delta, **lookup):
+    if model.objects.filter(**lookup).update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():  # Savepoint: a concurrent insert may win the race
+            model.objects.create(count=delta, **lookup)
+    except IntegrityError:
+        model.objects.filter(**lookup).update(count=F('count') + delta)
+
+
+def record_sentiment(created_at, new, old=None):
+    # `old` is the previous sentiment of an edited feedback, None for a new one
+    if old == new:
+        return
+    day = timezone.localdate(created_at)
+    if old is not None:
+        bump(SentimentCounter, -1, sentiment=old)
+        bump(SentimentDaily, -1, day=day, sentiment=old)
+    if new is not None:
+        bump(SentimentCounter, 1, sentiment=new)
+        bump(SentimentDaily, 1, day=day, sentiment=new)
+
+
+def recount():
+    # Returns the number of feedback rows counted
+    daily = (
+        SurveyFeedback.objects.annotate(day=TruncDate('created_at'))
+        .values_list('day', 'sentiment').annotate(n=Count('id')).order_by()
+    )
+    totals = {}
+    with transaction.atomic():
+        SentimentCounter.objects.all().delete()
+        SentimentDaily.objects.all().delete()
+        rows = []
+        for day, sentiment, n in daily:
+            rows.append(SentimentDaily(day=day, sentiment=sentiment, count=n))
+            totals[sentiment] = totals.get(sentiment, 0) + n
+        SentimentDaily.objects.bulk_create(rows, batch_size=500)
+        SentimentCounter.objects.bulk_create([SentimentCounter(sentiment=s, count=n) for s, n in totals.items()])
+    return sum(totals.values())
+
+
+def sentiment_totals():
+    return dict(SentimentCounter.objects.values_list('sentiment', 'count'))
+
+
+def daily_series(days):
+    # [{'day', 'counts': {sentiment: n}, 'total'}] for the last `days` days, oldest first
+    start = timezone.localdate() - timedelta(days=days - 1)
+    series = {start + timedelta(days=i): {} for i in range(days)}
+    for day, sentiment, count in SentimentDaily.objects.filter(day__gte=start).values_list('day', 'sentiment', 'count'):
+        if day in series:
+            series[day][sentiment] = count
+    return [{'day': day, 'counts': counts, 'total': sum(counts.values())} for day, counts in series.items()]
@@ -1,3 +1,1462 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import re
+import threading
+import time
+import warnings
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core import mail
+from django.core.cache import caches
+from django.core.cache.backends.base import CacheKeyWarning
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Count, Q
+from django.db.models.query import QuerySet
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import benchmarks, llm, outbox, question_bank
+from .analysis import build_analysis_prompt, prompt_for_job
+from .generation_cache import cache_key, get_cached_generation, store_generation
+from .jobs import claim_next_job, enqueue_analysis, process_job, requeue_stale_jobs
+from .llm import FakeBackend
+from .outbox import queue_emails
+from .models import AlternativeQuestion, AnalysisJob, ChatSession, FeedbackExcerpt, GenerationCache, OutboundEmail, Profile, Survey, SurveyFeedback, SurveySummary
+from .ratelimit import LLMSlot, check_rate_limit_cache
+from .question_bank import parse_questions
+from .prompts import PromptBuilder, TRUNCATION_MARKER, estimate_tokens
+from .pagination import FeedbackPage, SurveyPage
+from .retrieval import ExcerptIndex
+from .sentiment_stats import daily_series, sentiment_totals
+from .themes import profile_themes, question_themes, themes_summary
+from .views import parse_invite_rows, sse_event
+
+
+@override_settings(
+    CACHES=benchmarks.LOCAL_CACHES,
+    LLM_BACKEND='core.tests.FailingStreamBackend',
+    ANALYSIS_JOB_MAX_ATTEMPTS=2,
+    ANALYSIS_JOB_RETRY_BACKOFF=15,
+)
+class AnalysisJobQueueTests(TestCase):
+    """Analysis runs as queued jobs: claimed once, retried with backoff, recovered when stale."""
+
+    def setUp(self):
+        self.profile = benchmarks.seed_user(2, 'queued').profile
+        self.job, _ = enqueue_analysis(self.profile, "analysis prompt")
+
+    def test_a_job_is_claimed_by_one_worker_only(self):
+        # On SQLite both workers select the same queued row; the conditional update decides
+        update = QuerySet.update
+        rival = []
+
+        def racing_update(queryset, **fields):
+            if fields.get('status') == AnalysisJob.STATUS_RUNNING and not rival:
+                rival.append(None)
+                rival[0] = claim_next_job('worker-b')
+            return update(queryset, **fields)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=racing_update):
+            self.assertIsNone(claim_next_job('worker-a'))
+        self.assertEqual((rival[0].pk, rival[0].locked_by, rival[0].attempts), (self.job.pk, 'worker-b', 1))
+        self.assertIsNone(claim_next_job('worker-c'))  # Nothing else queued
+
+    def test_failures_retry_with_backoff_then_give_up(self):
+        job = claim_next_job('worker')
+        with self.assertLogs('core.jobs', 'ERROR') as logs:
+            self.assertFalse(process_job(job))
+        self.assertIn('(will retry)', logs.output[0])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), (AnalysisJob.STATUS_QUEUED, ''))
+        self.assertIn('Connection reset', job.last_error)
+        delay = (job.run_after - timezone.now()).total_seconds()
+        self.assertTrue(10 < delay <= 15, delay)
+        self.assertIsNone(claim_next_job('worker'))  # Not due yet
+
+        AnalysisJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        job = claim_next_job('worker')
+        self.assertEqual(job.attempts, 2)
+        with self.assertLogs('core.jobs', 'ERROR') as logs:
+            self.assertFalse(process_job(job))  # Last attempt
+        self.assertIn('(giving up)', logs.output[0])
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.STATUS_FAILED)
+        self.profile.refresh_from_db()
+        self.assertIn('Error during analysis: Connection reset', self.profile.ai_summary)
+
+    def test_jobs_of_dead_workers_are_requeued(self):
+        stale = timezone.now() - timedelta(seconds=settings.ANALYSIS_JOB_TIMEOUT * 2 + 1)
+        claim_next_job('dead-worker')
+        AnalysisJob.objects.filter(pk=self.job.pk).update(locked_at=stale)
+
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.locked_by), (AnalysisJob.STATUS_QUEUED, ''))
+
+        # One that already used its last attempt fails instead of running a third time
+        claim_next_job('dead-worker')
+        AnalysisJob.objects.filter(pk=self.job.pk).update(locked_at=stale, attempts=2)
+        requeue_stale_jobs()
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, AnalysisJob.STATUS_FAILED)
+
+    @override_settings(LLM_BACKEND='fake', ANALYSIS_JOB_TIMEOUT=0)
+    def test_runs_over_the_timeout_are_abandoned(self):
+        job = claim_next_job('worker')
+        with self.assertLogs('core.jobs', 'ERROR'):
+            self.assertFalse(process_job(job))
+        job.refresh_from_db()
+        self.assertIn('exceeded 0s', job.last_error)
+
+
+@override_settings(CACHES=benchmarks.LOCAL_CACHES, LLM_BACKEND='fake', GENERATION_CACHE_MAX_ENTRIES=2)
+class GenerationCacheTests(TestCase):
+    """Finished generations are reused for identical prompts, bounded by LRU eviction and a TTL."""
+
+    def store(self, name, used_minutes_ago=0):
+        key = cache_key(name, 'model')
+        store_generation(key, 'model', f"<p>{name}</p>")
+        GenerationCache.objects.filter(key=key).update(last_used_at=timezone.now() - timedelta(minutes=used_minutes_ago))
+        return key
+
+    def test_identical_prompts_hit(self):
+        self.assertNotEqual(cache_key("prompt", 'model'), cache_key("prompt", 'other-model'))
+        key = self.store("prompt")
+        self.assertEqual(get_cached_generation(key), "<p>prompt</p>")
+        self.assertEqual(GenerationCache.objects.get(key=key).hits, 1)
+        self.assertIsNone(get_cached_generation(cache_key("changed prompt", 'model')))
+
+    def test_least_recently_used_is_evicted(self):
+        old = self.store("old", used_minutes_ago=10)
+        recent = self.store("recent", used_minutes_ago=5)
+        get_cached_generation(old)  # Now the most recently used
+
+        newest = self.store("newest")
+        self.assertEqual(
+            set(GenerationCache.objects.values_list('key', flat=True)), {old, newest},
+        )
+        self.assertIsNone(get_cached_generation(recent))
+
+    @override_settings(GENERATION_CACHE_TTL=60)
+    def test_expired_entries_miss_and_are_deleted(self):
+        key = self.store("prompt")
+        GenerationCache.objects.filter(key=key).update(created_at=timezone.now() - timedelta(seconds=61))
+        self.assertIsNone(get_cached_generation(key))
+        self.assertFalse(GenerationCache.objects.filter(key=key).exists())
+
+    @override_settings(GENERATION_CACHE_TTL=0)
+    def test_zero_ttl_never_expires(self):
+        key = self.store("prompt")
+        GenerationCache.objects.filter(key=key).update(created_at=timezone.now() - timedelta(days=365))
+        self.assertEqual(get_cached_generation(key), "<p>prompt</p>")
+
+    def test_unchanged_profile_reuses_the_last_analysis(self):
+        user = benchmarks.seed_user(4, 'cached')
+        self.client.force_login(user)
+        prompt = build_analysis_prompt(Profile.objects.for_context().get(user=user))
+        store_generation(cache_key(prompt, settings.GEMINI_MODEL), settings.GEMINI_MODEL, "<p>Cached report</p>")
+
+        self.client.post(reverse('profile_analysis'))
+        self.assertFalse(AnalysisJob.objects.exists())
+        user.profile.refresh_from_db()
+        self.assertEqual(user.profile.ai_summary, "<p>Cached report</p>")
+
+
+class BrokenChatStreamBackend(FakeBackend):
+    # Sends the first chunk of the reply, then drops the connection
+    async def astream(self, prompt, model, timeout, system=None):
+        yield self.chunks()[0]
+        raise RuntimeError("Connection reset")
+
+
+@override_settings(CACHES=benchmarks.LOCAL_CACHES, LLM_BACKEND='fake', RATE_LIMIT_ENABLED=False)
+class ChatStreamTests(TestCase):
+    """The chat stream forwards the reply as server-sent events: session, text chunks, done."""
+
+    def setUp(self):
+        self.user = benchmarks.seed_user(2, 'streamer')
+        self.client.force_login(self.user)
+
+    def events(self, response):
+        # (event, data) per frame; unnamed frames are "message" events
+        frames = []
+        for frame in b''.join(response).decode().split('\n\n')[:-1]:
+            fields = dict(line.split(': ', 1) for line in frame.split('\n'))
+            frames.append((fields.get('event', 'message'), json.loads(fields['data'])))
+        return frames
+
+    def post(self, body):
+        return self.client.post(reverse('chat_stream'), body, content_type='application/json')
+
+    def test_frames_are_server_sent_events(self):
+        self.assertEqual(sse_event({'text': 'Hi "there"'}), 'data: {"text": "Hi \\"there\\""}\n\n')
+        self.assertEqual(sse_event({}, event='done'), 'event: done\ndata: {}\n\n')
+
+    def test_reply_is_streamed_in_order_and_saved(self):
+        response = self.post(json.dumps({'message': 'Hello'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+
+        events = self.events(response)
+        session_id = events[0][1]['session_id']
+        self.assertEqual(events[0][0], 'session')
+        self.assertEqual(events[-1], ('done', {}))
+        texts = [data['text'] for name, data in events[1:-1]]
+        self.assertEqual(texts, FakeBackend().chunks())
+
+        session = ChatSession.objects.get(pk=session_id, profile__user=self.user)
+        self.assertEqual(
+            [(m.role, m.text) for m in session.messages.order_by('id')],
+            [('user', 'Hello'), ('model', FakeBackend.reply)],
+        )
+
+    def test_bad_requests_are_rejected_before_streaming(self):
+        self.assertEqual(self.client.get(reverse('chat_stream')).status_code, 400)
+        response = self.post('{not json')
+        self.assertEqual((response.status_code, response.json()), (400, {'error': 'Invalid JSON'}))
+
+    @override_settings(LLM_BACKEND='core.tests.BrokenChatStreamBackend')
+    def test_backend_failure_mid_stream_ends_with_an_error_event(self):
+        events = self.events(self.post(json.dumps({'message': 'Hello'})))
+        self.assertEqual([name for name, _ in events], ['session', 'message', 'error'])
+        self.assertEqual(events[-1][1], {'error': 'Connection reset'})
+        self.assertFalse(ChatSession.objects.get(pk=events[0][1]['session_id']).messages.filter(role='model').exists())
+
+
+@override_settings(CACHES=benchmarks.LOCAL_CACHES)
+class FeedbackContextTests(TestCase):
+    """Profile.feedback_context is patched one section at a time, never rebuilt from every survey."""
+
+    def setUp(self):
+        self.user = benchmarks.seed_user(4, 'contextual')
+        self.profile = Profile.objects.get(user=self.user)
+        self.before = self.context()  # First read builds it
+
+    def context(self):
+        profile = Profile.objects.only('feedback_context', 'feedback_context_version').get(pk=self.profile.pk)
+        sections = profile.context_sections()
+        return profile.feedback_context_version, {sec['key']: sec for sec in sections}, [sec['key'] for sec in sections]
+
+    def assertPatched(self, changed=(), added=(), removed=()):
+        version, sections, order = self.context()
+        old_version, old_sections, old_order = self.before
+        self.assertEqual(version, old_version + 1)
+        self.assertEqual(order, [key for key in old_order if key not in removed] + list(added))
+        for key in old_order:
+            if key not in removed and key not in changed:
+                self.assertEqual(sections[key], old_sections[key], key)
+        for key in changed:
+            self.assertNotEqual(sections[key], old_sections[key], key)
+        return sections
+
+    def no_rebuild(self):
+        return mock.patch.object(Profile, 'rebuild_feedback_context', side_effect=AssertionError("full rebuild"))
+
+    def test_completing_a_survey_appends_its_section(self):
+        pending = Survey.objects.filter(user=self.user, is_completed=False).first()
+        pending.is_completed, pending.future_self_answer = True, "Leading the whole studio"
+        with self.no_rebuild():
+            pending.save()
+        sections = self.assertPatched(added=[f"survey:{pending.pk}"])
+        self.assertIn("Leading the whole studio", sections[f"survey:{pending.pk}"]['body'])
+        self.assertEqual(sections[f"survey:{pending.pk}"]['title'], f"Feedback from {pending.respondent_name}")
+
+    def test_editing_a_survey_replaces_only_its_section(self):
+        survey = Survey.objects.filter(user=self.user, is_completed=True).last()
+        survey.stress_profile_answer = "Goes very quiet"
+        with self.no_rebuild():
+            survey.save()
+        sections = self.assertPatched(changed=[f"survey:{survey.pk}"])
+        self.assertIn("Stress Profile: Goes very quiet", sections[f"survey:{survey.pk}"]['body'])
+
+    def test_deleting_a_survey_removes_only_its_section(self):
+        survey = Survey.objects.filter(user=self.user, is_completed=True).first()
+        key = f"survey:{survey.pk}"
+        with self.no_rebuild():
+            survey.delete()
+        self.assertPatched(removed=[key])
+
+    def test_saving_onboarding_replaces_only_the_onboarding_sections(self):
+        self.client.force_login(self.user)
+        with self.no_rebuild():
+            self.client.post(reverse('onboarding'), {'role': 'Head of Design', 'stress': 'Runs'})
+        sections = self.assertPatched(changed=['user_context', 'vision', 'internal_os'])
+        self.assertIn("Role: Head of Design", sections['user_context']['body'])
+        self.assertIn("Stress Response: Runs", sections['internal_os']['body'])
+
+
+@override_settings(CACHES=benchmarks.LOCAL_CACHES)
+class AnalysisStatusTests(TestCase):
+    """The dashboard poller revalidates with its ETag; an unchanged status is a bodiless 304."""
+
+    def setUp(self):
+        user = benchmarks.seed_user(2, 'poller')
+        self.client.force_login(user)
+        self.profile = user.profile
+        Profile.objects.filter(pk=self.profile.pk).update(ai_summary="__ANALYZING__")
+        self.job, _ = enqueue_analysis(self.profile, "analysis prompt")
+
+    def poll(self, etag=None):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(reverse('analysis_status'), **headers)
+
+    def test_unchanged_status_is_not_modified(self):
+        first = self.poll()
+        self.assertEqual((first.status_code, first.json()['state']), (200, AnalysisJob.STATUS_QUEUED))
+        self.assertEqual(first['Cache-Control'], 'private, no-cache')
+
+        again = self.poll(first['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+        self.assertEqual(again['ETag'], first['ETag'])
+
+    def test_etag_changes_with_status_and_progress(self):
+        etags = [self.poll()['ETag']]
+
+        claim_next_job('worker')
+        AnalysisJob.objects.filter(pk=self.job.pk).update(partial_output="<p>Section one.</p>")
+        running = self.poll(etags[-1])
+        self.assertEqual(running.status_code, 200)
+        self.assertEqual((running.json()['state'], running.json()['progress']), (AnalysisJob.STATUS_RUNNING, 19))
+        etags.append(running['ETag'])
+
+        AnalysisJob.objects.filter(pk=self.job.pk).update(partial_output="<p>Section one.</p><p>Section two.</p>")
+        longer = self.poll(etags[-1])
+        self.assertEqual((longer.status_code, longer.json()['progress']), (200, 38))
+        etags.append(longer['ETag'])
+        self.assertEqual(len(set(etags)), 3)
+        self.assertEqual(self.poll(etags[-1]).status_code, 304)
+
+
+@override_settings(CACHES=benchmarks.LOCAL_CACHES)
+class QueryPlanTests(TestCase):
+    """The hot dashboard/analysis/stats queries must be served by their indexes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('planner', 'planner@example.com', 'pw')
+        other = User.objects.create_user('other', 'other@example.com', 'pw')
+        for owner in (cls.user, other):
+            surveys = Survey.objects.bulk_create(
+                [Survey(user=owner, is_completed=(i % 3 == 0)) for i in range(30)]
+            )
+            SurveyFeedback.objects.bulk_create(
+                [SurveyFeedback(survey=s, sentiment=['insightful', 'intense'][i % 2]) for i, s in enumerate(surveys)]
+            )
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            # Tiny test tables would otherwise always be sequentially scanned
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        elif connection.vendor != 'sqlite':
+            self.skipTest(f"No plan assertions for {connection.vendor}")
+        return queryset.explain()
+
+    def assertPlanUses(self, queryset, *index_names):
+        plan = self.explain(queryset)
+        self.assertTrue(
+            any(name in plan for name in index_names),
+            f"Expected one of {index_names} in plan:\n{plan}",
+        )
+        return plan
+
+    def test_completed_surveys_use_index(self):
+        self.assertPlanUses(Survey.objects.filter(user=self.user, is_completed=True), 'core_survey_user_completed')
+
+    def test_dashboard_list_uses_index_for_order(self):
+        first = SurveyPage(self.user.pk, size=10)
+        for page in (first, SurveyPage(self.user.pk, first.next_cursor, size=10)):
+            qs = Survey.objects.filter(user=self.user).order_by('-created_at', '-id')
+            if page.after:
+                created_at, pk = page.after
+                qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+            plan = self.assertPlanUses(qs[:11], 'core_survey_user_created')
+            self.assertNotIn('TEMP B-TREE', plan)
+            self.assertNotIn('Sort', plan)
+
+    def test_recent_feedback_uses_index_for_order(self):
+        first = FeedbackPage(size=10)
+        for page in (first, first.next_page()):
+            qs = SurveyFeedback.objects.order_by('-created_at', '-id')
+            if page.after:
+                created_at, pk = page.after
+                qs = qs.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+            plan = self.assertPlanUses(qs[:11], 'core_feedback_created')
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_sentiment_counts_use_index(self):
+        qs = SurveyFeedback.objects.values('sentiment').annotate(count=Count('sentiment'))
+        self.assertPlanUses(qs, 'core_feedback_sentiment')
+
+
+@override_settings(CACHES=benchmarks.LOCAL_CACHES)
+class ViewQueryCountTests(TestCase):
+    """Every route's query count must not grow with the number of surveys (no N+1s)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.small = benchmarks.seed_user(10, 'small')
+        cls.large = benchmarks.seed_user(100, 'large')
+
+    def setUp(self):
+        self.addCleanup(benchmarks.isolated_environment().close)
+
+    def count_queries(self, case, user):
+        client = benchmarks.client_for(user, case)
+        benchmarks.run_case(case, user, client)  # Warm-up
+        status, n_queries, _ = benchmarks.run_case(case, user, client)
+        self.assertLess(status, 400, f"{case.name} returned {status}")
+        return n_queries
+
+    def test_query_counts_do_not_scale_with_surveys(self):
+        for case in benchmarks.CASES:
+            with self.subTest(route=case.name):
+                self.assertEqual(self.count_queries(case, self.small), self.count_queries(case, self.large))
+
+    def test_hot_endpoint_query_counts(self):
+        client = benchmarks.client_for(self.large, benchmarks.CASES[0])
+        # session, user, profile, latest job
+        with self.assertNumQueries(4):
+            client.get(reverse('analysis_status'))
+        # session, user, profile; the report and survey list are cached fragments
+        client.get(reverse('dashboard'))
+        with self.assertNumQueries(3):
+            client.get(reverse('dashboard'))
+        # session, user, profile, chat session, its recent messages, relevant excerpts, new messages, touch
+        client.post(reverse('chat_view'), '{"message": "Hi"}', content_type='application/json')
+        with self.assertNumQueries(8):
+            client.post(reverse('chat_view'), '{"message": "Hi"}', content_type='application/json')
+
+    def test_hot_paths_skip_large_text_columns(self):
+        # Onboarding answers stay: the dashboard's profile fragment shows them
+        heavy = ['"energy_audit_answer"', '"future_self_answer"', '"feedback_context"']
+        for case in benchmarks.CASES:
+            if case.name not in ('dashboard', 'invitation_page', 'analysis_status', 'chat', 'delete_invite', 'survey_feedback',
+                                 'public_survey', 'public_survey_submit'):
+                continue
+            client = benchmarks.client_for(self.large, case)
+            benchmarks.run_case(case, self.large, client)  # Warm-up: session starts, context builds
+            url, data = case.prepare(self.large)
+            with CaptureQueriesContext(connection) as queries:
+                case.perform(client, url, data)
+            for query in queries:
+                with self.subTest(route=case.name, sql=query['sql'][:80]):
+                    self.assertFalse(any(column in query['sql'] for column in heavy))
+
+    def test_cached_fragments_are_invalidated_by_changes(self):
+        client = benchmarks.client_for(self.small, benchmarks.CASES[0])
+        client.get(reverse('dashboard'))
+        Survey.objects.create(user=self.small, respondent_name='Fresh Invitee')
+        response = client.get(reverse('dashboard'))
+        self.assertContains(response, 'Fresh Invitee')
+
+        stats_client = benchmarks.client_for(self.large, next(c for c in benchmarks.CASES if c.superuser))
+        stats_client.get(reverse('stats'))
+        with self.assertNumQueries(2):  # session, user
+            stats_client.get(reverse('stats'))
+        SurveyFeedback.objects.create(survey=Survey.objects.create(user=self.small), sentiment='insightful', comment='Brand new comment')
+        self.assertContains(stats_client.get(reverse('stats')), 'Brand new comment')
+
+        # Past midnight the daily chart moves on without any new feedback
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        with mock.patch('django.utils.timezone.localdate', return_value=tomorrow):
+            self.assertContains(stats_client.get(reverse('stats')), tomorrow.strftime('%b %d'))
+
+
+class CountingBackend(FakeBackend):
+    prompts = []
+
+    def generate(self, prompt, model, timeout, system=None):
+        self.prompts.append(prompt)
+        return super().generate(prompt, model, timeout, system)
+
+
+@override_settings(
+    LLM_BACKEND='core.tests.CountingBackend',
+    CACHES=benchmarks.LOCAL_CACHES,
+    ANALYSIS_MAP_REDUCE_THRESHOLD=5,
+    ANALYSIS_REDUCE_BATCH_SIZE=4,
+)
+class MapReduceAnalysisTests(TestCase):
+    """Large profiles are summarised per survey once, and only new surveys cost a map call."""
+
+    def setUp(self):
+        self.user = benchmarks.seed_user(20, 'mapreduce')  # 10 completed
+        CountingBackend.prompts = []
+
+    def run_job(self):
+        profile = self.user.profile
+        job, _ = enqueue_analysis(profile, "direct prompt")
+        self.assertTrue(process_job(job))
+        return job
+
+    def test_summaries_are_cached_between_runs(self):
+        self.run_job()
+        self.assertEqual(SurveySummary.objects.filter(survey__user=self.user).count(), 10)
+        first_run = len(CountingBackend.prompts)
+        self.assertEqual(first_run, 10 + 3)  # 10 map calls, 3 groups condensed; the synthesis streams
+
+        CountingBackend.prompts = []
+        self.run_job()
+        self.assertEqual(CountingBackend.prompts, [])  # Everything came from the caches
+
+        survey = Survey.objects.filter(user=self.user, is_completed=False).first()
+        survey.is_completed = True
+        survey.energy_audit_answer = "A brand new answer"
+        survey.save()
+        self.run_job()
+        map_calls = [p for p in CountingBackend.prompts if 'ONE anonymous respondent' in p]
+        self.assertEqual(len(map_calls), 1)
+
+    def test_small_profiles_send_the_direct_prompt(self):
+        with self.settings(ANALYSIS_MAP_REDUCE_THRESHOLD=50):
+            job, _ = enqueue_analysis(self.user.profile, "direct prompt")
+            self.assertEqual(prompt_for_job(job), "direct prompt")
+        self.assertFalse(SurveySummary.objects.exists())
+
+
+@override_settings(CACHES=benchmarks.LOCAL_CACHES, LLM_BACKEND='fake', RATE_LIMIT_ENABLED=False)
+class SingleFlightAnalysisTests(TestCase):
+    """Concurrent analysis requests for one profile share a single job."""
+
+    def setUp(self):
+        self.user = benchmarks.seed_user(4, 'singleflight')
+        self.client.force_login(self.user)
+
+    def test_duplicate_requests_attach_to_the_running_job(self):
+        for _ in range(3):
+            self.client.get(reverse('profile_analysis'))
+        self.assertEqual(AnalysisJob.objects.filter(profile=self.user.profile).count(), 1)
+
+        job = AnalysisJob.objects.get(profile=self.user.profile)
+        attached, created = enqueue_analysis(self.user.profile, "newer prompt")
+        self.assertEqual((attached.pk, created), (job.pk, False))
+        job.refresh_from_db()
+        self.assertEqual(job.prompt, "newer prompt")  # Still queued, so it runs on the latest context
+
+        self.assertTrue(process_job(job))
+        _, created = enqueue_analysis(self.user.profile, "next run")
+        self.assertTrue(created)  # A finished job no longer blocks
+
+    def test_stale_claims_expire(self):
+        job, _ = enqueue_analysis(self.user.profile, "abandoned")
+        AnalysisJob.objects.filter(pk=job.pk).update(
+            status=AnalysisJob.STATUS_RUNNING, created_at=timezone.now() - timedelta(seconds=settings.ANALYSIS_CLAIM_TTL + 1),
+        )
+        fresh, created = enqueue_analysis(self.user.profile, "fresh")
+        self.assertTrue(created)
+        job.refresh_from_db()
+        self.assertEqual(job.status, AnalysisJob.STATUS_FAILED)
+        self.assertNotEqual(fresh.pk, job.pk)
+
+
+class FailingStreamBackend(FakeBackend):
+    reply = '<div><p>Section one.</p><p>Section two.</p><p>Section three.</p></div>'
+
+    def stream(self, prompt, model, timeout, system=None):
+        yield from self.chunks()[:2]
+        raise RuntimeError("Connection reset")
+
+
+@override_settings(
+    CACHES=benchmarks.LOCAL_CACHES,
+    LLM_BACKEND='core.tests.FailingStreamBackend',
+    ANALYSIS_JOB_MAX_ATTEMPTS=1,
+    ANALYSIS_FLUSH_CHUNKS=1,
+    RATE_LIMIT_ENABLED=False,
+)
+class PartialOutputTests(TestCase):
+    """Streamed analysis output is persisted as it arrives and survives a failed run."""
+
+    def setUp(self):
+        self.user = benchmarks.seed_user(4, 'streaming')
+        self.client.force_login(self.user)
+        self.client.get(reverse('profile_analysis'))
+        self.job = claim_next_job('test-worker')
+
+    def test_partial_output_is_shown_while_running_and_kept_on_failure(self):
+        AnalysisJob.objects.filter(pk=self.job.pk).update(partial_output='<p>Section one.</p>')
+        self.assertGreater(self.client.get(reverse('analysis_status')).json()['progress'], 0)
+        self.assertContains(self.client.get(reverse('profile_report')), 'Section one.')
+
+        with self.assertLogs('core.jobs', 'ERROR'):
+            self.assertFalse(process_job(self.job))
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, AnalysisJob.STATUS_FAILED)
+        self.assertEqual(self.job.partial_output, '<div><p>Section one.</p><p>Section two.</p>')
+        self.user.profile.refresh_from_db()
+        self.assertTrue(self.user.profile.ai_summary.startswith(self.job.partial_output))
+        self.assertIn('Connection reset', self.user.profile.ai_summary)
+
+    @override_settings(LLM_BACKEND='fake')
+    def test_finished_run_clears_partial_output(self):
+        self.assertTrue(process_job(self.job))
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.partial_output, '')
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.ai_summary, FakeBackend.reply)
+
+
+@override_settings(LLM_CHARS_PER_TOKEN=4)
+class PromptBudgetTests(TestCase):
+    """Prompts are fitted to their token budget deterministically, newest feedback first."""
+
+    def sections(self, n_surveys):
+        profile = [{'key': 'user_context', 'title': 'USER CONTEXT', 'body': "Role: Director\n"}]
+        surveys = [{'key': f"survey:{i}", 'title': 'Feedback', 'body': f"Answer {i} " * 100} for i in range(n_surveys)]
+        return profile + surveys
+
+    def build(self, budget, n_surveys=10):
+        builder = PromptBuilder('test', budget).add_feedback_context(self.sections(n_surveys))
+        with self.assertLogs('core.prompts', 'INFO'):
+            prompt = builder.build(lambda context: f"Header\n{context}\nFooter")
+        return prompt, {row['key']: row['sent'] for row in builder.report}
+
+    def test_everything_fits(self):
+        prompt, sent = self.build(100000)
+        self.assertEqual(set(sent.values()), {'full'})
+        self.assertNotIn(TRUNCATION_MARKER, prompt)
+
+    def test_budget_keeps_context_and_newest_surveys(self):
+        prompt, sent = self.build(1050)
+        self.assertLessEqual(estimate_tokens(prompt), 1050)
+        self.assertEqual(sent['user_context'], 'full')
+        self.assertEqual(sent['survey:9'], 'full')
+        self.assertEqual(sent['survey:0'], 'dropped')
+        self.assertIn('truncated', sent.values())
+        self.assertEqual(prompt, self.build(1050)[0])
+
+
+class CompactionBackend(FakeBackend):
+    # Records compaction prompts; fails them while `broken`
+    prompts = []
+    broken = False
+
+    async def agenerate(self, prompt, model, timeout, system=None):
+        if 'running notes' in prompt:
+            self.prompts.append(prompt)
+            if self.broken:
+                raise ConnectionError("Connection reset")
+        return await super().agenerate(prompt, model, timeout, system)
+
+
+@override_settings(
+    LLM_BACKEND='core.tests.CompactionBackend', CACHES=benchmarks.LOCAL_CACHES,
+    CHAT_RECENT_MESSAGES=4, CHAT_COMPACT_AFTER=2,
+)
+class ChatMemoryTests(TestCase):
+    """Chat turns stay flat: the context lives in the session and old turns are summarised."""
+
+    def setUp(self):
+        self.user = benchmarks.seed_user(10, 'chatter')
+        self.client.force_login(self.user)
+        CompactionBackend.prompts = []
+        CompactionBackend.broken = False
+
+    def say(self, message, session_id=None):
+        response = self.client.post(
+            reverse('chat_view'), json.dumps({'message': message, 'session_id': session_id}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['session_id']
+
+    def test_turns_reuse_the_session_and_compact_old_messages(self):
+        session_id = self.say("Turn 0")
+        for i in range(1, 4):
+            self.assertEqual(self.say(f"Turn {i}", session_id), session_id)
+
+        session = ChatSession.objects.get(pk=session_id)
+        self.assertTrue('Synthetic current_role' in session.system_prompt)
+        self.assertEqual(len(CompactionBackend.prompts), 1)  # 8 messages > 4 + 2: one compaction
+        self.assertTrue(session.summary)
+        self.assertEqual(session.messages.filter(id__gt=session.summarised_until).count(), 4)
+
+        self.say("Turn 4", session_id)
+        session.refresh_from_db()
+        self.assertEqual(session.messages.count(), 10)
+
+    def test_failed_compaction_keeps_the_reply_and_the_old_summary(self):
+        session_id = self.say("Turn 0")
+        for i in range(1, 3):
+            self.say(f"Turn {i}", session_id)
+        CompactionBackend.broken = True
+        self.say("Turn 3", session_id)
+
+        session = ChatSession.objects.get(pk=session_id)
+        self.assertEqual((session.summary, session.summarised_until), ('', 0))
+        self.assertEqual(session.messages.count(), 8)
+
+        CompactionBackend.broken = False
+        self.say("Turn 4", session_id)  # Tried again on the next turn
+        session.refresh_from_db()
+        self.assertEqual(len(CompactionBackend.prompts), 2)
+        self.assertEqual(session.messages.filter(id__gt=session.summarised_until).count(), 4)
+
+
+class ChatPromptBackend(FakeBackend):
+    prompts = []
+
+    async def agenerate(self, prompt, model, timeout, system=None):
+        self.prompts.append(prompt)
+        return await super().agenerate(prompt, model, timeout, system)
+
+
+@override_settings(CACHES=benchmarks.LOCAL_CACHES, LLM_BACKEND='core.tests.ChatPromptBackend', CHAT_RETRIEVAL_TOP_K=3)
+class FeedbackRetrievalTests(TestCase):
+    """Chat turns carry only the survey answers relevant to the question."""
+
+    def setUp(self):
+        self.user = benchmarks.seed_user(40, 'retrieval')  # 20 completed, identical answers
+        self.client.force_login(self.user)
+        ChatPromptBackend.prompts = []
+
+    def ask(self, message):
+        self.client.post(reverse('chat_view'), json.dumps({'message': message}), content_type='application/json')
+        return ChatPromptBackend.prompts[-1]
+
+    def complete(self, **answers):
+        survey = Survey.objects.create(user=self.user, relationship_type='manager', **answers)
+        survey.is_completed = True
+        survey.save()
+        return survey
+
+    def test_new_answers_are_indexed_and_retrieved(self):
+        survey = self.complete(stress_profile_answer="Under deadline pressure she micromanages the team.")
+        self.assertEqual(FeedbackExcerpt.objects.filter(survey=survey).count(), 1)
+
+        prompt = self.ask("Why do I micromanage?")
+        self.assertIn("(Manager, Stress Profile) Under deadline pressure", prompt)
+        self.assertEqual(prompt.count("\n- ("), 1)  # Only answers that match; none of the synthetic ones do
+        self.assertNotIn("Synthetic current_role", prompt)  # Onboarding answers live in the system prompt
+
+        survey.delete()
+        self.assertNotIn("micromanages", self.ask("Why do I micromanage?"))
+
+    def test_excerpts_are_written_before_the_context_version_moves(self):
+        # A chat turn that sees the new version must find the new excerpts: the index it
+        # caches under that version is kept for CHAT_INDEX_CACHE_TIMEOUT
+        store = Profile._store_feedback_context
+        indexed = []
+
+        def checked_store(profile, sections):
+            indexed.append(FeedbackExcerpt.objects.filter(text__contains="micromanages").exists())
+            return store(profile, sections)
+
+        with mock.patch.object(Profile, '_store_feedback_context', autospec=True, side_effect=checked_store):
+            self.complete(stress_profile_answer="Under deadline pressure she micromanages the team.")
+            FeedbackExcerpt.objects.all().delete()
+            Profile.objects.filter(user=self.user).update(feedback_context_version=0)
+            Profile.objects.get(user=self.user).context_sections()  # Full rebuild
+        self.assertEqual(indexed, [True, True])
+
+    def test_analysis_names_respondents_but_chat_does_not(self):
+        self.complete(respondent_name='Dana Example', stress_profile_answer="Under deadline pressure she micromanages the team.")
+        profile = Profile.objects.for_context().get(user=self.user)
+        self.assertIn("--- Feedback from Dana Example ---", build_analysis_prompt(profile))
+
+        prompt = self.ask("Why do I micromanage?")
+        self.assertIn("micromanages", prompt)
+        self.assertNotIn("Dana", prompt + ChatSession.objects.get(profile=profile).system_prompt)
+
+    def test_turn_size_does_not_grow_with_respondents(self):
+        small = len(self.ask("What do people say about my energy?"))
+        for i in range(10):
+            self.complete(energy_audit_answer=f"Observed behaviour number {i} about energy levels. " * 10)
+        self.assertLess(len(self.ask("What do people say about my energy?")), small * 2)
+
+    def test_bm25_ranks_rarer_terms_higher(self):
+        index = ExcerptIndex([
+            (1, {'team': 1, 'calm': 1}, 2),
+            (2, {'team': 2}, 2),
+            (3, {'deadline': 1}, 1),
+        ])
+        self.assertEqual(index.top(['calm', 'team'], 2), [1, 2])
+        self.assertEqual(index.top(['unknown'], 2), [3, 2])  # No match: newest answers
+
+
+@override_settings(CACHES=benchmarks.LOCAL_CACHES, THEMES_PER_QUESTION=2)
+class ThemeClusteringTests(TestCase):
+    """Answers are grouped into recurring themes per question, locally and incrementally."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('themed', 'themed@example.com', 'pw')
+        for i in range(6):
+            self.complete(
+                energy_audit_answer=f"Energized by mentoring juniors and coaching people {i}" if i % 2
+                else f"Drained by budget spreadsheets and finance reviews {i}",
+                stress_profile_answer="Goes quiet in conflict and withdraws from meetings",
+            )
+
+    def complete(self, **answers):
+        survey = Survey.objects.create(user=self.user, relationship_type='coworker', **answers)
+        survey.is_completed = True
+        survey.save()
+
+    def profile(self):
+        return Profile.objects.for_status().get(user=self.user)
+
+    def test_answers_cluster_into_counted_themes(self):
+        snapshot = {q['question']: q for q in profile_themes(self.profile())}
+        energy = snapshot['Energy Audit']['themes']
+        self.assertEqual([theme['count'] for theme in energy], [3, 3])
+        labels = sorted(" ".join(theme['terms']) for theme in energy)
+        self.assertIn('budget', labels[0])
+        self.assertIn('coaching', labels[1])
+        self.assertNotIn('Glass Ceiling', snapshot)  # No answers to compare
+
+        profile = Profile.objects.for_context().get(user=self.user)
+        self.assertIn('RECURRING THEMES ACROSS RESPONDENTS', build_analysis_prompt(profile))
+
+    def test_themes_are_dropped_before_any_survey_when_the_budget_is_tight(self):
+        profile = Profile.objects.for_context().get(user=self.user)
+        surveys = [sec for sec in profile.context_sections() if sec['key'].startswith('survey:')]
+        fixed = estimate_tokens(build_analysis_prompt(profile)) - estimate_tokens(themes_summary(profile))
+        with override_settings(LLM_ANALYSIS_TOKEN_BUDGET=fixed):
+            prompt = build_analysis_prompt(profile)
+        self.assertNotIn('RECURRING THEMES ACROSS RESPONDENTS', prompt)
+        self.assertTrue(all(sec['body'] in prompt for sec in surveys))
+
+    def test_snapshot_is_cached_and_only_changed_questions_recluster(self):
+        profile = self.profile()
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)  # Keys must also work on memcached
+            profile_themes(profile)
+        with self.assertNumQueries(0):
+            profile_themes(profile)
+
+        self.complete(energy_audit_answer="Energized by mentoring new managers")
+        with mock.patch('core.themes.question_themes', wraps=question_themes) as recluster:
+            profile_themes(self.profile())
+        self.assertEqual(recluster.call_count, 1)  # Energy Audit only; the other questions are unchanged
+
+
+@override_settings(CACHES=benchmarks.LOCAL_CACHES)
+class SentimentCounterTests(TestCase):
+    """Stats counters follow feedback as it is given, changed and deleted."""
+
+    def give(self, survey, sentiment):
+        response = self.client.post(
+            reverse('survey_feedback', args=[survey.uuid]), json.dumps({'sentiment': sentiment}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_counters_track_feedback(self):
+        user = User.objects.create_user('counted', 'counted@example.com', 'pw')
+        first, second = Survey.objects.create(user=user), Survey.objects.create(user=user)
+
+        self.give(first, 'insightful')
+        self.give(second, 'insightful')
+        self.give(second, 'intense')  # Changed their mind
+        self.assertEqual(sentiment_totals(), {'insightful': 1, 'intense': 1})
+        self.assertEqual(daily_series(1)[0]['total'], 2)
+
+        second.delete()
+        self.assertEqual(sentiment_totals(), {'insightful': 1, 'intense': 0})
+        self.assertEqual(daily_series(7)[-1]['counts'], {'insightful': 1, 'intense': 0})
+
+    def test_feedback_saved_outside_the_view_is_counted_and_recount_repairs_bulk_writes(self):
+        user = User.objects.create_user('elsewhere', 'elsewhere@example.com', 'pw')
+        surveys = [Survey.objects.create(user=user) for _ in range(4)]
+
+        feedback = SurveyFeedback.objects.create(survey=surveys[0], sentiment='boring')  # Admin, shell...
+        feedback.sentiment = 'insightful'
+        feedback.save()
+        SurveyFeedback.objects.get(pk=feedback.pk).delete()
+        SurveyFeedback.objects.create(survey=surveys[1], sentiment='intense')
+        self.assertEqual(sentiment_totals(), {'boring': 0, 'insightful': 0, 'intense': 1})
+
+        # bulk_create sends no signals: never counted, until a recount
+        SurveyFeedback.objects.bulk_create([SurveyFeedback(survey=s, sentiment='confusing') for s in surveys[2:]])
+        self.assertNotIn('confusing', sentiment_totals())
+        call_command('recount_sentiment', stdout=io.StringIO())
+        self.assertEqual(sentiment_totals(), {'intense': 1, 'confusing': 2})
+        self.assertEqual(daily_series(1)[0]['counts'], {'intense': 1, 'confusing': 2})
+        SurveyFeedback.objects.filter(sentiment='confusing').delete()
+        self.assertEqual(sentiment_totals(), {'intense': 1, 'confusing': 0})
+
+
+class CountingEmailBackend(locmem.EmailBackend):
+    # Counts connections; messages to "bounce@" addresses are refused
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return super().open()
+
+    def send_messages(self, messages):
+        if any(to.startswith('bounce@') for message in messages for to in message.to):
+            raise ConnectionError("550 Mailbox unavailable")
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='core.tests.CountingEmailBackend', EMAIL_OUTBOX_MAX_ATTEMPTS=2, EMAIL_DOMAIN_RATE_LIMIT=0)
+class OutboxTests(TestCase):
+    """Emails go out in batches over one connection; failures back off; domains are paced."""
+
+    def setUp(self):
+        CountingEmailBackend.opened = 0
+
+    def queue(self, n, domain='example.com'):
+        return queue_emails([(f"Subject {i}", "Body", f"person{i}@{domain}") for i in range(n)])
+
+    def seconds_until(self, email):
+        email.refresh_from_db()
+        return (email.send_after - timezone.now()).total_seconds()
+
+    def test_batches_share_one_connection(self):
+        self.queue(5)
+        call_command('send_outbox', '--once', '--batch-size', '3', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(CountingEmailBackend.opened, 2)  # 3 + 2
+        self.assertEqual(
+            set(OutboundEmail.objects.values_list('status', 'attempts', 'locked_by')),
+            {(OutboundEmail.STATUS_SENT, 1, '')},
+        )
+
+    def test_failed_sends_back_off_then_give_up(self):
+        self.queue(1)
+        bounce, = queue_emails([("Subject", "Body", "bounce@example.com")])
+        with self.assertLogs('core.outbox', 'WARNING'):
+            self.assertEqual(outbox.send_batch(outbox.claim_batch(10)), 1)
+
+        bounce.refresh_from_db()
+        self.assertEqual((bounce.status, bounce.attempts, bounce.locked_by), (OutboundEmail.STATUS_PENDING, 1, ''))
+        self.assertIn('550', bounce.last_error)
+        self.assertTrue(25 < self.seconds_until(bounce) <= 30)
+        self.assertEqual(outbox.claim_batch(10), [])  # Not due yet
+
+        OutboundEmail.objects.filter(pk=bounce.pk).update(send_after=timezone.now())
+        with self.assertLogs('core.outbox', 'WARNING'):
+            self.assertEqual(outbox.send_batch(outbox.claim_batch(10)), 0)
+        bounce.refresh_from_db()
+        self.assertEqual((bounce.status, bounce.attempts), (OutboundEmail.STATUS_FAILED, 2))
+
+    @override_settings(EMAIL_DOMAIN_RATE_LIMIT=2)
+    def test_busy_domains_are_deferred_without_using_an_attempt(self):
+        self.queue(3)
+        other, = self.queue(1, domain='Example.org')
+        self.assertEqual(outbox.send_batch(outbox.claim_batch(10)), 3)
+        self.assertEqual(sorted(to for m in mail.outbox for to in m.to),
+                         ['person0@Example.org', 'person0@example.com', 'person1@example.com'])
+
+        deferred = OutboundEmail.objects.exclude(status=OutboundEmail.STATUS_SENT).get()
+        self.assertEqual((deferred.to_email, deferred.status, deferred.attempts, deferred.locked_by),
+                         ('person2@example.com', OutboundEmail.STATUS_PENDING, 0, ''))
+        self.assertTrue(55 < self.seconds_until(deferred) <= 60)
+
+    def test_single_invites_are_validated_and_queued_with_their_survey(self):
+        user = User.objects.create_user('single-inviter', password='pw')
+        self.client.force_login(user)
+        for email in ('', '   ', 'not-an-email'):
+            with self.subTest(email=email):
+                response = self.client.post(reverse('add_invite'), {'name': 'Ann', 'email': email})
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'class="errors"')
+        self.assertFalse(Survey.objects.filter(user=user).exists())
+
+        with mock.patch('core.views.queue_email', side_effect=ConnectionError("database gone")):
+            self.client.post(reverse('add_invite'), {'name': 'Ann', 'email': 'ann@example.com'})
+        self.assertFalse(Survey.objects.filter(user=user).exists())  # Rolled back with the failed email
+
+        response = self.client.post(reverse('add_invite'), {'name': 'Ann', 'email': ' ann@example.com '})
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+        survey = Survey.objects.get(user=user)
+        self.assertEqual(survey.respondent_email, 'ann@example.com')
+        self.assertEqual(OutboundEmail.objects.get().to_email, 'ann@example.com')
+
+    def test_rows_of_dead_senders_are_requeued(self):
+        email, = self.queue(1)
+        outbox.claim_batch(10)
+        self.assertEqual(outbox.requeue_stale_emails(), 0)  # Still within the lock timeout
+
+        stale = timezone.now() - timedelta(seconds=settings.EMAIL_OUTBOX_LOCK_TIMEOUT + 1)
+        OutboundEmail.objects.filter(pk=email.pk).update(locked_at=stale)
+        self.assertEqual(outbox.requeue_stale_emails(), 1)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.locked_by, email.attempts), (OutboundEmail.STATUS_PENDING, '', 0))
+
+    def test_concurrent_claims_never_share_a_row(self):
+        # On SQLite both senders select the same pending ids; the second one's update
+        # must not hand it the rows the first one won
+        self.queue(3)
+        update = QuerySet.update
+        rival = []
+
+        def racing_update(queryset, **fields):
+            if fields.get('status') == OutboundEmail.STATUS_SENDING and not rival:
+                rival.append(None)
+                rival[0] = outbox.claim_batch(2)
+            return update(queryset, **fields)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=racing_update):
+            mine = outbox.claim_batch(2)
+        self.assertEqual(len(rival[0]), 2)
+        self.assertEqual(mine, [])
+        self.assertEqual([email.subject for email in outbox.claim_batch(5)], ['Subject 2'])
+
+
+class BulkInviteTests(TestCase):
+    """Bulk invitations from pasted lines, CSV uploads or JSON, validated row by row."""
+
+    def setUp(self):
+        self.user = User.objects.create_user('inviter', password='pw')
+        self.client.force_login(self.user)
+
+    def post_json(self, payload):
+        return self.client.post(reverse('bulk_invite'), json.dumps(payload), content_type='application/json')
+
+    def test_json_rows_with_non_text_values_are_rejected_per_row(self):
+        response = self.post_json({'invites': [
+            {'name': 'Ann', 'email': 'ann@example.com', 'phone': '555'},
+            {'name': ['Bob'], 'email': 'bob@example.com'},
+            {'email': 42},
+            {'name': 'Cy', 'email': 'cy@example.com', 'phone': {'home': 1}},
+        ]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([row['email'] for row in response.json()['created']], ['ann@example.com'])
+        self.assertEqual(response.json()['errors'], [
+            "bob@example.com: name must be text",
+            "Row 3: email must be text",
+            "cy@example.com: phone must be text",
+        ])
+
+    def test_rows_are_parsed_with_or_without_a_header(self):
+        rows, errors = parse_invite_rows("Name,Email,Phone\nAnn, ann@example.com ,555\n\nbob@example.com\nCy, no address\n")
+        self.assertEqual(rows, [
+            {'name': 'Ann', 'email': 'ann@example.com', 'phone': '555', 'line': 2},
+            {'name': '', 'email': 'bob@example.com', 'phone': '', 'line': 4},
+        ])
+        self.assertEqual(errors, ["Line 5: no email address"])
+
+        rows, _ = parse_invite_rows("dee@example.com,Dee")
+        self.assertEqual([(row['name'], row['email'], row['line']) for row in rows], [('Dee', 'dee@example.com', 1)])
+
+    def test_pasted_lines_and_csv_upload_create_surveys_and_queue_emails(self):
+        upload = SimpleUploadedFile('invites.csv', "\ufeffname,email\nCy,cy@example.com\n".encode('utf-8'))
+        response = self.client.post(reverse('bulk_invite'), {
+            'invites': "Ann, ann@example.com\nbob@example.com, Bob, 555",
+            'csv_file': upload,
+        })
+        self.assertRedirects(response, reverse('dashboard'), fetch_redirect_response=False)
+
+        surveys = Survey.objects.filter(user=self.user).order_by('respondent_email')
+        self.assertEqual(
+            [(s.respondent_name, s.respondent_email, s.respondent_phone) for s in surveys],
+            [('Ann', 'ann@example.com', ''), ('Bob', 'bob@example.com', '555'), ('Cy', 'cy@example.com', '')],
+        )
+        self.assertEqual(
+            sorted(OutboundEmail.objects.values_list('to_email', flat=True)),
+            ['ann@example.com', 'bob@example.com', 'cy@example.com'],
+        )
+
+    def test_duplicates_are_skipped_within_the_batch_and_against_earlier_invites(self):
+        Survey.objects.create(user=self.user, respondent_name='Ann', respondent_email='ann@example.com')
+        response = self.post_json({'invites': [
+            {'email': 'ANN@example.com'},
+            {'name': 'Bob', 'email': 'bob@example.com'},
+            {'name': 'Bob again', 'email': 'Bob@Example.com'},
+            {'email': 'not-an-email'},
+        ]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([row['email'] for row in response.json()['created']], ['bob@example.com'])
+        self.assertEqual(response.json()['errors'], [
+            "ANN@example.com: ANN@example.com has already been invited",
+            "Bob@Example.com: Bob@Example.com has already been invited",
+            "not-an-email: invalid email 'not-an-email'",
+        ])
+        self.assertEqual(OutboundEmail.objects.get().to_email, 'bob@example.com')
+
+    @override_settings(BULK_INVITE_MAX=2)
+    def test_batches_over_the_cap_create_nothing(self):
+        response = self.post_json({'invites': [{'email': f"p{i}@example.com"} for i in range(3)]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], ["Too many invitations at once (max 2)."])
+        self.assertFalse(Survey.objects.filter(user=self.user).exists())
+        self.assertFalse(OutboundEmail.objects.exists())
+
+        self.assertEqual(self.post_json({'invites': [{'email': f"p{i}@example.com"} for i in range(2)]}).status_code, 201)
+
+    def test_malformed_json_payloads_are_bad_requests(self):
+        for payload in ([{'email': 'a@example.com'}], {'invites': [1, 2]}, {'invites': 'a@example.com'}, 'text'):
+            with self.subTest(payload=payload):
+                self.assertEqual(self.post_json(payload).status_code, 400)
+        self.assertFalse(Survey.objects.filter(user=self.user).exists())
+
+
+class Overloaded(Exception):
+    pass
+
+
+class FlakyBackend(FakeBackend):
+    # Fails the first `failures` calls with a retryable error; streams can fail after a chunk
+    retryable = (Overloaded,)
+    failures = 0
+    fail_mid_stream = False
+    calls = 0
+
+    def attempt(self):
+        FlakyBackend.calls += 1
+        if FlakyBackend.calls <= self.failures:
+            raise Overloaded("429 Resource exhausted")
+
+    def generate(self, prompt, model, timeout, system=None):
+        self.attempt()
+        return super().generate(prompt, model, timeout, system)
+
+    def stream(self, prompt, model, timeout, system=None):
+        if self.fail_mid_stream:
+            FlakyBackend.calls += 1
+            yield self.chunks()[0]
+            raise Overloaded("503 Service unavailable")
+        self.attempt()
+        yield from super().stream(prompt, model, timeout, system)
+
+    async def agenerate(self, prompt, model, timeout, system=None):
+        self.attempt()
+        return await super().agenerate(prompt, model, timeout, system)
+
+
+class ConcurrencyBackend(FakeBackend):
+    # Records the most calls that were in flight at once
+    active = peak = 0
+    lock = threading.Lock()
+
+    def enter(self):
+        with self.lock:
+            ConcurrencyBackend.active += 1
+            ConcurrencyBackend.peak = max(self.peak, self.active)
+
+    def leave(self):
+        with self.lock:
+            ConcurrencyBackend.active -= 1
+
+    def generate(self, prompt, model, timeout, system=None):
+        self.enter()
+        time.sleep(0.05)
+        self.leave()
+        return self.reply
+
+    async def agenerate(self, prompt, model, timeout, system=None):
+        self.enter()
+        await asyncio.sleep(0.05)
+        self.leave()
+        return self.reply
+
+
+@override_settings(LLM_BACKEND='core.tests.FlakyBackend', LLM_MAX_RETRIES=2, LLM_RETRY_BACKOFF=0)
+class LLMClientTests(TestCase):
+    """One shared client: retries 429/5xx, never replays a started stream, caps concurrent calls."""
+
+    def setUp(self):
+        FlakyBackend.failures, FlakyBackend.fail_mid_stream, FlakyBackend.calls = 0, False, 0
+        ConcurrencyBackend.active = ConcurrencyBackend.peak = 0
+
+    def test_retryable_errors_are_retried(self):
+        FlakyBackend.failures = 2
+        self.assertEqual(llm.generate("prompt"), FakeBackend.reply)
+        self.assertEqual(FlakyBackend.calls, 3)
+
+    def test_gives_up_after_the_last_retry(self):
+        FlakyBackend.failures = 5
+        with self.assertRaises(Overloaded):
+            llm.generate("prompt")
+        self.assertEqual(FlakyBackend.calls, 3)
+
+    def test_streams_retry_only_before_the_first_chunk(self):
+        FlakyBackend.failures = 1
+        self.assertEqual(list(llm.stream("prompt")), FakeBackend().chunks())
+        self.assertEqual(FlakyBackend.calls, 2)
+
+        FlakyBackend.calls, FlakyBackend.fail_mid_stream = 0, True
+        received = []
+        with self.assertRaises(Overloaded):
+            for text in llm.stream("prompt"):
+                received.append(text)
+        self.assertEqual(received, FakeBackend().chunks()[:1])  # Not sent twice
+        self.assertEqual(FlakyBackend.calls, 1)
+
+    async def test_async_calls_are_retried(self):
+        FlakyBackend.failures = 1
+        self.assertEqual(await llm.agenerate("prompt"), FakeBackend.reply)
+        self.assertEqual(FlakyBackend.calls, 2)
+
+    @override_settings(LLM_BACKEND='core.tests.ConcurrencyBackend', LLM_MAX_CONCURRENCY=2)
+    def test_concurrent_calls_are_capped_per_process(self):
+        threads = [threading.Thread(target=llm.generate, args=("prompt",)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(ConcurrencyBackend.peak, 2)
+
+    @override_settings(LLM_BACKEND='core.tests.ConcurrencyBackend', LLM_MAX_CONCURRENCY=2)
+    async def test_concurrent_async_calls_are_capped_per_event_loop(self):
+        replies = await asyncio.gather(*(llm.agenerate("prompt") for _ in range(5)))
+        self.assertEqual(replies, [FakeBackend.reply] * 5)
+        self.assertEqual(ConcurrencyBackend.peak, 2)
+
+
+class QuestionBackend(FakeBackend):
+    # Numbered, quoted and bulleted lines around an intro, the way models tend to answer
+    calls = 0
+
+    def generate(self, prompt, model, timeout, system=None):
+        QuestionBackend.calls += 1
+        return 'Here are some questions:\n1. "How do they react to setbacks?"\n2) What energises them?\n- What energises them?\n* When do they seem at their best?'
+
+    async def agenerate(self, prompt, model, timeout, system=None):
+        QuestionBackend.calls += 1
+        return "  How do they handle pressure?\n"
+
+
+@override_settings(CACHES=benchmarks.LOCAL_CACHES, LLM_BACKEND='core.tests.QuestionBackend', RATE_LIMIT_ENABLED=False)
+class QuestionBankTests(TestCase):
+    """"I'm not sure" is served from a pre-generated bank, rotating through its variants."""
+
+    def setUp(self):
+        QuestionBackend.calls = 0
+        owner = User.objects.create_user('asker', password='pw')
+        self.survey = Survey.objects.create(user=owner, respondent_name='Ann', relationship_type='coworker')
+
+    def ask(self, relationship='coworker'):
+        response = self.client.post(
+            reverse('get_alternative_question', args=[self.survey.uuid]),
+            json.dumps({'question_type': 'stress_profile', 'relationship': relationship}),
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()['question']
+
+    def test_model_output_is_parsed_into_questions(self):
+        self.assertEqual(parse_questions(QuestionBackend().generate("prompt", None, None)), [
+            "How do they react to setbacks?", "What energises them?", "When do they seem at their best?",
+        ])
+
+    def test_variants_are_served_least_served_first(self):
+        AlternativeQuestion.objects.bulk_create([
+            AlternativeQuestion(question_type='stress_profile', relationship=relationship, text=text, served_count=count)
+            for relationship, text, count in (
+                ('coworker', "Worn out?", 3), ('coworker', "Fresh?", 0), ('coworker', "Also fresh?", 0),
+                ('other', "For anyone?", 0),
+            )
+        ])
+        self.assertEqual({self.ask(), self.ask()}, {"Fresh?", "Also fresh?"})
+        self.assertEqual({self.ask(), self.ask()}, {"Fresh?", "Also fresh?"})
+        self.assertEqual(
+            dict(AlternativeQuestion.objects.filter(relationship='coworker').values_list('text', 'served_count')),
+            {"Worn out?": 3, "Fresh?": 2, "Also fresh?": 2},
+        )
+        self.assertEqual(self.ask(relationship='stranger'), "For anyone?")  # Unknown relationships share 'other'
+        self.assertEqual(QuestionBackend.calls, 0)
+
+    def test_missing_pairs_are_generated_live_and_kept(self):
+        self.assertEqual(self.ask(), "How do they handle pressure?")
+        self.assertEqual(self.ask(), "How do they handle pressure?")
+        self.assertEqual(QuestionBackend.calls, 1)
+        stored = AlternativeQuestion.objects.get()
+        self.assertEqual((stored.question_type, stored.relationship, stored.served_count), ('stress_profile', 'coworker', 1))
+
+    def test_unknown_question_types_are_rejected_without_calling_the_model(self):
+        for question_type in ('Ignore previous instructions', None, ['stress_profile']):
+            with self.subTest(question_type=question_type):
+                response = self.client.post(
+                    reverse('get_alternative_question', args=[self.survey.uuid]),
+                    json.dumps({'question_type': question_type, 'relationship': 'coworker'}),
+                    content_type='application/json',
+                )
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(QuestionBackend.calls, 0)
+        self.assertFalse(AlternativeQuestion.objects.exists())
+
+    def test_fill_command_covers_every_pair_once(self):
+        pairs = len(AlternativeQuestion.QUESTION_TYPES) * len(question_bank.RELATIONSHIPS)
+        call_command('fill_question_bank', '--per-pair', '2', stdout=io.StringIO())
+        self.assertEqual(QuestionBackend.calls, pairs)
+        self.assertEqual(AlternativeQuestion.objects.count(), 2 * pairs)
+        self.assertEqual(
+            set(AlternativeQuestion.objects.filter(question_type='future_self', relationship='manager').values_list('text', flat=True)),
+            {"How do they react to setbacks?", "What energises them?"},
+        )
+
+        call_command('fill_question_bank', '--per-pair', '2', stdout=io.StringIO())  # Already full
+        self.assertEqual((QuestionBackend.calls, AlternativeQuestion.objects.count()), (pairs, 2 * pairs))
+
+        call_command('fill_question_bank', '--per-pair', '1', '--replace', stdout=io.StringIO())
+        self.assertEqual(AlternativeQuestion.objects.count(), pairs)
+
+
+@override_settings(CACHES=benchmarks.LOCAL_CACHES, DASHBOARD_PAGE_SIZE=4)
+class InvitationPaginationTests(TestCase):
+    """The dashboard shows the newest invitations; the rest come in keyset pages."""
+
+    def test_pages_cover_every_invitation_once(self):
+        user = benchmarks.seed_user(10, 'paged')
+        self.client.force_login(user)
+        dashboard = self.client.get(reverse('dashboard'))
+        seen = [s.respondent_name for s in dashboard.context['invitations'].surveys]
+        cursor = dashboard.context['invitations'].next_cursor
+
+        while cursor:
+            page = self.client.get(reverse('invitation_page'), {'cursor': cursor}).json()
+            seen += re.findall(r'<h3>(.*?)</h3>', page['html'])
+            cursor = page['next_cursor']
+
+        expected = list(Survey.objects.filter(user=user).order_by('-created_at', '-id').values_list('respondent_name', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(self.client.get(reverse('invitation_page'), {'cursor': 'nonsense'}).status_code, 400)
+
+
+@override_settings(CACHES=benchmarks.LOCAL_CACHES)
+class FeedbackApiTests(TestCase):
+    """Admin feedback listing and export: joined rows, time filters, keyset pages."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = benchmarks.seed_user(20, 'reviewed')
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def test_pages_cover_every_feedback_once_in_constant_queries(self):
+        seen, cursor = [], ''
+        while True:
+            with self.assertNumQueries(3):  # session, user, one joined page
+                page = self.client.get(reverse('feedback_api'), {'size': 3, 'cursor': cursor}).json()
+            seen += [row['id'] for row in page['results']]
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+
+        expected = list(SurveyFeedback.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(page['results'][0]['user'], 'reviewed')
+
+    def test_time_range_and_bad_parameters(self):
+        newest = SurveyFeedback.objects.order_by('-created_at', '-id').first()
+        rows = self.client.get(reverse('feedback_api'), {'since': newest.created_at.isoformat()}).json()['results']
+        self.assertIn(newest.pk, [row['id'] for row in rows])
+        self.assertTrue(all(row['created_at'] >= newest.created_at.isoformat() for row in rows))
+        rows = self.client.get(reverse('feedback_api'), {'until': '2000-01-01'}).json()['results']
+        self.assertEqual(rows, [])
+
+        for params in ({'since': 'yesterday'}, {'cursor': 'nonsense'}, {'size': 0}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(reverse('feedback_api'), params).status_code, 400)
+
+    @override_settings(FEEDBACK_EXPORT_BATCH=4)
+    def test_export_streams_every_row_as_ndjson(self):
+        response = self.client.get(reverse('feedback_export'))
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response).decode().splitlines()]
+        self.assertEqual([row['id'] for row in rows], list(
+            SurveyFeedback.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        ))
+
+    def test_admin_only(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('feedback_api')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('feedback_export')).status_code, 403)
+
+
+@override_settings(
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'ratelimit-tests'},
+        'ratelimit': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'ratelimit-tests-buckets'},
+    },
+    LLM_BACKEND='fake',
+    RATE_LIMIT_ENABLED=True,
+    RATE_LIMITS={**settings.RATE_LIMITS, 'public_signup:ip': (2, 600), 'public_signup:link': (3, 3600), 'chat:user': (50, 60)},
+)
+class AdmissionControlTests(TestCase):
+    """Bursts get fast 429s with Retry-After; repeat signups reuse their survey."""
+
+    def setUp(self):
+        caches['default'].clear()
+        caches['ratelimit'].clear()
+        self.owner = benchmarks.seed_user(2, 'linkowner')
+        self.client.force_login(self.owner)
+        self.link = reverse('public_survey', args=[self.owner.profile.public_link_uuid])
+
+    def signup(self, email, ip='203.0.113.1'):
+        return self.client.post(self.link, {'name': 'Public', 'email': email}, REMOTE_ADDR=ip)
+
+    def test_public_signups_are_limited_per_ip_and_per_link(self):
+        self.assertEqual(self.signup('a@example.com').status_code, 302)
+        self.assertEqual(self.signup('b@example.com').status_code, 302)
+        limited = self.signup('c@example.com')
+        self.assertEqual(limited.status_code, 429)
+        self.assertGreater(int(limited['Retry-After']), 0)
+
+        self.assertEqual(self.signup('d@example.com', ip='203.0.113.2').status_code, 302)
+        self.assertEqual(self.signup('e@example.com', ip='203.0.113.3').status_code, 429)  # The link's own bucket
+        self.assertEqual(Survey.objects.filter(user=self.owner, respondent_email__endswith='@example.com').count(), 2 + 3)
+
+    def test_repeat_signup_returns_the_existing_survey(self):
+        first = self.signup('Repeat@Example.com')
+        again = self.signup('repeat@example.com', ip='203.0.113.9')
+        self.assertEqual(first['Location'], again['Location'])
+        self.assertEqual(Survey.objects.filter(user=self.owner, respondent_email__iexact='repeat@example.com').count(), 1)
+
+    def test_signups_never_reuse_private_invites(self):
+        invite = Survey.objects.create(user=self.owner, respondent_name='Invitee', respondent_email='invitee@example.com')
+        response = self.signup('Invitee@example.com')
+        self.assertNotIn(str(invite.uuid), response['Location'])
+        public = Survey.objects.get(user=self.owner, source=Survey.SOURCE_PUBLIC_LINK)
+        self.assertEqual(response['Location'], reverse('survey_view', args=[public.uuid]))
+
+        # A finished public signup isn't handed out again either
+        Survey.objects.filter(pk=public.pk).update(is_completed=True)
+        self.assertNotIn(str(public.uuid), self.signup('invitee@example.com', ip='203.0.113.9')['Location'])
+
+    def test_forwarded_for_is_used_behind_trusted_proxies(self):
+        # Three clients behind one router: without the proxy setting they'd share the
+        # router's bucket and the third would be refused
+        with self.settings(RATE_LIMIT_PROXY_COUNT=1):
+            statuses = [
+                self.client.post(self.link, {'email': f"p{i}@example.com"}, REMOTE_ADDR='10.0.0.1',
+                                 HTTP_X_FORWARDED_FOR=f"spoofed, 198.51.100.{i}").status_code
+                for i in range(3)
+            ]
+        self.assertEqual(statuses, [302, 302, 302])
+
+    @override_settings(LLM_GLOBAL_MAX_IN_FLIGHT=1)
+    def test_llm_calls_over_the_global_cap_are_rejected(self):
+        message = json.dumps({'message': 'Hi'})
+        with LLMSlot():  # Another process's call in flight
+            for route in ('chat_view', 'chat_stream'):
+                response = self.client.post(reverse(route), message, content_type='application/json')
+                with self.subTest(route=route):
+                    self.assertEqual(response.status_code, 429)
+                    self.assertEqual(response['Retry-After'], str(settings.LLM_BUSY_RETRY_AFTER))
+        response = self.client.post(reverse('chat_stream'), message, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        with LLMSlot():
+            pass  # A stream whose body was never read (client gone) holds no slot
+        self.assertIn(b'event: done', b''.join(response))
+        with LLMSlot():
+            pass  # ...and a finished one gave its slot back
+
+    def test_rate_limit_cache_must_be_shared_atomically(self):
+        def with_backend(backend):
+            return {**settings.CACHES, 'ratelimit': {'BACKEND': f"django.core.cache.backends.{backend}", 'LOCATION': 'unused'}}
+
+        with self.settings(CACHES=with_backend('filebased.FileBasedCache'), DEBUG=False):
+            self.assertEqual([error.id for error in check_rate_limit_cache(None)], ['core.E001'])
+            with self.settings(RATE_LIMIT_ENABLED=False):
+                self.assertEqual(check_rate_limit_cache(None), [])
+        with self.settings(CACHES=with_backend('db.DatabaseCache'), DEBUG=False):
+            self.assertEqual(check_rate_limit_cache(None), [])
@@ -0,0 +1,151 @@
+import hashlib
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import FeedbackExcerpt
+from .retrieval import ANSWER_FIELDS
+
+# Recurring themes across respondents, computed locally.
+# For each survey question the answers' stored term counts (FeedbackExcerpt.terms) become
+# a TF-IDF matrix, which spherical k-means groups into a few themes, each labelled by its
+# heaviest terms. Results are cached per question under a digest of that question's
+# excerpts, so a change only re-clusters the questions whose answers changed, and the
+# whole snapshot is cached per feedback_context_version for the dashboard.
+# Deterministic: the same answers always give the same themes (and the same prompt).
+
+QUESTIONS = [question for _, question in ANSWER_FIELDS]
+QUESTION_FIELDS = {question: field for field, question in ANSWER_FIELDS}  # Cache-key safe names
+MAX_ITERATIONS = 25
+
+
+def tfidf_matrix(rows):
+    # rows: [terms dict]. Returns (unit-length TF-IDF rows, vocabulary list); vocabulary
+    # is the THEMES_MAX_TERMS terms used by most answers, ignoring one-off words
+    df = {}
+    for terms in rows:
+        for term in terms:
+            df[term] = df.get(term, 0) + 1
+    ranked = sorted((term for term, n in df.items() if n >= 2), key=lambda term: (-df[term], term))
+    vocabulary = ranked[:settings.THEMES_MAX_TERMS]
+    columns = {term: i for i, term in enumerate(vocabulary)}
+
+    matrix = np.zeros((len(rows), len(vocabulary)), dtype=np.float32)
+    for i, terms in enumerate(rows):
+        for term, count in terms.items():
+            if term in columns:
+                matrix[i, columns[term]] = count
+    idf = np.log((1 + len(rows)) / (1 + np.array([df[term] for term in vocabulary], dtype=np.float32))) + 1
+    matrix *= idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0), vocabulary
+
+
+def initial_centroids(matrix, k):
+    # Farthest-point seeding from the answer closest to the mean: deterministic, no RNG
+    mean = matrix.mean(axis=0)
+    chosen = [int(np.argmax(matrix @ mean))]
+    closest = matrix @ matrix[chosen[0]]
+    while len(chosen) < k:
+        nxt = int(np.argmin(closest))
+        chosen.append(nxt)
+        closest = np.maximum(closest, matrix @ matrix[nxt])
+    return matrix[chosen].copy()
+
+
+def cluster(matrix, k):
+    # Spherical k-means (cosine similarity on unit rows). Returns (labels, centroids).
+    centroids = initial_centroids(matrix, k)
+    labels = None
+    for _ in range(MAX_ITERATIONS):
+        new_labels = np.argmax(matrix @ centroids.T, axis=1)
+        if labels is not None and np.array_equal(labels, new_labels):
+            break
+        labels = new_labels
+        for c in range(k):
+            members = matrix[labels == c]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[c] = centroid / (np.linalg.norm(centroid) or 1)
+    return labels, centroids
+
+
+def question_themes(rows):
+    # rows: [(excerpt_id, terms)] for one question.
+    # Returns [{'terms', 'count', 'excerpt'}] largest theme first; `excerpt` is the id of
+    # the answer closest to the theme's centre.
+    if len(rows) < settings.THEMES_MIN_ANSWERS:
+        return []
+    matrix, vocabulary = tfidf_matrix([terms for _, terms in rows])
+    usable = np.flatnonzero(matrix.any(axis=1))
+    k = min(settings.THEMES_PER_QUESTION, len(usable) // 2)
+    if k < 1:
+        return []
+    matrix = matrix[usable]
+    labels, centroids = cluster(matrix, k)
+
+    themes = []
+    for c in range(k):
+        members = np.flatnonzero(labels == c)
+        if not len(members):
+            continue
+        top_terms = np.argsort(-centroids[c], kind='stable')[:settings.THEMES_LABEL_TERMS]
+        closest = members[np.argmax(matrix[members] @ centroids[c])]
+        themes.append({
+            'terms': [vocabulary[t] for t in top_terms if centroids[c][t] > 0],
+            'count': len(members),
+            'excerpt': rows[usable[closest]][0],
+        })
+    return sorted(themes, key=lambda theme: (-theme['count'], theme['terms']))
+
+
+def digest(rows):
+    return hashlib.sha256(",".join(str(excerpt_id) for excerpt_id, _ in rows).encode()).hexdigest()[:16]
+
+
+def profile_themes(profile):
+    # [{'question', 'answers', 'themes'}] for questions with enough answers to compare
+    key = f"themes:{profile.pk}:{profile.feedback_context_version}"
+    snapshot = cache.get(key)
+    if snapshot is not None:
+        return snapshot
+
+    rows = {question: [] for question in QUESTIONS}
+    excerpts = FeedbackExcerpt.objects.filter(profile_id=profile.pk).order_by('id')
+    for excerpt_id, question, terms in excerpts.values_list('id', 'question', 'terms'):
+        rows.setdefault(question, []).append((excerpt_id, terms))
+
+    # Only questions whose set of answers changed are clustered again
+    keys = {
+        question: f"themes-question:{profile.pk}:{QUESTION_FIELDS[question]}:{digest(rows[question])}"
+        for question in QUESTIONS
+    }
+    cached = cache.get_many(keys.values())
+    snapshot = []
+    for question in QUESTIONS:
+        themes = cached.get(keys[question])
+        if themes is None:
+            themes = question_themes(rows[question])
+            cache.set(keys[question], themes, settings.THEMES_CACHE_TIMEOUT)
+        if themes:
+            snapshot.append({'question': question, 'answers': len(rows[question]), 'themes': themes})
+
+    cache.set(key, snapshot, settings.THEMES_CACHE_TIMEOUT)
+    return snapshot
+
+
+def themes_summary(profile):
+    # Compact text for the analysis prompt: one line per theme with a representative
+    # (anonymous) answer, so the model sees every respondent's angle in a few hundred tokens
+    snapshot = profile_themes(profile)
+    excerpt_ids = [theme['excerpt'] for question in snapshot for theme in question['themes']]
+    texts = dict(FeedbackExcerpt.objects.filter(pk__in=excerpt_ids).values_list('id', 'text')) if excerpt_ids else {}
+
+    lines = []
+    for question in snapshot:
+        lines.append(f"{question['question']} ({question['answers']} answers):")
+        for theme in question['themes']:
+            quote = " ".join(texts.get(theme['excerpt'], '').split())[:settings.THEMES_QUOTE_CHARS]
+            lines.append(f"- {', '.join(theme['terms'])}: {theme['count']} respondents, e.g. \"{quote}\"")
+    return "\n".join(lines)
@@ -9,14 +9,21 @@ urlpatterns = [
     
     # Analysis & Chat
     path('profile/analyze/', views.profile_analysis_view, name='profile_analysis'),
+    path('profile/analyze/status/', views.analysis_status_view, name='analysis_status'),
+    path('profile/report/', views.profile_report_view, name='profile_report'),
     path('profile/chat/', views.chat_view, name='chat_view'),
+    path('profile/chat/stream/', views.chat_stream_view, name='chat_stream'),
     
     # Dashboard & Auth
     path('', views.landing_view, name='landing'),
     path('dashboard/', views.dashboard_view, name='dashboard'),
+    path('dashboard/invitations/', views.invitation_page_view, name='invitation_page'),
     path('stats/', views.stats_view, name='stats'),
+    path('stats/feedback/', views.feedback_api_view, name='feedback_api'),
+    path('stats/feedback/export/', views.feedback_export_view, name='feedback_export'),
     path('onboarding/', views.onboarding_view, name='onboarding'),
     path('invite/', views.add_invite_view, name='add_invite'),
+    path('invite/bulk/', views.bulk_invite_view, name='bulk_invite'),
     path('invite/delete/<uuid:uuid>/', views.delete_invite_view, name='delete_invite'),
     # path('signup/', views.signup_view, name='signup'), # Handled by allauth
 ]
\ No newline at end of file
@@ -1,15 +1,41 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from django.shortcuts import render, get_object_or_404, aget_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
-from .models import Survey, Profile, SurveyFeedback
-import google.generativeai as genai
-import os
+from .models import Survey, Profile, SurveyFeedback, AnalysisJob, AlternativeQuestion
+from .question_bank import aserve_alternative, alternative_prompt, normalise_relationship
+from .jobs import active_job, enqueue_analysis
+from .analysis import build_analysis_prompt
+from .chat import compact, finish_turn, messages_to_fold, prepare_turn
+from .generation_cache import cache_key, get_cached_generation
+from .outbox import queue_email, queue_emails
+from .sentiment_stats import daily_series, sentiment_totals
+from .pagination import FeedbackPage, SurveyPage
+from .themes import profile_themes
+from .ratelimit import LLMSlot, RateLimited, rate_limit, too_many_requests
+from .fragment_cache import STATS_SCOPE, dashboard_scope, fragment_version, invalidate
+from . import llm
 from django.urls import reverse
-from django.core.mail import send_mail
 from django.conf import settings
-from django.http import HttpResponse, JsonResponse
-import threading
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+import asyncio
 import json
+import hashlib
+from functools import partial
+import csv
+import io
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.db.models.functions import Length
+from django.utils.cache import get_conditional_response
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.http import quote_etag
+from asgiref.sync import sync_to_async
 
 # API Key managed via environment variables
 
@@ -40,276 +66,239 @@ def survey_view(request, uuid):
     return render(request, 'survey_form.html', {'survey': survey})
 
 # --- NEW GEMINI FUNCTION ---
-@login_required
-def get_alternative_question(request, uuid):
+# Public: respondents are not logged in, the survey uuid is the credential
+@rate_limit('alternative_question', by=('ip', 'survey'))
+async def get_alternative_question(request, uuid):
     if request.method != 'POST':
          return JsonResponse({'error': 'Invalid request method'}, status=400)
          
     try:
         data = json.loads(request.body)
         question_type = data.get('question_type')
-        relationship = data.get('relationship', 'acquaintance')
-        
-        survey = get_object_or_404(Survey, uuid=uuid)
-        target_user = survey.user
-        
-        # Configure Gemini
-        api_key = os.environ.get("GOOGLE_API_KEY")
-        if not api_key:
+        relationship = normalise_relationship(data.get('relationship', 'other'))
+        # Public endpoint: only the bank's question types, so arbitrary text never reaches a prompt
+        if question_type not in AlternativeQuestion.QUESTION_TYPES:
+            return JsonResponse({'error': 'Unknown question type'}, status=400)
+
+        await aget_object_or_404(Survey.objects.for_status(), uuid=uuid)
+
+        # 1. Serve a pre-generated alternative (millisecond lookup)
+        question = await aserve_alternative(question_type, relationship)
+        if question:
+            return JsonResponse({'question': question})
+
+        # 2. Pair not in the bank yet: generate live and keep it for next time
+        if not llm.is_configured():
             return JsonResponse({'error': 'API Key missing'}, status=500)
-            
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        # Context for the specific question types to help AI generate a good alternative
-        context_map = {
-            'energy_audit': f"The original question asked about 'flow state' and competence vs genius.",
-            'stress_profile': f"The original question asked about their 'stress character' or shadow side.",
-            'glass_ceiling': f"The original question asked about a 'hard truth' or behavior limiting their potential.",
-            'future_self': f"The original question asked to imagine them 3 years from now as a leader."
-        }
         
-        specific_context = context_map.get(question_type, "General leadership feedback.")
-        
-        prompt = f"""
-        Objective: Generate a SINGLE, simple, open-ended interview question for a respondent who knows the subject as a "{relationship}".
-        
-        Constraint: The respondent clicked "I'm not sure" on a deep psychological question about "{question_type}".
-        Context of original question: {specific_context}
-        
-        Task: Create a softer, broader, easier-to-answer alternative question that still gets at the same underlying insight but requires less specific observation.
-        
-        Example for 'Stress': 
-        - Hard: "Who do they turn into when threatened?"
-        - Easy: "When things get difficult at work, how do you typically see them react?"
+        async with LLMSlot():
+            question = (await llm.agenerate(alternative_prompt(question_type, relationship))).strip()
+        await AlternativeQuestion.objects.acreate(question_type=question_type, relationship=relationship, text=question)
+        return JsonResponse({'question': question})
 
-        Output ONLY the text of the new question. No quotes, no intro.
-        """
-        
-        response = model.generate_content(prompt)
-        return JsonResponse({'question': response.text.strip()})
-        
+    except RateLimited as e:
+        return too_many_requests(request, e.retry_after)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 
-def run_ai_analysis(profile_id, prompt, api_key):
-    import time
-    try:
-        # Re-fetch profile to avoid stale data (and ensure thread-safety)
-        from .models import Profile
-        profile = Profile.objects.get(id=profile_id)
-        
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.5-flash')
-        
-        # Stream response (standard practice for long gens)
-        response_stream = model.generate_content(prompt, stream=True)
-        
-        full_text = ""
-        for chunk in response_stream:
-            if chunk.text:
-                full_text += chunk.text
-        
-        profile.ai_summary = full_text
-        profile.save()
-        print(f"BACKGROUND DEBUG: Analysis saved for Profile {profile_id}")
-        
-    except Exception as e:
-        print(f"BACKGROUND ERROR: {e}")
-        try:
-             from .models import Profile
-             profile = Profile.objects.get(id=profile_id)
-             profile.ai_summary = f"Error during analysis: {str(e)}. Please try again."
-             profile.save()
-        except:
-            pass
-
 @login_required
+@rate_limit('profile_analysis', by=('user',), methods=('GET', 'POST'))
 def profile_analysis_view(request):
-    # 1. Gather ALL completed surveys for this user
-    completed_surveys = Survey.objects.filter(user=request.user, is_completed=True)
-    
-    if not completed_surveys:
+    # 1. Only analyse once there is feedback to analyse
+    if not Survey.objects.filter(user=request.user, is_completed=True).exists():
         return redirect('dashboard')
         
-    # Aggregate text
-    try:
-        profile = request.user.profile
-    except Profile.DoesNotExist:
-        profile = Profile.objects.create(user=request.user)
-
-    text_data = ""
-    text_data += f"\n--- USER CONTEXT ---\n"
-    text_data += f"Role: {profile.current_role}\n"
-    text_data += f"Responsibilities: {profile.responsibilities}\n"
-    text_data += f"Family: {profile.family_context}\n"
-    text_data += f"Values: {profile.core_values}\n"
-    
-    text_data += f"\n--- 10-YEAR VISION ---\n"
-    text_data += f"Perfect Tuesday (2035): {profile.vision_perfect_tuesday}\n"
-    text_data += f"Toast Test: {profile.vision_toast_test}\n"
-    text_data += f"Anti-Vision: {profile.vision_anti_vision}\n"
-    
-    text_data += f"\n--- INTERNAL OPERATING SYSTEM ---\n"
-    text_data += f"Stress Response: {profile.stress_response}\n"
-    text_data += f"The Anchor: {profile.internal_anchor}\n"
-    
-    for s in completed_surveys:
-        text_data += f"\n--- Feedback from {s.respondent_name} ---\n"
-        text_data += f"Context: {s.relationship_context}\n"
-        text_data += f"Energy Audit: {s.energy_audit_answer}\n"
-        text_data += f"Stress Profile: {s.stress_profile_answer}\n"
-        text_data += f"Glass Ceiling: {s.glass_ceiling_answer}\n"
-        text_data += f"Future Self: {s.future_self_answer}\n"
+    from django.contrib import messages
+
+    # Already running (double click, second tab)? Attach to that run instead of starting another
+    profile = Profile.objects.for_status().get_for_user(request.user)
+    if active_job(profile.pk) is not None:
+        messages.info(request, "Your analysis is already running. We'll update this page when it's ready.")
+        return redirect('dashboard')
+    profile = Profile.objects.for_context().get(pk=profile.pk)
+
+    # Pre-built context (see Profile.feedback_context), fitted to the analysis token budget
+    prompt = build_analysis_prompt(profile)
+
+    # Nothing changed since the last run? Reuse that report instead of paying for a new generation
+    cached_html = get_cached_generation(cache_key(prompt, settings.GEMINI_MODEL))
+    if cached_html is not None:
+        profile.ai_summary = cached_html
+        profile.save(update_fields=['ai_summary', 'last_updated'])
+        messages.success(request, "No new feedback since your last analysis, so your existing profile is up to date.")
+        return redirect('dashboard')
 
     # Check API Key
-    api_key = os.environ.get("GOOGLE_API_KEY")
-    if not api_key:
-        from django.contrib import messages
+    if not llm.is_configured():
         messages.error(request, "Configuration Error: No Google API Key found.")
         return redirect('dashboard')
 
-    # Construct Prompt
-    prompt = f"""
-    Role: You are an expert developmental psychologist and executive coach, fluent in the Enneagram, Internal Family Systems (IFS), The 6 Types of Working Genius, and Vertical Leadership Development.
-    
-    Input Data: You will receive 360-feedback from peers AND the user's own "10-Year Vision" from their onboarding.
-    
-    FEEDBACK DATA:
-    {text_data}
-    
-    Objective: Synthesize the inputs into a high-impact "User Manual" for the subject. Do not summarize; interpret the data to reveal their operating system. Use "Radical Candor"—be direct, kind, and psychologically deep.
-    
-    Output Format:
-    
-    Return pure HTML code (no markdown backticks, no markdown syntax like **, #). structure it as follows:
-
-    <div class="report-section">
-        <h3>Section 1: Who You Are (The Operating System)</h3>
-        <p><strong>Core Motivation:</strong> [Enneagram Insight]</p>
-        <p><strong>Zone of Genius:</strong> [Working Genius Insight]</p>
-    </div>
-
-    <div class="report-section">
-        <h3>Section 2: The Gap (Intent vs. Impact)</h3>
-        <p><strong>The Protectors (IFS):</strong></p>
-        <ul>
-            <li>[Character Name]: [Description of behavior and cost]</li>
-        </ul>
-        <p><strong>The Blind Spot:</strong> [Vertical Development Insight]</p>
-    </div>
-
-    <div class="report-section">
-        <h3>Section 3: The North Star</h3>
-        <p>[Comparison of Self-Report vs Peer Feedback]</p>
-        <p><strong>Vision of Maturity:</strong> [Description of them at Self-Transforming level]</p>
-    </div>
-
-    <div class="report-section">
-        <h3>Section 4: The Manual (The Path Forward)</h3>
-        <p><strong>The Daily Practice:</strong> [Specific Micro-habit]</p>
-        
-        <p><strong>The Media Stack:</strong></p>
-        <ul>
-            <li><strong>Read:</strong> [Book Title] - [Why]</li>
-            <li><strong>Watch:</strong> [Movie/Show] - [Why]</li>
-            <li><strong>Listen:</strong> [Podcast Episode] - [Why]</li>
-        </ul>
-
-        <p><strong>The Experience:</strong></p>
-        <ul>
-            <li>[Activity Recommendation]</li>
-        </ul>
-    </div>
-    """
-
     # Set Status Marker
     profile.ai_summary = "__ANALYZING__"
-    profile.save()
+    profile.save(update_fields=['ai_summary', 'last_updated'])
+
+    # Queue the generation; `manage.py run_analysis_worker` picks it up.
+    # A concurrent request may have won the race, in which case this one attaches to its job.
+    _, created = enqueue_analysis(profile, prompt)
+    if not created:
+        messages.info(request, "Your analysis is already running. We'll update this page when it's ready.")
+        return redirect('dashboard')
 
-    # Launch Background Thread
-    import threading
-    t = threading.Thread(target=run_ai_analysis, args=(profile.id, prompt, api_key))
-    t.start()
-    
-    from django.contrib import messages
     messages.success(request, "Analysis started! This may take 30-60 seconds. We'll update this page when it's ready.")
 
     return redirect('dashboard')
 
+def analysis_status(user):
+    # Small status document for the dashboard poller: never touches the report HTML itself
+    profile = (
+        Profile.objects.filter(user=user)
+        .annotate(is_analyzing=ExpressionWrapper(Q(ai_summary="__ANALYZING__"), output_field=BooleanField()))
+        .values('id', 'is_analyzing', 'last_updated')
+        .first()
+    )
+    if profile is None:
+        return {'state': 'none'}
+
+    job = (
+        AnalysisJob.objects.filter(profile_id=profile['id'])
+        .order_by('-id')
+        .annotate(progress=Length('partial_output'))  # Size only; the text is fetched with the report
+        .values('id', 'status', 'attempts', 'max_attempts', 'progress')
+        .first()
+    )
+
+    if profile['is_analyzing']:
+        state = job['status'] if job else AnalysisJob.STATUS_QUEUED
+        if state == AnalysisJob.STATUS_QUEUED and job and job['attempts']:
+            state = 'retrying'
+    elif job and job['status'] == AnalysisJob.STATUS_FAILED:
+        state = 'failed'
+    else:
+        state = 'done'
+
+    return {
+        'state': state,
+        'job': job['id'] if job else None,
+        'attempt': job['attempts'] if job else 0,
+        'max_attempts': job['max_attempts'] if job else 0,
+        'progress': job['progress'] if job and profile['is_analyzing'] else 0,
+        'updated': profile['last_updated'].isoformat(),
+    }
+
 @login_required
-def chat_view(request):
+def analysis_status_view(request):
+    status = analysis_status(request.user)
+
+    # Pollers send back the ETag; an unchanged status costs a bodiless 304
+    etag = quote_etag(hashlib.md5(json.dumps(status, sort_keys=True).encode()).hexdigest())
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(status)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+@login_required
+def profile_report_view(request):
+    # Just the report fragment, swapped into the dashboard once analysis finishes
+    profile = Profile.objects.for_report().get_for_user(request.user)
+    partial_text = ''
+    if profile.ai_summary == "__ANALYZING__":
+        # Still generating: show what has been streamed so far
+        partial_text = (
+            AnalysisJob.objects.filter(profile=profile, status__in=AnalysisJob.ACTIVE_STATUSES)
+            .values_list('partial_output', flat=True).first()
+        ) or ''
+    return render(request, 'partials/profile_report.html', {'profile': profile, 'partial_text': partial_text})
+
+@login_required
+@rate_limit('chat', by=('user',))
+async def chat_view(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
             user_message = data.get('message', '')
-            
-            # 1. Gather Context (All completed surveys)
-            completed_surveys = Survey.objects.filter(user=request.user, is_completed=True)
-            context_data = ""
-            
-            # Add User Context (Onboarding)
-            try:
-                profile = request.user.profile
-            except Profile.DoesNotExist:
-                profile = Profile.objects.create(user=request.user)
-            context_data += f"\n--- USER CONTEXT ---\n"
-            context_data += f"Role: {profile.current_role}\n"
-            context_data += f"Responsibilities: {profile.responsibilities}\n"
-            context_data += f"Family: {profile.family_context}\n"
-            context_data += f"Values: {profile.core_values}\n"
-            
-            context_data += f"\n--- 10-YEAR VISION ---\n"
-            context_data += f"Perfect Tuesday (2035): {profile.vision_perfect_tuesday}\n"
-            context_data += f"Toast Test: {profile.vision_toast_test}\n"
-            context_data += f"Anti-Vision: {profile.vision_anti_vision}\n"
-            
-            context_data += f"\n--- INTERNAL OPERATING SYSTEM ---\n"
-            context_data += f"Stress Response: {profile.stress_response}\n"
-            context_data += f"The Anchor: {profile.internal_anchor}\n"
-
-            for s in completed_surveys:
-                context_data += f"\n--- Feedback (Anonymous) ---\n"
-                context_data += f"Context: {s.relationship_context}\n"
-                context_data += f"Energy: {s.energy_audit_answer}\n"
-                context_data += f"Stress: {s.stress_profile_answer}\n"
-                context_data += f"Glass Ceiling: {s.glass_ceiling_answer}\n"
-                context_data += f"Future Self: {s.future_self_answer}\n"
-
-            # 2. Configure Gemini
-            api_key = os.environ.get("GOOGLE_API_KEY")
-            if not api_key:
-                return JsonResponse({'reply': "System Error: Google API Key not configured."})
-
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            
-            # 3. Construct Prompt with Privacy Rules
-            prompt = f"""
-            You are a confidential executive coach. You have access to the following 360-degree feedback about the user.
-            
-            FEEDBACK DATA:
-            {context_data}
-            
-            USER QUESTION: "{user_message}"
-            
-            CRITICAL RULES:
-            1. **CONFIDENTIALITY**: NEVER reveal the identity of the person who gave specific feedback. Use phrases like "One colleague mentioned..." or "Feedback suggests...".
-            2. **SYNTHESIS**: Aggregate the insights. Don't just quote.
-            3. **TONE**: Professional, encouraging, and growth-oriented.
-            
-            Answer the user's question based on the data.
-            """
-            
-            response = model.generate_content(prompt)
-            return JsonResponse({'reply': response.text})
-            
+            user = await request.auser()
+            async with LLMSlot():  # Taken first, so a busy server answers 429 before any work
+                session, history, prompt = await sync_to_async(prepare_turn)(user, data.get('session_id'), user_message)
+
+                if not llm.is_configured():
+                    return JsonResponse({'reply': "System Error: Google API Key not configured."})
+
+                # Older turns are summarised alongside the reply, not after it
+                folded = messages_to_fold(history)
+                reply, _ = await asyncio.gather(
+                    llm.agenerate(prompt, system=session.system_prompt),
+                    compact(session, folded),
+                )
+            await sync_to_async(finish_turn)(session, user_message, reply, touch=not folded)
+            return JsonResponse({'reply': reply, 'session_id': session.pk})
+
+        except RateLimited as e:
+            return too_many_requests(request, e.retry_after)
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
             
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
+def sse_event(data, event=None):
+    # Format one server-sent event frame
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {json.dumps(data)}\n\n"
+
+@login_required
+@rate_limit('chat', by=('user',))
+async def chat_stream_view(request):
+    # Same as chat_view, but forwards Gemini chunks to the browser as server-sent events
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    if not llm.is_configured():
+        return JsonResponse({'reply': "System Error: Google API Key not configured."})
+
+    # Busy: answer 429 now. The slot itself is taken by the stream, so a client that
+    # disconnects before the body starts never holds one
+    if not await LLMSlot.available():
+        return too_many_requests(request, settings.LLM_BUSY_RETRY_AFTER)
+
+    user = await request.auser()
+    user_message = data.get('message', '')
+    session, history, prompt = await sync_to_async(prepare_turn)(user, data.get('session_id'), user_message)
+
+    async def event_stream():
+        reply = []
+        slot = LLMSlot()
+        try:
+            await slot.aacquire()
+            yield sse_event({'session_id': session.pk}, event='session')
+            async for text in llm.astream(prompt, system=session.system_prompt):
+                reply.append(text)
+                yield sse_event({'text': text})
+            await slot.arelease()
+            yield sse_event({}, event='done')
+            folded = messages_to_fold(history)
+            await sync_to_async(finish_turn)(session, user_message, "".join(reply), touch=not folded)
+            # After `done`, so summarising older turns never delays the visible reply
+            await compact(session, folded)
+        except RateLimited as e:
+            # Lost the last slot to another request since the check above
+            yield sse_event({'error': 'Too many requests. Please try again shortly.', 'retry_after': e.retry_after}, event='error')
+        except Exception as e:
+            yield sse_event({'error': str(e)}, event='error')
+        finally:
+            await slot.arelease()
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop proxies from buffering the stream
+    return response
+
 # --- DASHBOARD & AUTH ---
 
 from django.http import HttpResponse
@@ -317,31 +306,43 @@ from django.http import HttpResponse
 @login_required
 def dashboard_view(request):
     try:
-        # Ensure Profile exists
-        try:
-            profile = request.user.profile
-        except Profile.DoesNotExist:
-            profile = Profile.objects.create(user=request.user)
+        # Ensure Profile exists (without the feedback context document nobody shows here)
+        profile = Profile.objects.for_dashboard().get_for_user(request.user)
 
         # Check Onboarding
         if not profile.onboarding_completed:
             return redirect('onboarding')
 
-        # Show only the logged-in user's surveys (invitations)
-        surveys = Survey.objects.filter(user=request.user).order_by('-created_at')
-        return render(request, 'dashboard.html', {'surveys': surveys, 'profile': profile})
+        # First page of the logged-in user's invitations; older ones load on scroll.
+        # Lazy: only queried when its cached fragment is missing or outdated.
+        invitations = SurveyPage(request.user.pk)
+        get_token(request)  # Cached forms carry this user's CSRF secret, so the key varies on it
+        return render(request, 'dashboard.html', {
+            'invitations': invitations,
+            'profile': profile,
+            'themes': partial(profile_themes, profile),  # Called only when the fragment is rebuilt
+            'fragment_version': fragment_version(dashboard_scope(request.user.pk)),
+            'fragment_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
+        })
     except Exception as e:
         import traceback
         return HttpResponse(f"<h1>Debug Error</h1><pre>{traceback.format_exc()}</pre>", status=500)
 
+@login_required
+def invitation_page_view(request):
+    # Infinite-scroll endpoint: the next page of invitation cards after `cursor`
+    try:
+        page = SurveyPage(request.user.pk, request.GET.get('cursor'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    html = render_to_string('partials/invitation_cards.html', {'surveys': page.surveys}, request)
+    return JsonResponse({'html': html, 'next_cursor': page.next_cursor})
+
 @login_required
 def onboarding_view(request):
     try:
-        # Ensure Profile exists
-        try:
-            profile = request.user.profile
-        except Profile.DoesNotExist:
-            profile = Profile.objects.create(user=request.user)
+        # Ensure Profile exists; the answers are only written here, never read
+        profile = Profile.objects.for_status().get_for_user(request.user)
 
         if request.method == 'POST':
             profile.current_role = request.POST.get('role', '')
@@ -359,7 +360,8 @@ def onboarding_view(request):
             profile.internal_anchor = request.POST.get('internal_anchor', '')
             
             profile.onboarding_completed = True
-            profile.save()
+            profile.save(update_fields=Profile.ONBOARDING_FIELDS + ['onboarding_completed', 'last_updated'])
+            profile.update_feedback_context(upsert=profile.profile_context_sections())
             print(f"DEBUG: Onboarding saved for {request.user.username}. Completed: {profile.onboarding_completed}")
             return redirect('dashboard')
         return render(request, 'onboarding.html')
@@ -367,61 +369,156 @@ def onboarding_view(request):
         import traceback
         return HttpResponse(f"<h1>Debug Error</h1><pre>{traceback.format_exc()}</pre>", status=500)
 
+def invite_email(request, survey):
+    # (subject, body, to_email) for an invitation
+    link = request.build_absolute_uri(reverse('survey_view', args=[survey.uuid]))
+    return (
+        f"Feedback Request from {request.user.username}",
+        f"Hi {survey.respondent_name},\n\n{request.user.username} would value your feedback.\n\nPlease click here: {link}",
+        survey.respondent_email,
+    )
+
 @login_required
 def add_invite_view(request):
     try:
         if request.method == 'POST':
             name = request.POST.get('name')
-            email = request.POST.get('email')
+            email = (request.POST.get('email') or '').strip()
             phone = request.POST.get('phone', '')
-            
-            # Create the invitation
-            survey = Survey.objects.create(
-                user=request.user,
-                respondent_name=name,
-                respondent_email=email,
-                respondent_phone=phone
-            )
-            
-            # Generate Link
-            link = request.build_absolute_uri(reverse('survey_view', args=[survey.uuid]))
-            
-            # Send Email in Background Thread
-            import threading
-            def send_email_thread(subject, message, from_email, recipient_list):
-                try:
-                    send_mail(
-                        subject=subject,
-                        message=message,
-                        from_email=from_email,
-                        recipient_list=recipient_list,
-                        fail_silently=False,
-                    )
-                    print(f"Email sent successfully to {recipient_list}")
-                except Exception as e:
-                    print(f"Email Error (Background): {e}")
-
-            email_thread = threading.Thread(
-                target=send_email_thread,
-                args=(
-                    f"Feedback Request from {request.user.username}",
-                    f"Hi {name},\n\n{request.user.username} would value your feedback.\n\nPlease click here: {link}",
-                    settings.DEFAULT_FROM_EMAIL,
-                    [email]
+
+            try:
+                validate_email(email)
+            except ValidationError:
+                return render(request, 'invite.html', {
+                    'errors': [f"Invalid email '{email}'" if email else "An email address is required."],
+                    'name': name, 'email': email, 'phone': phone,
+                })
+
+            # Create the invitation and queue its email together: never an invite nobody is told about.
+            # `manage.py send_outbox` delivers it
+            with transaction.atomic():
+                survey = Survey.objects.create(
+                    user=request.user,
+                    respondent_name=name,
+                    respondent_email=email,
+                    respondent_phone=phone
                 )
-            )
-            email_thread.start()
-            # print("Email sending temporarily disabled for debugging.")
-            
+                queue_email(*invite_email(request, survey))
+
             return redirect('dashboard')
         return render(request, 'invite.html')
     except Exception as e:
         import traceback
         return HttpResponse(f"<h1>Debug Error</h1><pre>{traceback.format_exc()}</pre>", status=500)
 
+def parse_invite_rows(text):
+    # "Name, email[, phone]" per line (or CSV file contents); a header row is skipped
+    rows, errors = [], []
+    for line_no, row in enumerate(csv.reader(io.StringIO(text)), start=1):
+        cells = [cell.strip() for cell in row]
+        if not any(cells):
+            continue
+        if line_no == 1 and any(cell.lower() == 'email' for cell in cells):
+            continue
+
+        email_cells = [cell for cell in cells if '@' in cell]
+        if not email_cells:
+            errors.append(f"Line {line_no}: no email address")
+            continue
+        email = email_cells[0]
+        others = [cell for cell in cells if cell != email]
+        rows.append({
+            'name': others[0] if others else '',
+            'email': email,
+            'phone': others[1] if len(others) > 1 else '',
+            'line': line_no,
+        })
+    return rows, errors
+
+def create_bulk_invites(request, rows):
+    # Validate + de-duplicate, then create every Survey and queue every email in one transaction
+    errors = []
+    existing = set(
+        email.lower() for email in
+        Survey.objects.filter(user=request.user, respondent_email__isnull=False).values_list('respondent_email', flat=True)
+    )
+    seen = set()
+    surveys = []
+    for index, row in enumerate(rows, start=1):
+        fields = {field: row.get(field) or '' for field in ('name', 'email', 'phone')}
+        not_text = [field for field, value in fields.items() if not isinstance(value, str)]
+        email = fields['email'].strip() if isinstance(fields['email'], str) else ''
+        label = f"Line {row['line']}" if row.get('line') else email or f"Row {index}"
+        if not_text:
+            errors.append(f"{label}: {', '.join(not_text)} must be text")
+            continue
+        try:
+            validate_email(email)
+        except ValidationError:
+            errors.append(f"{label}: invalid email '{email}'")
+            continue
+        if email.lower() in existing or email.lower() in seen:
+            errors.append(f"{label}: {email} has already been invited")
+            continue
+        seen.add(email.lower())
+        surveys.append(Survey(
+            user=request.user,
+            respondent_name=fields['name'].strip() or email.split('@')[0],
+            respondent_email=email,
+            respondent_phone=fields['phone'].strip(),
+        ))
+
+    if len(surveys) > settings.BULK_INVITE_MAX:
+        return [], [f"Too many invitations at once (max {settings.BULK_INVITE_MAX})."]
+
+    with transaction.atomic():
+        Survey.objects.bulk_create(surveys)
+        queue_emails(invite_email(request, survey) for survey in surveys)
+    invalidate(dashboard_scope(request.user.pk))  # bulk_create sends no post_save
+    return surveys, errors
+
+@login_required
+def bulk_invite_view(request):
+    if request.method != 'POST':
+        return render(request, 'bulk_invite.html')
+
+    # JSON API: {"invites": [{"name": ..., "email": ..., "phone": ...}, ...]}
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        invites = data.get('invites') if isinstance(data, dict) else None
+        if not isinstance(invites, list) or not all(isinstance(row, dict) for row in invites):
+            return JsonResponse({'error': '"invites" must be a list of objects'}, status=400)
+        surveys, errors = create_bulk_invites(request, invites)
+        return JsonResponse({
+            'created': [{'uuid': str(s.uuid), 'email': s.respondent_email} for s in surveys],
+            'errors': errors,
+        }, status=201 if surveys else 400)
+
+    # Form: pasted lines and/or an uploaded CSV
+    text = request.POST.get('invites', '')
+    upload = request.FILES.get('csv_file')
+    if upload:
+        text += '\n' + upload.read().decode('utf-8-sig', errors='replace')
+
+    rows, errors = parse_invite_rows(text)
+    surveys, create_errors = create_bulk_invites(request, rows)
+    errors += create_errors
+
+    if not surveys:
+        return render(request, 'bulk_invite.html', {'errors': errors or ["No invitations found."], 'invites': request.POST.get('invites', '')})
+
+    from django.contrib import messages
+    messages.success(request, f"Sent {len(surveys)} invitation{'s' if len(surveys) != 1 else ''}.")
+    if errors:
+        messages.error(request, f"Skipped {len(errors)}: " + "; ".join(errors[:10]))
+    return redirect('dashboard')
+
 @login_required
 def delete_invite_view(request, uuid):
-    survey = get_object_or_404(Survey, uuid=uuid, user=request.user)
+    survey = get_object_or_404(Survey.objects.for_status(), uuid=uuid, user=request.user)
     if request.method == 'POST':
         survey.delete()
     return redirect('dashboard')
@@ -432,20 +529,34 @@ def delete_invite_view(request, uuid):
 # But I am replacing lines 411-431.
 
 @login_required(login_url=None) # Keep or remove based on previous state, but fixing the logic below is key.
+@rate_limit('public_signup', by=('ip', 'link'))
 def public_survey_view(request, uuid):
-    # 1. Find the user who owns this public link
-    profile = get_object_or_404(Profile, public_link_uuid=uuid)
+    # 1. Find the user who owns this public link (one join, none of the profile's text columns)
+    profile = get_object_or_404(
+        Profile.objects.select_related('user').only('id', 'public_link_uuid', 'user__id', 'user__username'),
+        public_link_uuid=uuid,
+    )
     user = profile.user
     
     if request.method == 'POST':
         # 2. Create a new Survey object for this respondent
         name = request.POST.get('name')
-        email = request.POST.get('email')
-        
+        email = (request.POST.get('email') or '').strip()
+
+        # Same person signing up again (refresh, double submit): send them back to their survey.
+        # Only pending public-link signups: a personal invite's link must never be handed to
+        # whoever types that invitee's address in here.
+        existing = Survey.objects.for_status().filter(
+            user=user, source=Survey.SOURCE_PUBLIC_LINK, is_completed=False, respondent_email__iexact=email,
+        ).first() if email else None
+        if existing:
+            return redirect('survey_view', uuid=existing.uuid)
+
         survey = Survey.objects.create(
             user=user,
             respondent_name=name,
             respondent_email=email,
+            source=Survey.SOURCE_PUBLIC_LINK,
             is_completed=False # They still need to fill it out
         )
         
@@ -463,18 +574,23 @@ def landing_view(request):
         return redirect('dashboard')
     return render(request, 'landing.html')
 
+@rate_limit('survey_feedback', by=('ip', 'survey'))
 def survey_feedback_view(request, uuid):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
-            survey = get_object_or_404(Survey, uuid=uuid)
+            survey = get_object_or_404(Survey.objects.for_status(), uuid=uuid)
             
-            # Create or update feedback
-            feedback, created = SurveyFeedback.objects.get_or_create(survey=survey)
-            feedback.sentiment = data.get('sentiment', '')
-            if data.get('comment'):
-                feedback.comment = data.get('comment', '')
-            feedback.save()
+            # Create or update feedback (the stats counters follow via signals)
+            with transaction.atomic():
+                feedback, created = SurveyFeedback.objects.select_for_update().get_or_create(
+                    survey=survey, defaults={'sentiment': data.get('sentiment', ''), 'comment': data.get('comment') or ''},
+                )
+                if not created:
+                    feedback.sentiment = data.get('sentiment', '')
+                    if data.get('comment'):
+                        feedback.comment = data.get('comment', '')
+                    feedback.save()
             
             return JsonResponse({'status': 'success'})
         except Exception as e:
@@ -486,19 +602,97 @@ def stats_view(request):
     if not request.user.is_superuser:
         return redirect('dashboard')
         
-    # Aggregate counts
-    from django.db.models import Count
-    total_feedback = SurveyFeedback.objects.count()
-    
-    # Get counts per sentiment
-    counts = SurveyFeedback.objects.values('sentiment').annotate(count=Count('sentiment'))
-    sentiment_counts = {item['sentiment']: item['count'] for item in counts}
-    
-    # Get recent feedback
-    recent_feedback = SurveyFeedback.objects.order_by('-created_at')[:50]
-    
-    return render(request, 'stats.html', {
-        'total_feedback': total_feedback,
-        'sentiment_counts': sentiment_counts,
-        'recent_feedback': recent_feedback
+    # Whole page cached until the next SurveyFeedback change (see core/fragment_cache.py),
+    # or the next day: the daily chart ends today
+    key = f"stats-page:{timezone.localdate().isoformat()}:{fragment_version(STATS_SCOPE)}"
+    html = cache.get(key)
+    if html is None:
+        # Materialised counters: a few rows however much feedback there is
+        sentiment_counts = sentiment_totals()
+        total_feedback = sum(sentiment_counts.values())
+        daily = daily_series(settings.STATS_DAILY_DAYS)
+
+        # Get recent feedback (with survey and user joined in, see FeedbackPage)
+        recent_feedback = FeedbackPage(size=settings.STATS_RECENT_FEEDBACK).items
+
+        html = render_to_string('stats.html', {
+            'total_feedback': total_feedback,
+            'sentiment_counts': sentiment_counts,
+            'daily': daily,
+            'daily_max': max([row['total'] for row in daily] + [1]),
+            'recent_feedback': recent_feedback
+        }, request)
+        cache.set(key, html, settings.FRAGMENT_CACHE_TIMEOUT)
+    return HttpResponse(html)
+
+
+def parse_time_param(value, name):
+    # ISO 8601 timestamp or date from a query parameter; naive values are in the site timezone
+    if not value:
+        return None
+    parsed = parse_datetime(value) or parse_datetime(f"{value}T00:00:00")
+    if parsed is None:
+        raise ValueError(f"Invalid {name}: expected an ISO 8601 date or timestamp")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def feedback_page_from_request(request, size):
+    # ?since=&until= (created_at range, until exclusive) and ?cursor=; raises ValueError
+    return FeedbackPage(
+        request.GET.get('cursor'), size,
+        since=parse_time_param(request.GET.get('since'), 'since'),
+        until=parse_time_param(request.GET.get('until'), 'until'),
+    )
+
+
+def feedback_row(feedback):
+    return {
+        'id': feedback.pk,
+        'created_at': feedback.created_at.isoformat(),
+        'sentiment': feedback.sentiment,
+        'comment': feedback.comment,
+        'survey': str(feedback.survey.uuid),
+        'relationship': feedback.survey.relationship_type,
+        'user': feedback.survey.user.username,
+    }
+
+
+@login_required
+def feedback_api_view(request):
+    # Admin feedback listing: newest first, keyset pages of ?size= rows
+    if not request.user.is_superuser:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    try:
+        size = int(request.GET.get('size') or settings.FEEDBACK_PAGE_SIZE)
+        if not 1 <= size <= settings.FEEDBACK_PAGE_SIZE_MAX:
+            raise ValueError(f"Invalid size: expected 1 to {settings.FEEDBACK_PAGE_SIZE_MAX}")
+        page = feedback_page_from_request(request, size)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({
+        'results': [feedback_row(feedback) for feedback in page.items],
+        'next_cursor': page.next_cursor,
     })
+
+
+@login_required
+async def feedback_export_view(request):
+    # The whole (or ?since=/?until= filtered) feedback table as NDJSON, one line per row.
+    # Streamed in keyset batches, so memory stays flat however large the table is.
+    user = await request.auser()
+    if not user.is_superuser:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    try:
+        first_page = feedback_page_from_request(request, settings.FEEDBACK_EXPORT_BATCH)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    async def lines():
+        async for batch in first_page.abatches():
+            yield ''.join(json.dumps(feedback_row(feedback)) + '\n' for feedback in batch)
+
+    response = StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename="feedback.ndjson"'
+    return response